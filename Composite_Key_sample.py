@@ -1,5 +1,7 @@
 import pandas as pd
 
+from fallback_join import A_ROW, fallback_join
+
 # Sample data frames with multiple key columns (replace with your actual data)
 # Assume 'key_cols' is the list of key columns
 key_cols = ['key1', 'key2', 'key3', 'key4', 'key5', 'key6']
@@ -28,29 +30,17 @@ key_cols = ['key1', 'key2', 'key3', 'key4', 'key5', 'key6']
 #     'value_b': ['VB1', 'VB2', 'VB3']
 # })
 
-# Step 1: Create a composite key in both DataFrames
-df_a['composite_key'] = df_a[key_cols].astype(str).agg('_'.join, axis=1)
-df_b['composite_key'] = df_b[key_cols].astype(str).agg('_'.join, axis=1)
-
-# Step 2: Perform the initial left join on the composite key
-result_df = df_a.merge(df_b, how='left', on='composite_key', suffixes=('_a', '_b'))
-
-# Step 3: Identify unmatched records in df_b after the initial join
-df_b_matched = df_b.merge(df_a[['composite_key']], on='composite_key', how='left', indicator=True)
-df_b_unmatched = df_b_matched[df_b_matched['_merge'] == 'left_only'].drop(columns=['_merge'])
-
-# Step 4: For unmatched df_b records, remove one key column (e.g., 'key6') from the composite key
-# Re-create composite keys without 'key6'
+# Steps 1-5: Factorize the key columns into integer codes once, left join on the full key,
+# then retry unmatched df_b records on the key without 'key6' to get 'a', 'b', 'c'
 reduced_key_cols = key_cols[:-1]  # Remove 'key6' from the list
-df_a['reduced_key'] = df_a[reduced_key_cols].astype(str).agg('_'.join, axis=1)
-df_b_unmatched['reduced_key'] = df_b_unmatched[reduced_key_cols].astype(str).agg('_'.join, axis=1)
+joined = fallback_join(df_a, df_b, key_levels=[key_cols, reduced_key_cols], attrs=['a', 'b', 'c'])
+result_df = joined.matched
 
-# Step 5: Merge unmatched df_b records with df_a on 'reduced_key' to get 'a', 'b', 'c'
-df_a_subset = df_a[reduced_key_cols + ['a', 'b', 'c', 'reduced_key']].drop_duplicates(subset='reduced_key')
-df_b_unmatched = df_b_unmatched.merge(df_a_subset, on='reduced_key', how='left')
+# Unmatched df_b records: fallback matches carry 'a', 'b', 'c'; records without any match keep NaN
+df_b_unmatched = pd.concat([joined.fallback.drop(columns=[A_ROW]), joined.unmatched], ignore_index=True)
 
-# Step 6: Output df_a's all columns and 'a', 'b', 'c' for unmatched records
-df_a_unmatched = df_a[df_a['reduced_key'].isin(df_b_unmatched['reduced_key'])].drop_duplicates(subset='reduced_key')
+# Step 6: Output df_a's all columns for unmatched records (one row per reduced key)
+df_a_unmatched = df_a.iloc[joined.fallback[A_ROW].unique()]
 
 # Display the results
 print("Result after initial left join on composite key:")
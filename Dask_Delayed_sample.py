@@ -1,81 +1,39 @@
-import os
-import glob
-import pandas as pd
-import dask
-from dask import delayed
-import dask.dataframe as dd
+from csv_extract import extract_csv_data as _extract_csv_data
 
-def extract_csv_data(root_path, domain, model_name, model_version_folder_filter, required_columns):
+
+def extract_csv_data(root_path, domain, model_name, model_version_folder_filter, required_columns, catalog=None,
+                     cache=None, return_report=False, backend='dask', max_workers=None):
     """
     Extracts data from CSV files in parallel using Dask Delayed.
 
+    Thin wrapper over csv_extract.extract_csv_data, which shares file discovery, type coercion
+    and the output contract with the serial / thread / process backends.
+
     Parameters:
     - root_path (str): The root directory path where data is stored.
     - domain (str): The domain value (e.g., 'Domain1').
     - model_name (str): The model name (e.g., 'model_a').
     - model_version_folder_filter (str): 'all' or a specific model version folder name (e.g., 'model_version1').
     - required_columns (dict): A mapping of column names to their data types.
+    - catalog (FileCatalog, optional): A persistent file index built with
+      FileCatalog(os.path.join(root_path, domain, model_name), subdir=None, pattern='raw_data*.csv').
+      When given, files are looked up in the index instead of globbing the tree.
+    - cache (ParquetCache, optional): Opt-in columnar sidecar cache. Each processed file is stored
+      as a typed Parquet/Feather copy keyed by path, size, mtime and required_columns, and later
+      runs load that copy instead of parsing the CSV again.
+    - return_report (bool): Also return a report with per-column coercion failure counts
+      and, per missing column, the number of files that lacked it.
+    - backend (str): 'dask' (default; uses a connected dask.distributed Client if there is one),
+      'serial', 'threads', 'processes' or 'auto'.
+    - max_workers (int, optional): Pool size for the 'threads' / 'processes' backends.
 
     Returns:
-    - pandas.DataFrame: The concatenated data from the CSV files.
+    - pandas.DataFrame: The concatenated data from the CSV files
+      (or a (DataFrame, report) tuple when return_report is True).
     """
-    # Construct the path pattern to search for files
-    version_pattern = '*' if model_version_folder_filter == 'all' else model_version_folder_filter
-
-    search_pattern = os.path.join(
-        root_path,
-        domain,
-        model_name,
-        version_pattern,
-        '*',  # Date folders
-        'raw_data*.csv'
-    )
-
-    # Get list of files matching the pattern
-    files = glob.glob(search_pattern, recursive=True)
-
-    if not files:
-        return pd.DataFrame(columns=required_columns.keys())
-
-    # Define a function to read and process a single file
-    def read_and_process(file):
-        try:
-            df = pd.read_csv(file, dtype=str)
-            # Ensure required columns are present
-            for col, dtype in required_columns.items():
-                if col not in df.columns:
-                    default_value = {
-                        'int': -9999,
-                        'float': -9999.0,
-                        'date': pd.Timestamp('1900-01-01'),
-                        'string': ''
-                    }.get(dtype, '')
-                    df[col] = default_value
-                else:
-                    # Convert column to the specified data type
-                    if dtype == 'int':
-                        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-9999).astype('Int64')
-                    elif dtype == 'float':
-                        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-9999.0)
-                    elif dtype == 'date':
-                        df[col] = pd.to_datetime(df[col], errors='coerce').fillna(pd.Timestamp('1900-01-01'))
-                    else:
-                        df[col] = df[col].astype(str)
-            # Reorder columns
-            df = df[list(required_columns.keys())]
-            return df
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
-            return pd.DataFrame(columns=required_columns.keys())
-
-    # Create delayed tasks for each file
-    delayed_dfs = [delayed(read_and_process)(file) for file in files]
-
-    # Compute all tasks in parallel and concatenate results
-    dfs = dask.compute(*delayed_dfs)
-    final_df = pd.concat(dfs, ignore_index=True)
-
-    return final_df
+    return _extract_csv_data(root_path, domain, model_name, model_version_folder_filter, required_columns,
+                             catalog=catalog, cache=cache, return_report=return_report,
+                             backend=backend, max_workers=max_workers)
 
 # Example usage:
 root_path = '/path/to/data'
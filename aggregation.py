@@ -0,0 +1,253 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from chunked_reader import DEFAULT_BLOCK_SIZE, open_csv_stream, types_declared
+from predicates import Filter, filter_batches, read_columns, to_expression
+from scheduler import plan_tasks
+from schema_cache import SchemaCache, default_schema_cache, sniff_header
+from stream_reader import read_csv_table
+
+logger = logging.getLogger(__name__)
+
+# Constants
+AGG_FUNCS = ("sum", "count", "min", "max", "mean", "approx_distinct")
+COUNT_ALL = "*"               # ("*", "count") 统计行数（含空值）
+HLL_PRECISION = 12            # 2^12 个寄存器，标准误差约 1.04 / sqrt(4096) ≈ 1.6%
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_REG = "__hll_reg"
+_RANK = "__hll_rank"
+DEFAULT_FANOUT = 8            # 树形归约：每积累 fanout 个部分结果合并一次
+
+Agg = Tuple[str, str]         # (列名, 聚合函数)，与 pyarrow Table.group_by().aggregate 的写法一致
+Partial = Dict[str, pa.Table]  # {"main": 数值状态表, "hll:<列>": 稀疏 HLL 寄存器表}
+
+
+def _state_aggs(aggs: Sequence[Agg]) -> List[Agg]:
+    """把用户聚合拆成可合并的部分状态：mean -> sum + count；approx_distinct 单独走 HLL"""
+    states: List[Agg] = []
+    for col, func in aggs:
+        if func not in AGG_FUNCS:
+            raise ValueError(f"Unsupported aggregation: {func} (expected one of {AGG_FUNCS})")
+        if func == "approx_distinct":
+            continue
+        parts = [(col, "sum"), (col, "count")] if func == "mean" else [(col, func)]
+        for part in parts:
+            if part not in states:
+                states.append(part)
+    return states
+
+
+def _state_name(col: str, func: str) -> str:
+    return "count" if col == COUNT_ALL else f"{col}_{func}"
+
+
+def _hll_registers(values: pa.ChunkedArray) -> Tuple[np.ndarray, np.ndarray]:
+    """每个非空值的 (寄存器号, 秩)：哈希高 p 位选寄存器，其余位的前导零个数 + 1 为秩"""
+    hashes = pd.util.hash_array(values.to_numpy())
+    registers = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.uint16)
+    rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+    # rest 不超过 52 位，转 float64 无损；frexp 的指数即有效位数
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    ranks = (64 - HLL_PRECISION - bit_length + 1).astype(np.uint8)
+    return registers, ranks
+
+
+def partial_aggregate(table: pa.Table, keys: List[str], aggs: Sequence[Agg]) -> Partial:
+    """在一张表（或一个块）上计算可合并的部分聚合状态"""
+    states = _state_aggs(aggs)
+    arrow_aggs = [([], "count_all") if col == COUNT_ALL else (col, func) for col, func in states]
+    main = table.group_by(keys, use_threads=False).aggregate(arrow_aggs)
+    partial = {"main": _select_states(main, keys, states, {"count_all": "count"})}
+    for col in {col for col, func in aggs if func == "approx_distinct"}:
+        valid = table.filter(pc.is_valid(table.column(col)))
+        registers, ranks = _hll_registers(valid.column(col))
+        hll = valid.select(keys).append_column(_REG, pa.array(registers)).append_column(_RANK, pa.array(ranks))
+        partial[f"hll:{col}"] = hll.group_by(keys + [_REG], use_threads=False).aggregate([(_RANK, "max")]) \
+            .rename_columns(keys + [_REG, _RANK])
+    return partial
+
+
+def _select_states(table: pa.Table, keys: List[str], states: List[Agg], renames: Dict[str, str]) -> pa.Table:
+    """group_by 的输出列名为 <列>_<函数>；按 renames 改回状态列名，并按 keys + 状态列排列"""
+    table = table.rename_columns([renames.get(name, name) for name in table.column_names])
+    return table.select(keys + [_state_name(c, f) for c, f in states])
+
+
+def merge_partials(partials: Iterable[Partial], keys: List[str], aggs: Sequence[Agg]) -> Partial:
+    """合并多个部分状态：sum/count 求和，min/max 取极值，HLL 寄存器取最大秩"""
+    partials = [p for p in partials if p is not None]
+    if len(partials) == 1:
+        return partials[0]
+    states = _state_aggs(aggs)
+    merge_func = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+    main = pa.concat_tables([p["main"] for p in partials], promote_options="permissive")
+    merged = main.group_by(keys, use_threads=False).aggregate(
+        [(_state_name(c, f), merge_func[f]) for c, f in states]
+    )
+    renames = {f"{_state_name(c, f)}_{merge_func[f]}": _state_name(c, f) for c, f in states}
+    result = {"main": _select_states(merged, keys, states, renames)}
+    for name in partials[0]:
+        if name.startswith("hll:"):
+            hll = pa.concat_tables([p[name] for p in partials], promote_options="permissive")
+            result[name] = hll.group_by(keys + [_REG], use_threads=False).aggregate([(_RANK, "max")]) \
+                .rename_columns(keys + [_REG, _RANK])
+    return result
+
+
+def tree_reduce(
+    partials: Iterable[Partial],
+    keys: List[str],
+    aggs: Sequence[Agg],
+    fanout: int = DEFAULT_FANOUT
+) -> Optional[Partial]:
+    """
+    按到达顺序做树形归约：每层积累 fanout 个部分结果后合并进上一层
+    任一时刻只保留 O(fanout * log(n)) 个部分结果，每次合并的输入规模与分组数成正比
+    """
+    levels: List[List[Partial]] = []
+    for partial in partials:
+        level = 0
+        while True:
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(partial)
+            if len(levels[level]) < fanout:
+                break
+            partial = merge_partials(levels[level], keys, aggs)
+            levels[level] = []
+            level += 1
+    remaining = [p for level in levels for p in level]
+    return merge_partials(remaining, keys, aggs) if remaining else None
+
+
+def _hll_estimate(hll: pa.Table, keys: List[str]) -> pd.DataFrame:
+    """HyperLogLog 估计；空寄存器较多时改用线性计数"""
+    inv = pc.power(2.0, pc.negate(pc.cast(hll.column(_RANK), pa.float64())))
+    sums = hll.append_column("_inv", inv).group_by(keys, use_threads=False).aggregate(
+        [("_inv", "sum"), (_REG, "count")]
+    ).to_pandas()
+    zeros = HLL_REGISTERS - sums[f"{_REG}_count"].to_numpy()
+    estimate = _HLL_ALPHA * HLL_REGISTERS ** 2 / (sums["_inv_sum"].to_numpy() + zeros)
+    small = (estimate <= 2.5 * HLL_REGISTERS) & (zeros > 0)
+    with np.errstate(divide="ignore"):
+        linear = HLL_REGISTERS * np.log(HLL_REGISTERS / np.maximum(zeros, 1))
+    sums["estimate"] = np.round(np.where(small, linear, estimate)).astype(np.int64)
+    return sums[keys + ["estimate"]]
+
+
+def finalize(partial: Optional[Partial], keys: List[str], aggs: Sequence[Agg]) -> pd.DataFrame:
+    """把部分状态转换为最终结果：每个分组一行，列为 keys + <列>_<函数>"""
+    columns = keys + [_state_name(c, f) for c, f in aggs]
+    if partial is None:
+        return pd.DataFrame(columns=columns)
+    main = partial["main"].to_pandas()
+    for col, func in aggs:
+        name = _state_name(col, func)
+        if func == "mean":
+            main[name] = main[f"{col}_sum"] / main[f"{col}_count"].replace(0, np.nan)
+        elif func == "approx_distinct":
+            # merge 会把 NaN 键互相匹配，与 group_by 中空值单独成组一致
+            estimate = _hll_estimate(partial[f"hll:{col}"], keys).rename(columns={"estimate": name})
+            main = main.merge(estimate, on=keys, how="left")
+            main[name] = main[name].fillna(0).astype(np.int64)
+    return main[columns]
+
+
+def aggregate_batch(
+    file_paths: List[str],
+    keys: List[str],
+    aggs: Sequence[Agg],
+    column_types: Dict[str, str],
+    expr: Optional[pc.Expression] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    fanout: int = DEFAULT_FANOUT
+) -> Tuple[Optional[Partial], Dict[str, str]]:
+    """
+    进程池 worker：逐块读取一批文件并计算部分聚合，只把分组级别的状态传回父进程
+    :return: (部分状态 或 None, {失败文件: 错误信息})
+    """
+    columns = list(dict.fromkeys(keys + [c for c, _ in aggs if c != COUNT_ALL]))
+    errors = {}
+
+    def partials():
+        for file_path in file_paths:
+            try:
+                header = sniff_header(file_path) or []
+                if types_declared(header, columns, column_types, expr):
+                    reader = open_csv_stream(file_path, columns, column_types, block_size,
+                                             header=header, expr=expr)
+                else:
+                    # 有未声明类型的列：整文件推断类型，避免按首块推断的类型在后续块上解析失败
+                    reader = read_csv_table(file_path, read_columns(columns, expr, header),
+                                            column_types).to_batches()
+                blocks = (partial_aggregate(pa.Table.from_batches([batch]), keys, aggs)
+                          for batch in filter_batches(reader, expr, columns))
+                # 先归约完整个文件再产出：中途失败的文件不会贡献部分数据
+                file_partial = tree_reduce(blocks, keys, aggs, fanout)
+            except Exception as e:
+                errors[file_path] = f"{type(e).__name__}: {e}"
+                continue
+            if file_partial is not None:
+                yield file_partial
+
+    return tree_reduce(partials(), keys, aggs, fanout), errors
+
+
+def aggregate_files(
+    file_paths: Iterable[str],
+    keys: List[str],
+    aggs: Sequence[Agg],
+    column_types: Dict[str, str],
+    max_workers: Optional[int] = None,
+    filters: Optional[Filter] = None,
+    schema_cache: Optional[SchemaCache] = None,
+    fanout: int = DEFAULT_FANOUT
+) -> pd.DataFrame:
+    """
+    Map-reduce 分组聚合：worker 按文件/块计算部分聚合状态，父进程按完成顺序树形归约
+    传输量与内存占用与分组数成正比，而不是与行数成正比
+    :param keys: 分组键，例如 ['user_id', 'date']
+    :param aggs: [(列, 函数)]，函数为 sum / count / min / max / mean / approx_distinct；
+                 ('*', 'count') 统计行数
+    :param column_types: 读取时的列类型（同 read_table），键和聚合列类型需在各文件间一致
+    :param filters: 行谓词，在 worker 内聚合前求值
+    :return: 每个分组一行的 DataFrame，列为 keys + <列>_<函数>
+    """
+    _state_aggs(aggs)  # 尽早校验聚合函数
+    expr = to_expression(filters)
+    cache = schema_cache or default_schema_cache()
+    required = set(keys) | {c for c, _ in aggs if c != COUNT_ALL}
+    valid_paths = [p for p in file_paths if cache.has_columns(p, required)]
+    if not valid_paths:
+        return finalize(None, keys, aggs)
+
+    pool_size = max_workers or os.cpu_count() or 1
+    large, batches = plan_tasks(valid_paths, min_tasks=pool_size * 4)
+    tasks = [[p] for p, _ in large] + [[p for p, _ in batch] for batch in batches]
+    logger.info(f"Aggregating {len(valid_paths)} files in {len(tasks)} tasks by {keys} with {pool_size} workers")
+
+    def partials(executor):
+        futures = {executor.submit(aggregate_batch, paths, keys, aggs, column_types, expr): paths
+                   for paths in tasks}
+        for future in as_completed(futures):
+            try:
+                partial, errors = future.result()
+            except Exception as e:
+                logger.error(f"Failed aggregating {len(futures[future])} files starting at {futures[future][0]}: {e}")
+                continue
+            for file_path, error in errors.items():
+                logger.error(f"Failed aggregating {file_path}: {error}")
+            if partial is not None:
+                yield partial
+
+    with ProcessPoolExecutor(max_workers=min(pool_size, len(tasks))) as executor:
+        merged = tree_reduce(partials(executor), keys, aggs, fanout)
+    return finalize(merged, keys, aggs)
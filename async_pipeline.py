@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import pyarrow as pa
+
+from compressed import CSV_PATTERNS, matches
+from file_catalog import FileCatalog
+from instrumentation import PipelineMetrics
+from predicates import Filter, to_expression
+from scheduler import LARGE_FILE_BYTES, TASK_TARGET_BYTES
+from schema_cache import SchemaCache, default_schema_cache
+from stream_reader import default_spill_dir, load_ipc, read_csv_batch_ipc
+
+logger = logging.getLogger(__name__)
+
+# Constants
+REGION = "region"
+DEFAULT_IO_CONCURRENCY = 32           # 同时进行的目录列举 / stat / 表头嗅探 / 预取数
+DEFAULT_PREFETCH_BYTES = 4 * 1024 ** 2  # 不支持 posix_fadvise 时预读的字节数；0 表示不预取
+MAX_FILES_PER_TASK = 64               # 检查通过的文件积压时，单个解析任务最多打包的文件数
+QUEUE_FACTOR = 4                      # 各级队列长度 = worker 数 * QUEUE_FACTOR
+
+_DONE = object()
+
+
+def _list_dir(path: Path, pattern: Union[str, Tuple[str, ...]]) -> List[str]:
+    try:
+        with os.scandir(path) as entries:
+            return sorted(e.path for e in entries if e.is_file() and matches(e.name, pattern))
+    except OSError:
+        return []
+
+
+def _prefetch(path: str, size: int, nbytes: int):
+    """提示内核/网络文件系统客户端预读文件，使 worker 打开文件时数据已在页缓存中"""
+    if nbytes <= 0:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            os.read(fd, min(size, nbytes))
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _inspect(path: str, required: Set[str], cache: SchemaCache, prefetch_bytes: int) -> Optional[int]:
+    """stat + 表头检查 + 预取；文件缺少必需列或不可读时返回 None，否则返回文件大小"""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if not cache.has_columns(path, required):
+        return None
+    _prefetch(path, size, prefetch_bytes)
+    return size
+
+
+async def aiter_tables(
+    main_folder: Path,
+    versions: List[str],
+    dates: List[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: Optional[int] = None,
+    catalog: Optional[FileCatalog] = None,
+    subdir: str = REGION,
+    pattern: Union[str, Tuple[str, ...]] = CSV_PATTERNS,
+    io_concurrency: int = DEFAULT_IO_CONCURRENCY,
+    prefetch_bytes: int = DEFAULT_PREFETCH_BYTES,
+    schema_cache: Optional[SchemaCache] = None,
+    spill_dir: Optional[str] = None,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None
+) -> AsyncIterator[Tuple[str, pa.Table]]:
+    """
+    发现、检查、解析三级流水线，按完成顺序产出 (源文件路径, Arrow Table)
+    - 发现：各 <version>/<date>/<subdir> 目录并发列举（提供 catalog 时改为查询索引）
+    - 检查：stat + 表头嗅探 + 预取在线程中并发执行，并发数受 io_concurrency 限制
+    - 解析：检查通过的文件经队列送入进程池；队列积压时把多个小文件打包成一个任务
+    各级之间是有界队列，下游变慢时上游自动等待；第一批结果在目录树遍历完成之前就可能产出
+    """
+    expr = to_expression(filters)
+    cache = schema_cache or default_schema_cache()
+    required = set(columns_list or ())
+    spill_dir = spill_dir or default_spill_dir()
+    workers = max_workers or os.cpu_count() or 1
+    io_sem = asyncio.Semaphore(io_concurrency)
+    parse_sem = asyncio.Semaphore(workers * 2)
+    paths_q: asyncio.Queue = asyncio.Queue(maxsize=io_concurrency * QUEUE_FACTOR)
+    checked_q: asyncio.Queue = asyncio.Queue(maxsize=workers * QUEUE_FACTOR)
+    results_q: asyncio.Queue = asyncio.Queue(maxsize=workers * QUEUE_FACTOR)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    unconsumed: Set[Future] = set()
+    started = time.perf_counter()
+
+    async def list_one(path: Path):
+        async with io_sem:
+            files = await asyncio.to_thread(_list_dir, path, pattern)
+        for file in files:
+            await paths_q.put(file)
+
+    async def discover():
+        try:
+            if catalog is not None:
+                files = await asyncio.to_thread(catalog.find_files, versions, dates)
+                for file in files:
+                    await paths_q.put(str(file))
+            else:
+                await asyncio.gather(*(list_one(Path(main_folder) / v / d / subdir)
+                                       for v in versions for d in dates))
+        finally:
+            for _ in range(io_concurrency):
+                await paths_q.put(_DONE)
+
+    async def check():
+        while (path := await paths_q.get()) is not _DONE:
+            if metrics is not None:
+                metrics.count("files_scanned")
+            async with io_sem:
+                size = await asyncio.to_thread(_inspect, path, required, cache, prefetch_bytes)
+            if size is None:
+                if metrics is not None:
+                    metrics.record_file(path, {}, "skipped", "missing required columns")
+                continue
+            await checked_q.put((path, size))
+
+    async def check_all():
+        try:
+            await asyncio.gather(*(check() for _ in range(io_concurrency)))
+        finally:
+            await checked_q.put(_DONE)
+
+    async def collect(future: Future, paths: List[str], submitted: float):
+        try:
+            try:
+                results = await asyncio.wrap_future(future)
+            except Exception as e:
+                logger.error(f"Failed processing {len(paths)} files starting at {paths[0]}: {e}")
+                return
+            if metrics is not None and results:
+                metrics.record_task({"pid": results[0][3]["pid"], "started": results[0][3]["started"],
+                                     "finished": results[-1][3]["finished"],
+                                     "rss_mb": max(r[3]["rss_mb"] or 0 for r in results)}, submitted)
+            for file_path, ipc_path, error, stats in results:
+                if error is not None:
+                    logger.error(f"Failed processing {file_path}: {error}")
+                    if metrics is not None:
+                        metrics.record_file(file_path, stats, "failed", error)
+                    continue
+                table = await asyncio.to_thread(load_ipc, ipc_path)
+                if metrics is not None:
+                    metrics.record_file(file_path, dict(stats, rows=table.num_rows), "ok")
+                await results_q.put((file_path, table))
+            # 全部加载后才移出：中途取消时剩余的 IPC 文件由外层清理（已加载的已被 load_ipc 删除）
+            unconsumed.discard(future)
+        finally:
+            parse_sem.release()
+
+    async def dispatch():
+        collectors = []
+        loop = asyncio.get_running_loop()
+        try:
+            done = False
+            while not done:
+                item = await checked_q.get()
+                if item is _DONE:
+                    break
+                batch, batch_bytes = [item], item[1]
+                # 只打包已经在队列中的文件，不为凑批而等待
+                while (item[1] < LARGE_FILE_BYTES and batch_bytes < TASK_TARGET_BYTES
+                       and len(batch) < MAX_FILES_PER_TASK and not checked_q.empty()):
+                    nxt = checked_q.get_nowait()
+                    if nxt is _DONE:
+                        done = True
+                        break
+                    batch.append(nxt)
+                    batch_bytes += nxt[1]
+                paths = [p for p, _ in batch]
+                is_large = len(batch) == 1 and batch_bytes >= LARGE_FILE_BYTES
+                await parse_sem.acquire()
+                future = executor.submit(read_csv_batch_ipc, paths, columns_list, column_types,
+                                         spill_dir, is_large, expr, metrics.profile if metrics else None)
+                unconsumed.add(future)
+                collectors.append(loop.create_task(collect(future, paths, time.time())))
+            await asyncio.gather(*collectors)
+        finally:
+            for task in collectors:
+                task.cancel()
+            await results_q.put(_DONE)
+
+    tasks = [asyncio.create_task(coro) for coro in (discover(), check_all(), dispatch())]
+    first = True
+    try:
+        while (item := await results_q.get()) is not _DONE:
+            if first:
+                first = False
+                elapsed = time.perf_counter() - started
+                logger.info(f"First batch after {elapsed:.2f}s")
+                if metrics is not None:
+                    metrics.add_stage_time("time_to_first_batch", elapsed)
+            yield item
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+        # 调用方提前停止时清理已写出但未加载的结果
+        for future in unconsumed:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                for _, ipc_path, _, _ in future.result():
+                    if ipc_path is not None:
+                        try:
+                            os.unlink(ipc_path)
+                        except OSError:
+                            pass
+
+
+def iter_tables(*args, buffer: int = 2, **kwargs) -> Iterator[Tuple[str, pa.Table]]:
+    """
+    aiter_tables 的同步版本：事件循环运行在后台线程中，调用方处理当前结果时
+    发现/检查/解析仍在继续；参数同 aiter_tables
+    :param buffer: 已完成但尚未被调用方取走的结果数上限
+    """
+    results: queue.Queue = queue.Queue(maxsize=max(1, buffer))
+    stop = threading.Event()
+
+    def offer(item) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def pump():
+        agen = aiter_tables(*args, **kwargs)
+        try:
+            async for item in agen:
+                if not await asyncio.to_thread(offer, item):
+                    break
+        finally:
+            await agen.aclose()
+
+    def run():
+        try:
+            asyncio.run(pump())
+            offer(_DONE)
+        except BaseException as e:
+            offer(e)
+
+    thread = threading.Thread(target=run, name="async-pipeline", daemon=True)
+    thread.start()
+    try:
+        while (item := results.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_table(*args, **kwargs) -> Optional[pa.Table]:
+    """流水线读取全部文件并合并为一个 Arrow Table；参数同 aiter_tables，没有结果时返回 None"""
+    tables = [table for _, table in iter_tables(*args, **kwargs)]
+    if not tables:
+        return None
+    return pa.concat_tables(tables, promote_options="permissive")
@@ -0,0 +1,397 @@
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from coercion import ARROW_TYPES, DEFAULT_VALUES, CoercionPlan
+from compressed import CSV_PATTERNS, compress_file, compression_of, open_input
+
+logger = logging.getLogger(__name__)
+
+# Constants
+REGION = "region"
+REQUIRED_COLUMNS = {
+    'user_id': 'string',
+    'price': 'float',
+    'quantity': 'int',
+    'event_date': 'date',
+}
+DEFAULT_TOLERANCE = 0.2  # 相对基线变慢/内存增加超过 20% 视为回归
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "zstd-seekable": ".zst"}
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+# ---------------------------------------------------------------------------
+
+def generate_tree(
+    root: Path,
+    versions: int = 2,
+    dates: int = 3,
+    files_per_dir: int = 10,
+    rows_mean: int = 20_000,
+    size_dist: str = "lognormal",
+    width: int = 8,
+    missing_ratio: float = 0.1,
+    malformed_ratio: float = 0.02,
+    bad_value_ratio: float = 0.001,
+    seed: int = 0
+) -> Dict[str, object]:
+    """
+    生成 <root>/<version>/<date>/region/raw_data_*.csv 目录树
+    :param size_dist: 'uniform'（每个文件 rows_mean 行）或 'lognormal'（长尾分布，少数大文件）
+    :param width: REQUIRED_COLUMNS 之外额外的数值列数
+    :param missing_ratio: 缺少某个必需列的文件比例
+    :param malformed_ratio: 结构损坏（某行字段数不对）的文件比例
+    :param bad_value_ratio: 数值/日期列中无法解析的单元格比例
+    :return: 生成参数及文件数、总字节数
+    """
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    total_bytes = 0
+    n_files = 0
+    base_date = np.datetime64("2023-01-01")
+    for v in range(versions):
+        for d in range(dates):
+            out_dir = root / f"v{v + 1}" / str(base_date + d) / REGION
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for f in range(files_per_dir):
+                if size_dist == "uniform":
+                    n = rows_mean
+                else:
+                    n = max(1, int(rng.lognormal(np.log(rows_mean) - 0.5, 1.0)))
+                df = pd.DataFrame({
+                    'user_id': np.char.add("u", rng.integers(0, 100_000, n).astype(str)),
+                    'price': rng.random(n).round(4) * 100,
+                    'quantity': rng.integers(0, 1000, n).astype(str),
+                    'event_date': (base_date + rng.integers(0, 365, n)).astype(str),
+                })
+                for c in range(width):
+                    df[f'x{c}'] = rng.random(n).round(6)
+                bad = rng.random(n) < bad_value_ratio
+                df.loc[bad, 'quantity'] = 'n/a?'
+                df.loc[rng.random(n) < bad_value_ratio, 'event_date'] = 'not-a-date'
+                if rng.random() < missing_ratio:
+                    df = df.drop(columns=[rng.choice(['price', 'quantity', 'event_date'])])
+                path = out_dir / f"raw_data_{f:04d}.csv"
+                df.to_csv(path, index=False)
+                if rng.random() < malformed_ratio:
+                    with open(path, "a") as fh:
+                        fh.write("broken,row\n")
+                total_bytes += path.stat().st_size
+                n_files += 1
+    params = dict(versions=versions, dates=dates, files_per_dir=files_per_dir, rows_mean=rows_mean,
+                  size_dist=size_dist, width=width, missing_ratio=missing_ratio,
+                  malformed_ratio=malformed_ratio, bad_value_ratio=bad_value_ratio, seed=seed)
+    return dict(params, files=n_files, bytes=total_bytes)
+
+
+def list_files(root: Path) -> List[str]:
+    return sorted(f for pattern in CSV_PATTERNS for f in glob.glob(os.path.join(str(root), "*", "*", REGION, pattern)))
+
+
+def compress_tree(src_root: Path, dst_root: Path, codec: str) -> Dict[str, object]:
+    """把未压缩的目录树压缩成同样布局的 .csv.gz / .csv.zst 目录树（内容与原树一致，便于对比吞吐）"""
+    total_bytes = 0
+    files = list_files(src_root)
+    for f in files:
+        dst = Path(dst_root) / Path(f).relative_to(src_root)
+        dst = dst.with_name(dst.name + CODEC_SUFFIXES[codec])
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        compress_file(f, dst, codec)
+        total_bytes += dst.stat().st_size
+    return {"codec": codec, "files": len(files), "bytes": total_bytes}
+
+
+# ---------------------------------------------------------------------------
+# 各读取方式（在独立子进程中运行，返回读取的行数）
+# ---------------------------------------------------------------------------
+
+def _legacy_read_and_process(file: str, required_columns: Dict[str, str]) -> pd.DataFrame:
+    """dask_read_multi_files.txt 中的逐文件 pandas 处理逻辑（pd.read_csv(file, dtype=str) 后逐列转换）"""
+    try:
+        # 压缩文件经 Arrow 流式解压后交给 pandas（pandas 直接读 .zst 需要额外的 zstandard 包）
+        with open_input(file) if compression_of(file) is not None else nullcontext(file) as source:
+            df = pd.read_csv(source, dtype=str)
+    except Exception as e:
+        logger.debug(f"Error reading {file}: {e}")
+        return pd.DataFrame(columns=list(required_columns))
+    for col, dtype in required_columns.items():
+        if col not in df.columns:
+            df[col] = DEFAULT_VALUES[dtype]
+        elif dtype == 'int':
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-9999).astype('Int64')
+        elif dtype == 'float':
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(-9999.0)
+        elif dtype == 'date':
+            df[col] = pd.to_datetime(df[col], errors='coerce').fillna(pd.Timestamp('1900-01-01'))
+        else:
+            df[col] = df[col].astype(str)
+    return df[list(required_columns)]
+
+
+def _plan_read(file: str, plan: CoercionPlan) -> int:
+    try:
+        table, _ = plan.read_csv(file, use_threads=False)
+    except Exception as e:
+        logger.debug(f"Error reading {file}: {e}")
+        return 0
+    return len(plan.to_pandas(table))
+
+
+def _typed_readers_types() -> Dict[str, pa.DataType]:
+    """
+    stream_reader 系列按类型严格解析，出现不可解析的值时整个文件报错，
+    推断出的类型在文件间不一致时也无法拼接；含脏数据的 int/date 列按字符串读取
+    """
+    return {c: ARROW_TYPES[t] if t == 'float' else pa.string() for c, t in REQUIRED_COLUMNS.items()}
+
+
+def backend_pyarrow_serial(files: List[str]) -> int:
+    dfs = [_legacy_read_and_process(f, REQUIRED_COLUMNS) for f in files]
+    return len(pd.concat(dfs, ignore_index=True))
+
+
+def backend_pool(files: List[str]) -> int:
+    from multiprocessing import Pool, cpu_count
+    with Pool(cpu_count()) as pool:
+        dfs = pool.starmap(_legacy_read_and_process, [(f, REQUIRED_COLUMNS) for f in files])
+    return len(pd.concat(dfs, ignore_index=True))
+
+
+def backend_dask_delayed(files: List[str]) -> int:
+    import dask
+    from dask import delayed
+    dfs = dask.compute(*[delayed(_legacy_read_and_process)(f, REQUIRED_COLUMNS) for f in files])
+    return len(pd.concat(dfs, ignore_index=True))
+
+
+def backend_dask_bag(files: List[str]) -> int:
+    import dask.bag as db
+    from multiprocessing import cpu_count
+    dfs = db.from_sequence(files, npartitions=cpu_count()).map(_legacy_read_and_process, REQUIRED_COLUMNS).compute()
+    return len(pd.concat(dfs, ignore_index=True))
+
+
+def backend_coercion_plan(files: List[str]) -> int:
+    plan = CoercionPlan(REQUIRED_COLUMNS)
+    return sum(_plan_read(f, plan) for f in files)
+
+
+def backend_read_table(files: List[str]) -> int:
+    from stream_reader import read_table
+    column_types = _typed_readers_types()
+    table = read_table(files, list(REQUIRED_COLUMNS), column_types)
+    return 0 if table is None else len(table.to_pandas(self_destruct=True))
+
+
+def backend_parallel_read(files: List[str]) -> int:
+    parallel_read = importlib.import_module("process_multi_files").parallel_read
+    column_types = _typed_readers_types()
+    df = parallel_read(files, list(REQUIRED_COLUMNS), column_types)
+    return 0 if df is None else len(df)
+
+
+def backend_csv_processor(files: List[str]) -> int:
+    from file_catalog import FileCatalog
+    processor_cls = importlib.import_module("multi_files_v2").CSVProcessor
+    root = Path(files[0]).parents[3]
+    catalog = FileCatalog(root, db_path=Path(tempfile.mkdtemp()) / "catalog.sqlite3")
+    column_types = _typed_readers_types()
+    df = processor_cls(column_types, list(REQUIRED_COLUMNS), catalog=catalog).process(["*"], ["*"])
+    return len(df)
+
+
+BACKENDS: Dict[str, Callable[[List[str]], int]] = {
+    "pyarrow_serial": backend_pyarrow_serial,
+    "pool": backend_pool,
+    "dask_delayed": backend_dask_delayed,
+    "dask_bag": backend_dask_bag,
+    "coercion_plan": backend_coercion_plan,
+    "read_table": backend_read_table,
+    "parallel_read": backend_parallel_read,
+    "csv_processor": backend_csv_processor,
+}
+
+
+def _peak_rss_mb() -> tuple:
+    """(本进程峰值 RSS, 最大子进程峰值 RSS)，单位 MB；不支持 resource 模块的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1024 if sys.platform != "darwin" else 1024 ** 2  # Linux 为 KB，macOS 为字节
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def run_one(backend: str, root: Path) -> dict:
+    """在当前进程中运行一个读取方式（由 run_backend 在子进程中调用）"""
+    files = list_files(root)
+    total_bytes = sum(os.path.getsize(f) for f in files)
+    start = time.perf_counter()
+    rows = BACKENDS[backend](files)
+    wall = time.perf_counter() - start
+    rss, child_rss = _peak_rss_mb()
+    return {
+        "wall_s": round(wall, 4),
+        "rows": rows,
+        "rows_per_s": round(rows / wall, 1) if wall else None,
+        "mb_per_s": round(total_bytes / 1024 ** 2 / wall, 2) if wall else None,  # 按磁盘上的（压缩后）字节计
+        "peak_rss_mb": None if rss is None else round(rss, 1),
+        "peak_child_rss_mb": None if child_rss is None else round(child_rss, 1),
+    }
+
+
+def run_backend(backend: str, root: Path, repeat: int = 1, timeout: float = None) -> dict:
+    """每次运行都在新的解释器中执行，峰值内存互不影响；取最快的一次"""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend, "--root", str(root)],
+            capture_output=True, text=True, timeout=timeout, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if proc.returncode != 0:
+            error = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+            # 导入失败（SyntaxError / ModuleNotFoundError）同样记为失败，不能被当作跳过而掩盖
+            return {"status": "failed", "error": error}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    return dict(best, status="ok")
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """与基线比较耗时和峰值内存，返回回归描述列表"""
+    regressions = []
+    for backend, current in results["backends"].items():
+        base = baseline.get("backends", {}).get(backend)
+        if not base or base.get("status") != "ok":
+            continue
+        if current.get("status") != "ok":
+            regressions.append(f"{backend}: {current.get('status')} ({current.get('error')})")
+            continue
+        for field in ("wall_s", "peak_rss_mb"):
+            if base.get(field) and current.get(field) and current[field] > base[field] * (1 + tolerance):
+                regressions.append(f"{backend}: {field} {base[field]} -> {current[field]} "
+                                   f"(+{(current[field] / base[field] - 1) * 100:.0f}%)")
+        if current.get("rows") != base.get("rows"):
+            regressions.append(f"{backend}: rows {base.get('rows')} -> {current.get('rows')}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the CSV reader backends on a synthetic MAIN_FOLDER tree")
+    parser.add_argument("--root", help="existing data tree; a temporary one is generated when omitted")
+    parser.add_argument("--generate", action="store_true", help="(re)generate the tree under --root")
+    parser.add_argument("--versions", type=int, default=2)
+    parser.add_argument("--dates", type=int, default=3)
+    parser.add_argument("--files-per-dir", type=int, default=10)
+    parser.add_argument("--rows-mean", type=int, default=20_000)
+    parser.add_argument("--size-dist", choices=["uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--width", type=int, default=8)
+    parser.add_argument("--missing-ratio", type=float, default=0.1)
+    parser.add_argument("--malformed-ratio", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma-separated backends to run")
+    parser.add_argument("--compression", default="none",
+                        help="comma-separated input codecs to compare: none, gzip, zstd, zstd-seekable; "
+                             "compressed trees are written next to --root as <root>_<codec>")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per backend; the fastest is kept")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_one(args.worker, Path(args.root))))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # 子进程在仓库目录中运行，使用绝对路径
+    root = Path(args.root).resolve() if args.root else Path(tempfile.mkdtemp(prefix="csv_bench_"))
+    gen_params = dict(versions=args.versions, dates=args.dates, files_per_dir=args.files_per_dir,
+                      rows_mean=args.rows_mean, size_dist=args.size_dist, width=args.width,
+                      missing_ratio=args.missing_ratio, malformed_ratio=args.malformed_ratio, seed=args.seed)
+    if args.generate or not args.root:
+        dataset = generate_tree(root, **gen_params)
+        logger.info(f"Generated {dataset['files']} files ({dataset['bytes'] / 1024 ** 2:.1f}MB) under {root}")
+    else:
+        files = list_files(root)
+        dataset = {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+
+    codecs = [c.strip() for c in args.compression.split(",") if c.strip()]
+    roots = {}
+    for codec in codecs:
+        if codec == "none":
+            roots[codec] = root
+            continue
+        if codec not in CODEC_SUFFIXES:
+            parser.error(f"unknown codec {codec}; choose from none, {', '.join(CODEC_SUFFIXES)}")
+        roots[codec] = Path(f"{root}_{codec}")
+        if args.generate or not roots[codec].exists():
+            info = compress_tree(root, roots[codec], codec)
+            logger.info(f"Compressed {info['files']} files with {codec} "
+                        f"({info['bytes'] / 1024 ** 2:.1f}MB) under {roots[codec]}")
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pyarrow": pa.__version__,
+            "pandas": pd.__version__,
+            "cpu_count": os.cpu_count(),
+            "root": str(root),
+            "dataset": dataset,
+            "compression": {codec: str(path) for codec, path in roots.items()},
+        },
+        "backends": {},
+    }
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend}; choose from {', '.join(BACKENDS)}")
+        for codec, codec_root in roots.items():
+            # 未压缩输入沿用原键名，与旧基线可比；压缩输入记为 <backend>@<codec>
+            name = backend if codec == "none" else f"{backend}@{codec}"
+            result = run_backend(backend, codec_root, args.repeat)
+            results["backends"][name] = result
+            if result["status"] == "ok":
+                # 各压缩树与未压缩树内容相同，按未压缩字节数计算可比的吞吐
+                result["raw_mb_per_s"] = round(dataset["bytes"] / 1024 ** 2 / result["wall_s"], 2)
+                logger.info(f"{name}: {result['wall_s']:.2f}s, {result['rows_per_s']:.0f} rows/s, "
+                            f"{result['mb_per_s']:.1f} MB/s ({result['raw_mb_per_s']:.1f} MB/s uncompressed), "
+                            f"peak RSS {result['peak_rss_mb']}MB")
+            else:
+                logger.warning(f"{name}: {result['status']} - {result['error']}")
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in regressions:
+            logger.error(f"Regression: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
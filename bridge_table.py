@@ -0,0 +1,256 @@
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from interval_join import DATE_RANGE_TABLES, TIME_UNIT, US_PER_DAY, Frame, IntervalTable, expand_days, interval_join, to_us
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MANIFEST_NAME = "_bridge.sqlite3"
+DATE_COL = "date"
+DEFAULT_RESULT_CACHE = 32  # 内存中保留的查询结果数（LRU）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    name          TEXT,
+    month         TEXT,
+    fingerprint   TEXT,
+    source_rows   INTEGER,
+    bridge_rows   INTEGER,
+    max_fromdate  INTEGER,
+    path          TEXT,
+    PRIMARY KEY (name, month)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name          TEXT PRIMARY KEY,
+    max_fromdate  INTEGER,
+    excluded_rows INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _month_of(us: np.ndarray) -> np.ndarray:
+    """微秒时间 -> 自 1970-01 起的月份序号"""
+    return (us // US_PER_DAY).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _month_name(month: int) -> str:
+    return str(np.datetime64(int(month), "M"))
+
+
+def _month_bounds(month: int) -> Tuple[np.datetime64, np.datetime64]:
+    """月份的第一天和最后一天"""
+    first = np.datetime64(int(month), "M").astype("datetime64[D]")
+    return first, np.datetime64(int(month) + 1, "M").astype("datetime64[D]") - np.timedelta64(1, "D")
+
+
+class BridgeStore:
+    """
+    sec_id/日期 桥接表（date_range.md 第 3 节）：把各区间表预先展开为逐日行，按月分区存为 Parquet
+    - refresh() 只重建源区间发生变化的月份：每个分区记录与该月相交的源行的指纹（行哈希之和）
+      以及 fromdate 水位；ob_inc != 0 的行不进入桥接表，其数量作为水位一并记录
+    - query(start, end) 只读取相交月份的分区，在 (sec_id, date) 上做等值连接，并缓存最近的查询结果
+    与 interval_join.date_range_query 的区别：左连接表按天匹配（某天没有有效行时属性为空）
+    """
+
+    def __init__(
+        self,
+        store_dir: Path,
+        tables: Optional[Dict[str, dict]] = None,
+        key: str = "sec_id",
+        cache_size: int = DEFAULT_RESULT_CACHE
+    ):
+        """
+        :param tables: {表名: IntervalTable 的 from_col/to_col/columns/how}，默认 date_range.md 中的 t1..t5，
+                       第一张表为连接的基表
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.tables = tables or DATE_RANGE_TABLES
+        self.key = key
+        self.cache_size = cache_size
+        self._results: "OrderedDict[tuple, pa.Table]" = OrderedDict()
+        self._conn = sqlite3.connect(str(self.store_dir / MANIFEST_NAME))
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _partition_path(self, name: str, month: int) -> Path:
+        return self.store_dir / f"table={name}" / f"month={_month_name(month)}" / "part.parquet"
+
+    def _source_ranges(self, name: str, data: Frame, start: np.datetime64, end: np.datetime64) -> pd.DataFrame:
+        """单表过滤后的有效区间：key、属性列、row_fromdate、row_todate"""
+        spec = self.tables[name]
+        table = IntervalTable(data, spec["from_col"], spec["to_col"], spec.get("columns", ()))
+        return interval_join(table, [], start, end, key=self.key)
+
+    def _bridge_schema(self, name: str, data: Frame) -> pa.Schema:
+        """分区文件的固定 schema（空分区也保持一致，便于跨月读取和连接）"""
+        columns = [self.key] + list(self.tables[name].get("columns", ()))
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data[columns], preserve_index=False)
+        fields = [data.schema.field(c) for c in columns]
+        fields = [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in fields]
+        return pa.schema([fields[0], pa.field(DATE_COL, pa.timestamp(TIME_UNIT))] + fields[1:])
+
+    @staticmethod
+    def _row_months(ranges: pd.DataFrame, months: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """每个区间覆盖的首末月份（限制在 months 范围内）"""
+        first = np.maximum(_month_of(ranges["row_fromdate"].to_numpy()), months[0])
+        last = np.minimum(_month_of(ranges["row_todate"].to_numpy() - 1), months[-1])
+        return first, last
+
+    def _fingerprints(self, ranges: pd.DataFrame, months: np.ndarray) -> Dict[int, tuple]:
+        """每个月份：(指纹, 相交的源行数, 最大 fromdate)"""
+        if ranges.empty:
+            return {}
+        row_hash = pd.util.hash_pandas_object(ranges, index=False).to_numpy()
+        first, last = self._row_months(ranges, months)
+        counts = np.maximum(last - first + 1, 0)
+        rows = np.repeat(np.arange(len(ranges)), counts)
+        month = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        if len(rows) == 0:
+            return {}
+        order = np.argsort(month, kind="stable")
+        rows, month = rows[order], month[order]
+        uniq, starts = np.unique(month, return_index=True)
+        # 行哈希求和（uint64 自然回绕）与行的顺序无关
+        sums = np.add.reduceat(row_hash[rows], starts)
+        sizes = np.diff(np.append(starts, len(rows)))
+        max_from = np.maximum.reduceat(ranges["row_fromdate"].to_numpy()[rows], starts)
+        return {int(m): (f"{int(s):016x}", int(n), int(f)) for m, s, n, f in zip(uniq, sums, sizes, max_from)}
+
+    def refresh(self, sources: Dict[str, Frame], horizon_start, horizon_end) -> Dict[str, int]:
+        """
+        按整月物化 [horizon_start, horizon_end] 内的桥接行，只重写指纹变化的分区
+        :param sources: {表名: DataFrame 或 Arrow Table}，例如 interval_join.load_interval_csv 的结果
+        :return: 统计信息（重建、未变化的分区数，写入的桥接行数）
+        """
+        months = np.arange(_month_of(to_us([horizon_start]))[0], _month_of(to_us([horizon_end]))[0] + 1)
+        # 区间过滤条件为 from < end，end 取下个月第一天才能包含最后一天开始的区间
+        start, end = _month_bounds(months[0])[0], _month_bounds(months[-1])[1] + np.timedelta64(1, "D")
+        stats = {"rebuilt": 0, "unchanged": 0, "rows": 0}
+
+        for name, data in sources.items():
+            ranges = self._source_ranges(name, data, start, end)
+            prints = self._fingerprints(ranges, months)
+            schema = self._bridge_schema(name, data)
+            first, last = self._row_months(ranges, months)
+            known = dict(self._conn.execute(
+                "SELECT month, fingerprint FROM partitions WHERE name = ?", (name,)
+            ).fetchall())
+
+            for month in months:
+                month = int(month)
+                fingerprint, source_rows, max_from = prints.get(month, ("0" * 16, 0, None))
+                path = self._partition_path(name, month)
+                if known.get(_month_name(month)) == fingerprint and path.exists():
+                    stats["unchanged"] += 1
+                    continue
+                first_day, last_day = _month_bounds(month)
+                in_month = ranges[(first <= month) & (last >= month)]
+                days = expand_days(in_month, first_day, last_day, key=self.key, date_col=DATE_COL)
+                table = pa.Table.from_pandas(days, preserve_index=False).select(schema.names).cast(schema)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                pq.write_table(table, tmp)
+                os.replace(tmp, path)
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO partitions "
+                        "(name, month, fingerprint, source_rows, bridge_rows, max_fromdate, path) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (name, _month_name(month), fingerprint, source_rows, table.num_rows, max_from, str(path))
+                    )
+                stats["rebuilt"] += 1
+                stats["rows"] += table.num_rows
+
+            excluded = 0
+            columns = data.column_names if isinstance(data, pa.Table) else data.columns
+            if "ob_inc" in columns:
+                flag = pd.Series(data.column("ob_inc").to_numpy() if isinstance(data, pa.Table) else data["ob_inc"])
+                excluded = int((flag.fillna(0) != 0).sum())
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (name, max_fromdate, excluded_rows) VALUES (?, ?, ?)",
+                    (name, int(ranges["row_fromdate"].max()) if len(ranges) else None, excluded)
+                )
+
+        if stats["rebuilt"]:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('generation', 1) "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+            self._results.clear()
+        logger.info(f"Bridge refresh {_month_name(months[0])}..{_month_name(months[-1])}: {stats}")
+        return stats
+
+    def watermarks(self) -> Dict[str, dict]:
+        """每张表已物化数据的 fromdate 水位及被 ob_inc 排除的行数"""
+        rows = self._conn.execute("SELECT name, max_fromdate, excluded_rows FROM watermarks").fetchall()
+        return {
+            name: {"max_fromdate": None if max_from is None else np.datetime64(max_from, TIME_UNIT),
+                   "excluded_rows": excluded}
+            for name, max_from, excluded in rows
+        }
+
+    def _read(self, name: str, months: np.ndarray, start: pa.Scalar, end: pa.Scalar) -> pa.Table:
+        paths = dict(self._conn.execute("SELECT month, path FROM partitions WHERE name = ?", (name,)).fetchall())
+        wanted = [_month_name(int(m)) for m in months]
+        missing = [m for m in wanted if m not in paths]
+        if missing:
+            raise ValueError(f"Bridge table {name} is not materialized for {missing}; refresh with a wider horizon")
+        dataset = ds.dataset([paths[m] for m in wanted], format="parquet")
+        return dataset.to_table(filter=(ds.field(DATE_COL) >= start) & (ds.field(DATE_COL) <= end))
+
+    def query(self, start_date, end_date) -> pd.DataFrame:
+        """
+        逐日结果：date、key 及各表属性列，按 (key, date) 排序
+        只读取与 [start_date, end_date] 相交的月份分区；相同区间的重复查询直接返回缓存结果
+        """
+        cache_key = (str(np.datetime64(start_date, "D")), str(np.datetime64(end_date, "D")), self._generation())
+        if cache_key in self._results:
+            self._results.move_to_end(cache_key)
+            return self._results[cache_key].to_pandas()
+
+        start_us, end_us = to_us([start_date, end_date])
+        months = np.arange(_month_of(np.array([start_us]))[0], _month_of(np.array([end_us]))[0] + 1)
+        start, end = (pa.scalar(int(v), pa.timestamp(TIME_UNIT)) for v in (start_us, end_us))
+
+        names = list(self.tables)
+        result = self._read(names[0], months, start, end)
+        for name in names[1:]:
+            join_type = "left outer" if self.tables[name].get("how", "inner") == "left" else "inner"
+            result = result.join(self._read(name, months, start, end), keys=[self.key, DATE_COL],
+                                 join_type=join_type, use_threads=True)
+        result = result.sort_by([(self.key, "ascending"), (DATE_COL, "ascending")])
+        columns = [DATE_COL, self.key] + [c for name in names for c in self.tables[name].get("columns", ())]
+        result = result.select(columns)
+
+        self._results[cache_key] = result
+        while len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result.to_pandas()
+
+    def stats(self) -> List[dict]:
+        rows = self._conn.execute(
+            "SELECT name, month, source_rows, bridge_rows FROM partitions ORDER BY name, month"
+        ).fetchall()
+        return [dict(zip(("name", "month", "source_rows", "bridge_rows"), r)) for r in rows]
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from instrumentation import PipelineMetrics
+from parquet_cache import schema_hash
+from predicates import Filter, to_expression
+from stream_reader import CSV_CONVERSION_ERROR, iter_file_tables
+
+logger = logging.getLogger(__name__)
+
+# Constants
+CHECKPOINT_NAME = "_checkpoint.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS done (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER,
+    mtime_ns  INTEGER,
+    spec      TEXT,
+    rows      INTEGER,
+    part_file TEXT
+);
+CREATE TABLE IF NOT EXISTS quarantine (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER,
+    mtime_ns  INTEGER,
+    spec      TEXT,
+    error     TEXT,
+    failed_at REAL
+);
+"""
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Checkpoint:
+    """
+    可恢复的批量读取：每个文件解析完成后立即把带类型的结果写成 Parquet 并登记到 SQLite 清单
+    - 进程被杀 / OOM 后以同一 checkpoint_dir 重跑，已完成且未变化的文件直接读取 Parquet，不再解析
+    - 解析/解码失败的文件进入隔离列表（记录错误原因），在其 size/mtime 或读取参数变化之前的运行中跳过；
+      I/O、内存不足、谓词引用不存在的列等其他错误不隔离，下次运行重新解析
+    - 值无法转换为声明的列类型时，只有同一读取参数下有其他文件解析成功才隔离，
+      否则更可能是 column_types 声明有误，不隔离
+    - 列、列类型或谓词变化后已有的结果和隔离记录自动失效（按 parquet_cache.schema_hash 比较）
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: Path,
+        columns_list: List[str],
+        column_types: Dict[str, str],
+        filters: Optional[Filter] = None
+    ):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.columns_list = columns_list
+        self.column_types = column_types
+        self.filters = filters
+        expr = to_expression(filters)
+        self.spec = schema_hash({"columns": list(columns_list or ()), "types": column_types,
+                                 "filters": str(expr) if expr is not None else ""})
+        self._conn = sqlite3.connect(str(self.checkpoint_dir / CHECKPOINT_NAME))
+        self._conn.executescript(_SCHEMA)
+        if "spec" not in {r[1] for r in self._conn.execute("PRAGMA table_info(quarantine)")}:
+            # 旧版清单的隔离记录没有 spec，视为与当前参数不同
+            self._conn.execute("ALTER TABLE quarantine ADD COLUMN spec TEXT")
+
+    def close(self):
+        self._conn.close()
+
+    def _part_file(self, path: str) -> Path:
+        name = hashlib.sha1(f"{path}|{self.spec}".encode()).hexdigest()[:20] + ".parquet"
+        return self.checkpoint_dir / name
+
+    def plan(self, file_paths: Iterable[str]) -> Tuple[Dict[str, str], List[str], Dict[str, str]]:
+        """
+        :return: (已完成 {文件: Parquet 路径}, 待解析文件, 仍处于隔离中的 {文件: 错误原因})
+        """
+        done = {r[0]: r[1:] for r in self._conn.execute("SELECT path, size, mtime_ns, spec, part_file FROM done")}
+        quarantined = {r[0]: r[1:]
+                       for r in self._conn.execute("SELECT path, size, mtime_ns, spec, error FROM quarantine")}
+        completed, pending, skipped, released = {}, [], {}, []
+        for path in dict.fromkeys(os.path.abspath(p) for p in file_paths):
+            stat = _stat(path)
+            if path in quarantined:
+                if stat == tuple(quarantined[path][:2]) and quarantined[path][2] == self.spec:
+                    skipped[path] = quarantined[path][3]
+                    continue
+                released.append(path)  # 文件已被修改或读取参数已变化，重新尝试
+            entry = done.get(path)
+            if (entry is not None and stat == tuple(entry[:2]) and entry[2] == self.spec
+                    and os.path.exists(entry[3])):
+                completed[path] = entry[3]
+            else:
+                pending.append(path)
+        if released:
+            with self._conn:
+                self._conn.executemany("DELETE FROM quarantine WHERE path = ?", [(p,) for p in released])
+        return completed, pending, skipped
+
+    def mark_done(self, path: str, table: pa.Table, stat: Optional[Tuple[int, int]]) -> str:
+        """先原子写出 Parquet 再登记，中途被杀时不会留下登记了但不完整的结果"""
+        part_file = self._part_file(path)
+        tmp = part_file.with_suffix(".tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, part_file)
+        size, mtime_ns = stat or (None, None)
+        previous = self._conn.execute("SELECT part_file FROM done WHERE path = ?", (path,)).fetchone()
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO done (path, size, mtime_ns, spec, rows, part_file) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, self.spec, table.num_rows, str(part_file))
+            )
+        if previous and previous[0] != str(part_file):
+            # 列/类型/谓词变化前的旧结果
+            Path(previous[0]).unlink(missing_ok=True)
+        return str(part_file)
+
+    def quarantine(self, path: str, error: str, stat: Optional[Tuple[int, int]] = None):
+        size, mtime_ns = stat or _stat(path) or (None, None)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO quarantine (path, size, mtime_ns, spec, error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, self.spec, error, time.time())
+            )
+        logger.warning(f"Quarantined {path}: {error}")
+
+    def quarantined(self) -> Dict[str, str]:
+        """当前隔离列表：{文件: 错误原因}"""
+        return dict(self._conn.execute("SELECT path, error FROM quarantine ORDER BY path"))
+
+    def run(
+        self,
+        file_paths: Iterable[str],
+        max_workers: int = None,
+        metrics: Optional[PipelineMetrics] = None
+    ) -> Optional[pa.Table]:
+        """
+        只解析未完成的文件，每完成一个即落盘登记；返回全部已完成文件（按输入顺序）的合并表
+        无可用结果时返回 None
+        """
+        file_paths = list(dict.fromkeys(os.path.abspath(p) for p in file_paths))
+        completed, pending, skipped = self.plan(file_paths)
+        logger.info(f"Checkpoint {self.checkpoint_dir}: {len(completed)} files done, {len(pending)} to parse, "
+                    f"{len(skipped)} quarantined")
+        if metrics is not None:
+            metrics.count("files_resumed", len(completed))
+            metrics.count("files_quarantined", len(skipped))
+        # 解析前记录 size/mtime：解析期间文件被修改时下次运行会重新解析
+        stats = {p: _stat(p) for p in pending}
+        conversion_errors = {}
+
+        def on_error(path: str, error: str, parse_error: bool):
+            # 只隔离文件内容本身的解析/解码错误；磁盘已满、内存不足等环境错误下次运行照常重试
+            if parse_error and CSV_CONVERSION_ERROR in error:
+                conversion_errors[path] = error
+            elif parse_error:
+                self.quarantine(path, error, stats.get(path))
+            else:
+                logger.warning(f"Not quarantining {path}, will retry on the next run: {error}")
+
+        # 不拆分字节范围：每个文件恰好产出一个 Table，才能按文件登记
+        for path, table in iter_file_tables(pending, self.columns_list, self.column_types, max_workers,
+                                            filters=self.filters, metrics=metrics, on_error=on_error):
+            completed[path] = self.mark_done(path, table, stats.get(path))
+        for path, error in conversion_errors.items():
+            if completed:
+                self.quarantine(path, error, stats.get(path))
+            else:
+                logger.warning(f"Not quarantining {path}: no file could be read with these column types, "
+                               f"check column_types: {error}")
+
+        parts = [pq.read_table(completed[p], memory_map=True) for p in file_paths if p in completed]
+        if not parts:
+            return None
+        return pa.concat_tables(parts, promote_options="permissive")
@@ -0,0 +1,134 @@
+import logging
+import mmap
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.ipc as ipc
+
+from compressed import compression_of, open_csv_source
+from predicates import filter_batches, read_columns
+from schema_cache import sniff_header
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_BLOCK_SIZE = 16 * 1024 ** 2      # 流式解析的块大小（Arrow 默认 1MB，大文件上块太小调度开销明显）
+SPLIT_FILE_BYTES = 1024 ** 3             # 超过该大小的文件按字节范围拆成多个任务并行解析
+RANGE_TARGET_BYTES = 256 * 1024 ** 2     # 每个字节范围的目标大小
+
+
+def types_declared(
+    header: List[str],
+    columns_list: Optional[List[str]],
+    column_types: Optional[Dict[str, str]],
+    expr: Optional[pc.Expression] = None
+) -> bool:
+    """
+    读取涉及的列（投影列 + 谓词列；未指定投影时为表头全部列）是否都在 column_types 中声明了类型
+    流式读取和按字节范围拆分只按局部数据推断未声明列的类型，只有全部声明时结果才与整文件读取一致
+    """
+    if not header:
+        return False
+    needed = read_columns(columns_list, expr, header) or header
+    return all(c in (column_types or {}) for c in needed)
+
+
+def split_byte_ranges(file_path: str, target_bytes: int = RANGE_TARGET_BYTES) -> List[Tuple[int, int]]:
+    """
+    把表头之后的数据区按换行边界切成约 target_bytes 的 [start, end) 字节范围
+    只扫描每个切分点之后到下一个换行符的少量字节，不读取整个文件
+    注意：按原始换行切分，字段值内含换行（引号内换行）的文件不能拆分；
+    各范围独立推断未声明列的类型，调用方需先用 types_declared 确认全部列类型已声明
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(b'\n')
+        start = size if pos < 0 else pos + 1
+        ranges = []
+        while start < size:
+            cut = start + max(1, target_bytes)
+            if cut >= size:
+                end = size
+            else:
+                nl = mm.find(b'\n', cut - 1)
+                end = size if nl < 0 else nl + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def open_csv_stream(
+    file_path: str,
+    columns_list: Optional[List[str]],
+    column_types: Dict[str, str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    use_threads: bool = False,
+    byte_range: Optional[Tuple[int, int]] = None,
+    header: Optional[List[str]] = None,
+    expr: Optional[pc.Expression] = None
+) -> pv.CSVStreamingReader:
+    """
+    以 pa.memory_map 打开文件并返回 Arrow 流式 CSV 读取器，每次只解析 block_size 字节
+    .csv.gz / .csv.zst 流式解压；use_threads 时 seekable zstd 按帧组多线程解压（见 compressed.open_csv_source）
+    :param byte_range: 只解析 [start, end) 范围（由 split_byte_ranges 给出）；此时用 header 作为列名，
+                       仅支持未压缩文件
+    :param expr: 额外读取谓词引用的列（调用方负责过滤与投影，见 predicates.filter_batches）
+    注意：流式读取按第一个块推断未在 column_types 中声明的列类型
+    """
+    header = header or sniff_header(file_path) or []
+    include = read_columns(columns_list, expr, header) if expr is not None else columns_list
+    read_options = pv.ReadOptions(use_threads=use_threads, block_size=block_size)
+    if byte_range is not None:
+        if compression_of(file_path) is not None:
+            raise ValueError(f"Byte ranges are not supported for compressed file {file_path}")
+        source = pa.memory_map(file_path)
+        start, end = byte_range
+        source.seek(start)
+        source = pa.BufferReader(source.read_buffer(end - start))
+        read_options.column_names = header
+    else:
+        source = open_csv_source(file_path, use_threads)
+    return pv.open_csv(
+        source,
+        read_options=read_options,
+        convert_options=pv.ConvertOptions(column_types=column_types, include_columns=include)
+    )
+
+
+def write_stream_ipc(
+    reader: pv.CSVStreamingReader,
+    spill_dir: str,
+    columns_list: Optional[List[str]] = None,
+    expr: Optional[pc.Expression] = None
+) -> str:
+    """逐块写入 spill_dir 下的临时 IPC 文件，worker 内存只保留当前块"""
+    schema = pa.schema([reader.schema.field(c) for c in columns_list]) if columns_list else reader.schema
+    fd, ipc_path = tempfile.mkstemp(prefix="csv_", suffix=".arrow", dir=spill_dir)
+    os.close(fd)
+    try:
+        with pa.OSFile(ipc_path, 'wb') as sink, ipc.new_file(sink, schema) as writer:
+            for batch in filter_batches(reader, expr, columns_list):
+                writer.write_batch(batch)
+    except BaseException:
+        os.unlink(ipc_path)
+        raise
+    return ipc_path
+
+
+def iter_record_batches(
+    file_path: str,
+    columns_list: Optional[List[str]],
+    column_types: Dict[str, str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    use_threads: bool = True,
+    expr: Optional[pc.Expression] = None
+) -> Iterator[pa.RecordBatch]:
+    """单进程流式读取一个大文件：内存占用与 block_size 成正比，而不是与文件大小成正比"""
+    reader = open_csv_stream(file_path, columns_list, column_types, block_size, use_threads, expr=expr)
+    yield from filter_batches(reader, expr, columns_list)
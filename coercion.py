@@ -0,0 +1,182 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from schema_cache import sniff_header
+
+logger = logging.getLogger(__name__)
+
+# Constants
+# 与 pandas.read_csv 默认的缺失值集合保持一致
+PANDAS_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+DEFAULT_VALUES = {
+    'int': -9999,
+    'float': -9999.0,
+    'date': datetime(1900, 1, 1),
+    'string': '',
+}
+DATE_UNIT = 'us'
+ARROW_TYPES = {
+    'int': pa.int64(),
+    'float': pa.float64(),
+    'date': pa.timestamp(DATE_UNIT),
+    'string': pa.string(),
+}
+# 依次尝试的日期格式；与 pandas 一样，按列中第一个非空值推断格式后整列统一解析
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%Y%m%d',
+]
+
+_INT_PATTERN = r'^-?\d{1,18}$'  # 可直接转换为 int64 的文本；其余数值走浮点路径
+_FLOAT_PATTERN = r'^[+-]?((\d+\.?\d*|\.\d+)(e[+-]?\d+)?|inf|infinity|nan)$'
+_INT64_LIMIT = 2.0 ** 63
+
+
+def _null_like(arr: pa.ChunkedArray) -> pa.Scalar:
+    return pa.scalar(None, type=arr.type)
+
+
+def _parse_int(text: pa.ChunkedArray) -> pa.ChunkedArray:
+    """整数列：纯整数文本直接转换；'1.0'、'1e3' 等整值浮点文本同样接受（与 pd.to_numeric 一致）"""
+    is_int = pc.match_substring_regex(text, _INT_PATTERN)
+    ints = pc.cast(pc.if_else(is_int, text, _null_like(text)), pa.int64())
+    floats = _parse_float(pc.if_else(is_int, _null_like(text), text))
+    integral = pc.and_(pc.equal(floats, pc.floor(floats)), pc.less(pc.abs(floats), _INT64_LIMIT))
+    from_floats = pc.cast(pc.if_else(integral, floats, pa.scalar(None, pa.float64())), pa.int64())
+    return pc.coalesce(ints, from_floats)
+
+
+def _parse_float(text: pa.ChunkedArray) -> pa.ChunkedArray:
+    is_float = pc.match_substring_regex(text, _FLOAT_PATTERN, ignore_case=True)
+    return pc.cast(pc.if_else(is_float, text, _null_like(text)), pa.float64())
+
+
+def _date_digits(text: pa.ChunkedArray) -> pa.ChunkedArray:
+    """只保留各数字段（去掉前导零）：'2023-02-03' 与 '2023-2-3' 得到相同结果"""
+    return pc.replace_substring_regex(pc.replace_substring_regex(text, r'\D+', '-'), r'(^|-)0+(\d)', r'\1\2')
+
+
+def _parse_date(text: pa.ChunkedArray, formats: List[str]) -> pa.ChunkedArray:
+    non_null = text.drop_null()
+    if len(non_null) == 0:
+        return pa.chunked_array([pa.nulls(len(text), ARROW_TYPES['date'])])
+    first = non_null[0].as_py()
+    for fmt in formats:
+        probe = pc.strptime(pa.array([first]), format=fmt, unit=DATE_UNIT, error_is_null=True)
+        if probe.null_count == 0:
+            parsed = pc.strptime(text, format=fmt, unit=DATE_UNIT, error_is_null=True)
+            # strptime 会把 2023-02-30 顺延为 2023-03-02；按原格式写回文本比对，不一致的视为解析失败
+            valid = pc.equal(_date_digits(pc.strftime(parsed, format=fmt)), _date_digits(text))
+            return pc.if_else(valid, parsed, pa.scalar(None, ARROW_TYPES['date']))
+    return pa.chunked_array([pa.nulls(len(text), ARROW_TYPES['date'])])
+
+
+class CoercionPlan:
+    """
+    把 required_columns（列名 -> 'int'/'float'/'date'/'string'）一次性编译为
+    Arrow ConvertOptions + pyarrow.compute 转换/填充，替代逐列的 pandas 修正：
+    - 无法解析的值置空后填充哨兵值（-9999 / -9999.0 / 1900-01-01），与原 pandas 逻辑一致
+    - 缺失列直接生成类型化的常量列，没有逐行 Python 开销
+    - 每次转换返回各列解析失败的行数
+    """
+
+    def __init__(self, required_columns: Dict[str, str], date_formats: Optional[List[str]] = None):
+        # 未识别的类型与原逻辑一样按字符串处理
+        self.kinds = {col: (dtype if dtype in ARROW_TYPES else 'string') for col, dtype in required_columns.items()}
+        self.columns = list(self.kinds)
+        self.schema = pa.schema([(col, ARROW_TYPES[kind]) for col, kind in self.kinds.items()])
+        self.date_formats = date_formats or DATE_FORMATS
+
+    def convert_options(self, present: Iterable[str]) -> pv.ConvertOptions:
+        """只读取文件中存在的必需列，全部先按字符串读入"""
+        present = [c for c in self.columns if c in set(present)]
+        return pv.ConvertOptions(
+            column_types={c: pa.string() for c in present},
+            include_columns=present,
+            null_values=PANDAS_NA_VALUES,
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=True
+        )
+
+    def coerce(self, table: pa.Table) -> Tuple[pa.Table, Dict[str, object]]:
+        """
+        按计划转换列类型
+        :return: (按 required_columns 顺序排列的表, {"failures": {列: 失败行数}, "missing": [缺失列]})
+        """
+        num_rows = table.num_rows
+        arrays = []
+        failures = {}
+        missing = []
+        for col, kind in self.kinds.items():
+            if col not in table.column_names:
+                missing.append(col)
+                arrays.append(pa.nulls(num_rows, ARROW_TYPES[kind]).fill_null(DEFAULT_VALUES[kind]))
+                continue
+
+            raw = table.column(col)
+            if kind == 'string':
+                arrays.append(pc.cast(raw, pa.string()))
+                continue
+
+            text = pc.utf8_trim_whitespace(pc.cast(raw, pa.string()))
+            if kind == 'int':
+                parsed = _parse_int(text)
+            elif kind == 'float':
+                parsed = _parse_float(text)
+            else:
+                parsed = _parse_date(text, self.date_formats)
+            failed = parsed.null_count - raw.null_count
+            if failed:
+                failures[col] = failed
+            arrays.append(parsed.fill_null(DEFAULT_VALUES[kind]))
+
+        return pa.Table.from_arrays(arrays, schema=self.schema), {"failures": failures, "missing": missing}
+
+    def read_csv(self, file_path: str, use_threads: bool = True) -> Tuple[pa.Table, Dict[str, object]]:
+        """读取单个 CSV 并完成类型转换（只解析存在的必需列）"""
+        header = sniff_header(file_path) or []
+        table = pv.read_csv(
+            file_path,
+            read_options=pv.ReadOptions(use_threads=use_threads),
+            convert_options=self.convert_options(header)
+        )
+        return self.coerce(table)
+
+    def empty_table(self) -> pa.Table:
+        return self.schema.empty_table()
+
+    def to_pandas(self, table: pa.Table, missing: Iterable[str] = ()) -> pd.DataFrame:
+        """
+        int 列转换为可空的 Int64，其余类型使用默认映射
+        :param missing: 所有来源文件都缺失的列；其中的 int 列与原 pandas 逻辑一样为 int64（整列哨兵值）
+        """
+        df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        for col in missing:
+            if self.kinds.get(col) == 'int' and col in df.columns:
+                df[col] = df[col].astype('int64')
+        return df
+
+
+def merge_reports(reports: Iterable[Dict[str, object]]) -> Dict[str, object]:
+    """汇总多个文件的转换报告：失败行数求和，缺失列统计出现的文件数"""
+    failures: Dict[str, int] = {}
+    missing: Dict[str, int] = {}
+    for report in reports:
+        for col, n in report["failures"].items():
+            failures[col] = failures.get(col, 0) + n
+        for col in report["missing"]:
+            missing[col] = missing.get(col, 0) + 1
+    return {"failures": failures, "missing": missing}
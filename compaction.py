@@ -0,0 +1,160 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from coercion import DEFAULT_VALUES
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_DICT_RATIO = 0.5          # 不同值数 / 非空行数 不超过该比例的字符串、日期列做字典编码
+INT_TYPES = [pa.int8(), pa.int16(), pa.int32(), pa.int64()]
+FLOAT32_MAX = float(np.finfo(np.float32).max)
+# 转换 pandas 时整数列使用可空类型，哨兵值替换成的空值不会把列变成 float
+PANDAS_INT_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+Range = Tuple[float, float]
+
+
+def _kind(arrow_type: pa.DataType) -> Optional[str]:
+    if pa.types.is_integer(arrow_type):
+        return 'int'
+    if pa.types.is_floating(arrow_type):
+        return 'float'
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        return 'date'
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return 'string'
+    return None
+
+
+def _null_sentinel(column: pa.ChunkedArray, kind: str) -> pa.ChunkedArray:
+    """把 coercion 填充的哨兵值（-9999 / -9999.0 / 1900-01-01 / 空串）换回空值"""
+    try:
+        sentinel = pa.scalar(DEFAULT_VALUES[kind]).cast(column.type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return column  # 哨兵值超出该列类型的取值范围，不可能出现
+    return pc.if_else(pc.equal(column, sentinel), pa.scalar(None, column.type), column)
+
+
+def _smallest_int(lo, hi) -> pa.DataType:
+    for t in INT_TYPES:
+        info = np.iinfo(t.to_pandas_dtype())
+        if info.min <= lo and hi <= info.max:
+            return t
+    return pa.int64()
+
+
+def _downcast_int(name: str, column: pa.ChunkedArray, declared: Optional[Range]) -> pa.ChunkedArray:
+    """
+    按声明的取值范围（未声明时按实际最值）选择最小的整数类型
+    实际值超出声明范围时抛出 ValueError（指明列名与范围），不会改用其他类型，保证各次运行输出类型一致
+    """
+    bounds = pc.min_max(column)
+    actual_lo, actual_hi = bounds['min'].as_py(), bounds['max'].as_py()
+    if declared is not None:
+        lo, hi = declared
+        if actual_lo is not None and (actual_lo < lo or actual_hi > hi):
+            raise ValueError(f"Column {name!r} has values in [{actual_lo}, {actual_hi}] "
+                             f"outside its declared range [{lo}, {hi}]")
+    elif actual_lo is None:
+        return pc.cast(column, pa.int8())
+    else:
+        lo, hi = actual_lo, actual_hi
+    return pc.cast(column, _smallest_int(lo, hi))
+
+
+def _dictionary_encode(column: pa.ChunkedArray, max_ratio: float) -> Optional[pa.ChunkedArray]:
+    """低基数列字典编码（pandas 中为 categorical）；索引类型按字典大小取最小整数类型"""
+    non_null = len(column) - column.null_count
+    if non_null == 0:
+        return None
+    distinct = pc.count_distinct(column).as_py()
+    if distinct > max_ratio * non_null:
+        return None
+    encoded = pc.dictionary_encode(column)
+    index_type = _smallest_int(0, distinct)
+    return pc.cast(encoded, pa.dictionary(index_type, column.type))
+
+
+def _is_midnight(column: pa.ChunkedArray) -> bool:
+    return pa.types.is_timestamp(column.type) and pc.all(
+        pc.equal(column, pc.floor_temporal(column, unit='day'))
+    ).as_py() is not False
+
+
+def compact_table(
+    table: pa.Table,
+    sentinels: bool = True,
+    dictionary: bool = True,
+    downcast: bool = True,
+    ranges: Optional[Dict[str, Range]] = None,
+    max_dict_ratio: float = MAX_DICT_RATIO
+) -> Tuple[pa.Table, Dict[str, object]]:
+    """
+    合并后的输出表的紧凑化（可选阶段，在 to_pandas 之前对 Arrow 表执行）
+    - sentinels：哨兵值换回空值
+    - dictionary：低基数字符串/日期列字典编码；在整张合并表上编码，各文件共用同一字典，
+      转换为 pandas 后是一个 categorical 列（按文件分别编码的表先 unify_dictionaries）
+    - downcast：整数按取值范围降为 int8/16/32；浮点只有在 ranges 中声明且在 float32 范围内时才降为 float32；
+      整点的时间戳列转为 date32
+    :param ranges: 列名 -> (最小值, 最大值) 的声明范围；声明后类型不随数据变化，各次运行输出一致；
+                   整数列的实际值超出声明范围时抛出 ValueError
+    :return: (紧凑化后的表, 内存报告)
+    """
+    ranges = ranges or {}
+    arrays = []
+    for name in table.column_names:
+        column = table.column(name)
+        kind = _kind(column.type)
+        if kind is not None and sentinels:
+            column = _null_sentinel(column, kind)
+        encoded = _dictionary_encode(column, max_dict_ratio) if dictionary and kind in ('string', 'date') else None
+        if encoded is not None:
+            column = encoded
+        elif downcast and kind == 'int':
+            column = _downcast_int(name, column, ranges.get(name))
+        elif downcast and kind == 'float' and name in ranges and max(map(abs, ranges[name])) <= FLOAT32_MAX:
+            column = pc.cast(column, pa.float32(), safe=False)
+        elif downcast and kind == 'date' and _is_midnight(column):
+            column = pc.cast(column, pa.date32())
+        arrays.append(column)
+    compacted = pa.Table.from_arrays(arrays, names=table.column_names)
+    return compacted, memory_report(table, compacted)
+
+
+def memory_report(before: pa.Table, after: pa.Table) -> Dict[str, object]:
+    """各列压缩前后的字节数与类型"""
+    columns = {
+        name: {
+            "before": before.column(name).nbytes,
+            "after": after.column(name).nbytes,
+            "type": str(after.column(name).type),
+        }
+        for name in after.column_names
+    }
+    return {"before_bytes": before.nbytes, "after_bytes": after.nbytes, "columns": columns}
+
+
+def format_report(report: Dict[str, object]) -> str:
+    mb = 1024 ** 2
+    lines = [f"Compaction: {report['before_bytes'] / mb:.1f}MB -> {report['after_bytes'] / mb:.1f}MB"]
+    for name, col in report["columns"].items():
+        lines.append(f"  {name}: {col['before'] / mb:.1f}MB -> {col['after'] / mb:.1f}MB ({col['type']})")
+    return "\n".join(lines)
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """紧凑表转 pandas：字典列 -> categorical（先统一字典），整数 -> 可空整数，date32 -> datetime64"""
+    return table.unify_dictionaries().to_pandas(
+        types_mapper=PANDAS_INT_TYPES.get, date_as_object=False, split_blocks=True, self_destruct=True
+    )
@@ -0,0 +1,243 @@
+import fnmatch
+import io
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Constants
+CSV_PATTERNS = ("*.csv", "*.csv.gz", "*.csv.zst")   # 文件发现默认匹配的文件名
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+ESTIMATED_RATIO = 6                     # 无法得知解压后大小时按压缩比估算（CSV 常见 5–10 倍）
+SEEKABLE_MAGIC = 0x8F92EAB1             # zstd seekable format 的 seek table 尾部魔数
+SKIPPABLE_MAGIC = 0x184D2A5E            # seek table 所在的 skippable frame 魔数
+SEEK_FOOTER = struct.Struct("<IBI")     # (帧数, 描述字节, SEEKABLE_MAGIC)
+SKIPPABLE_HEADER = struct.Struct("<II")  # (SKIPPABLE_MAGIC, 帧内容长度)
+SEEKABLE_FRAME_BYTES = 4 * 1024 ** 2    # 写出 seekable zstd 时每帧的解压后大小
+DECOMPRESS_GROUP_BYTES = 64 * 1024 ** 2  # 多线程解压 seekable zstd 时每组帧的解压后大小
+ZSTD_LEVEL = 3
+
+PathLike = Union[str, Path]
+SeekTable = List[Tuple[int, int, int]]  # [(压缩帧偏移, 压缩帧长度, 解压后长度)]
+
+
+def as_patterns(pattern: Union[str, Iterable[str]]) -> Tuple[str, ...]:
+    return (pattern,) if isinstance(pattern, str) else tuple(pattern)
+
+
+def matches(name: str, pattern: Union[str, Iterable[str]]) -> bool:
+    return any(fnmatch.fnmatchcase(name, p) for p in as_patterns(pattern))
+
+
+def compression_of(file_path: PathLike) -> Optional[str]:
+    """按扩展名判断压缩格式（gzip / zstd），未压缩返回 None"""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(str(file_path))[1].lower())
+
+
+def open_input(file_path: PathLike) -> pa.NativeFile:
+    """
+    打开输入文件：未压缩文件用 memory_map，压缩文件用 Arrow CompressedInputStream 流式解压
+    只读取开头若干字节（例如嗅探表头）时只解压对应的少量数据
+    """
+    codec = compression_of(file_path)
+    if codec is None:
+        return pa.memory_map(str(file_path))
+    return pa.CompressedInputStream(pa.OSFile(str(file_path)), codec)
+
+
+def read_seek_table(file_path: PathLike) -> Optional[SeekTable]:
+    """
+    读取 zstd seekable format 文件末尾的 seek table；不是 seekable 格式时返回 None
+    格式：若干独立 zstd 帧 + 一个 skippable frame，其内容为每帧的 (压缩长度, 解压长度[, 校验和])
+    及尾部 (帧数, 描述字节, 0x8F92EAB1)
+    """
+    if compression_of(file_path) != "zstd":
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < SKIPPABLE_HEADER.size + SEEK_FOOTER.size:
+                return None
+            f.seek(size - SEEK_FOOTER.size)
+            n_frames, descriptor, magic = SEEK_FOOTER.unpack(f.read(SEEK_FOOTER.size))
+            if magic != SEEKABLE_MAGIC:
+                return None
+            entry_size = 12 if descriptor & 0x80 else 8  # 最高位表示每项带 4 字节校验和
+            table_bytes = n_frames * entry_size
+            table_start = size - SEEK_FOOTER.size - table_bytes
+            if table_start < SKIPPABLE_HEADER.size:
+                return None
+            f.seek(table_start - SKIPPABLE_HEADER.size)
+            skippable, length = SKIPPABLE_HEADER.unpack(f.read(SKIPPABLE_HEADER.size))
+            if skippable != SKIPPABLE_MAGIC or length != table_bytes + SEEK_FOOTER.size:
+                return None
+            raw = f.read(table_bytes)
+    except OSError as e:
+        logger.debug(f"Could not read seek table of {file_path}: {e}")
+        return None
+    frames, offset = [], 0
+    for i in range(n_frames):
+        compressed, decompressed = struct.unpack_from("<II", raw, i * entry_size)
+        frames.append((offset, compressed, decompressed))
+        offset += compressed
+    if offset != table_start - SKIPPABLE_HEADER.size:
+        return None  # 帧长度之和与 seek table 位置不符，按普通 zstd 文件处理
+    return frames
+
+
+def decompressed_size(file_path: PathLike) -> int:
+    """
+    解压后大小（用于调度与内存预算）：seekable zstd 取 seek table 之和，gzip 取尾部 ISIZE，
+    其余压缩文件按 ESTIMATED_RATIO 估算；未压缩文件即文件大小
+    """
+    size = os.path.getsize(file_path)
+    codec = compression_of(file_path)
+    if codec is None:
+        return size
+    if codec == "zstd":
+        frames = read_seek_table(file_path)
+        if frames is not None:
+            return sum(d for _, _, d in frames)
+    elif codec == "gzip" and size >= 4:
+        with open(file_path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            isize = struct.unpack("<I", f.read(4))[0]
+        # ISIZE 只记录模 2^32 的长度（且只属于最后一个 member）；比压缩后还小说明已回绕
+        if isize >= size:
+            return isize
+    return size * ESTIMATED_RATIO
+
+
+def iter_seekable_frames(
+    file_path: PathLike,
+    frames: Optional[SeekTable] = None,
+    max_workers: Optional[int] = None,
+    group_bytes: int = DECOMPRESS_GROUP_BYTES
+) -> Iterator[pa.Buffer]:
+    """
+    按顺序产出 seekable zstd 文件各帧解压后的数据：帧按解压后大小分组（每组约 group_bytes），
+    组内各帧由线程池并行解压，消费当前组时预先解压下一组；内存中至多保留两组
+    """
+    frames = frames if frames is not None else read_seek_table(file_path)
+    if frames is None:
+        raise ValueError(f"{file_path} is not a seekable zstd file")
+    groups, group, size = [], [], 0
+    for frame in frames:
+        group.append(frame)
+        size += frame[2]
+        if size >= group_bytes:
+            groups.append(group)
+            group, size = [], 0
+    if group:
+        groups.append(group)
+    codec = pa.Codec("zstd")
+
+    with pa.memory_map(str(file_path)) as source, \
+            ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        def decompress(frame) -> pa.Buffer:
+            offset, compressed, decompressed = frame
+            return codec.decompress(source.read_at(compressed, offset), decompressed_size=decompressed)
+
+        # Arrow 解压时释放 GIL，线程即可并行
+        pending = [pool.submit(decompress, f) for f in groups[0]] if groups else []
+        for i in range(len(groups)):
+            current = pending
+            pending = [pool.submit(decompress, f) for f in groups[i + 1]] if i + 1 < len(groups) else []
+            for future in current:
+                yield future.result()
+
+
+class BufferStream(io.RawIOBase):
+    """把按顺序产出的缓冲区拼接成只读文件对象，经 pa.PythonFile 包装后交给 CSV 读取器流式消费"""
+
+    def __init__(self, buffers: Iterator[pa.Buffer]):
+        self._buffers = buffers
+        self._current = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = 0
+        while n < len(b):
+            if not len(self._current):
+                buf = next(self._buffers, None)
+                if buf is None:
+                    break
+                self._current = memoryview(buf)
+                continue
+            k = min(len(b) - n, len(self._current))
+            b[n:n + k] = self._current[:k]
+            self._current = self._current[k:]
+            n += k
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._current = memoryview(b'')
+            close = getattr(self._buffers, "close", None)
+            if close is not None:
+                close()  # 提前关闭时停止解压后续帧组
+        super().close()
+
+
+def open_csv_source(file_path: PathLike, use_threads: bool = False) -> pa.NativeFile:
+    """
+    CSV 读取器的输入：use_threads（大文件单独成任务）时 seekable zstd 按帧组多线程解压、边解压边解析
+    （见 iter_seekable_frames，内存与文件大小无关），其余压缩文件流式解压
+    """
+    if use_threads:
+        frames = read_seek_table(file_path)
+        if frames is not None and len(frames) > 1:
+            return pa.PythonFile(BufferStream(iter_seekable_frames(file_path, frames)), mode='r')
+    return open_input(file_path)
+
+
+def write_seekable_zstd(src: PathLike, dst: PathLike, frame_bytes: int = SEEKABLE_FRAME_BYTES,
+                        level: int = ZSTD_LEVEL):
+    """把文件写成 zstd seekable format：每 frame_bytes 解压后字节一帧，帧尾按换行对齐"""
+    codec = pa.Codec("zstd", compression_level=level)
+    entries = []
+    tmp = f"{dst}.tmp"
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        pending = b''
+        while True:
+            chunk = fin.read(frame_bytes)
+            data = pending + chunk
+            if not data:
+                break
+            cut = data.rfind(b'\n') + 1 if chunk else len(data)
+            if cut == 0:
+                # 一行超过 frame_bytes：继续累积到行尾
+                pending = data
+                continue
+            frame = codec.compress(data[:cut], asbytes=True)
+            fout.write(frame)
+            entries.append((len(frame), cut))
+            pending = data[cut:]
+        table = b''.join(struct.pack("<II", c, d) for c, d in entries)
+        fout.write(SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(table) + SEEK_FOOTER.size))
+        fout.write(table)
+        fout.write(SEEK_FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC))
+    os.replace(tmp, dst)
+
+
+def compress_file(src: PathLike, dst: PathLike, codec: str):
+    """
+    压缩单个文件
+    :param codec: gzip / zstd（单帧流式压缩）/ zstd-seekable（多帧，可并行解压）
+    """
+    if codec == "zstd-seekable":
+        write_seekable_zstd(src, dst)
+        return
+    tmp = f"{dst}.tmp"
+    with open(src, 'rb') as fin, pa.CompressedOutputStream(pa.OSFile(tmp, 'wb'), codec) as fout:
+        for chunk in iter(lambda: fin.read(1024 ** 2), b''):
+            fout.write(chunk)
+    os.replace(tmp, dst)
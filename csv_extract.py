@@ -0,0 +1,199 @@
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+
+from coercion import CoercionPlan, merge_reports
+from compaction import compact_table, format_report, to_pandas as compact_to_pandas
+from file_catalog import FileCatalog
+from parquet_cache import ParquetCache, cache_spec
+from scheduler import file_size, plan_tasks
+from schema_cache import sniff_header
+
+logger = logging.getLogger(__name__)
+
+# Constants
+BACKENDS = ("serial", "threads", "processes", "dask", "auto")
+FILE_PATTERN = "raw_data*.csv"
+# auto 的选择阈值：文件少且数据量小时并行开销得不偿失；
+# Arrow 解析与 pyarrow.compute 转换都会释放 GIL，中等规模用线程即可；
+# 文件很多时单文件的 Python 开销（表头嗅探、逐列转换调度）成为瓶颈，改用进程
+AUTO_SERIAL_MAX_FILES = 4
+AUTO_SERIAL_MAX_BYTES = 16 * 1024 ** 2
+AUTO_THREADS_MAX_FILES = 256
+AUTO_THREADS_MAX_BYTES = 2 * 1024 ** 3
+TASK_TARGET_BYTES = 64 * 1024 ** 2  # processes / dask 后端每个任务的目标字节数
+
+
+def discover_files(
+    root_path: str,
+    domain: str,
+    model_name: str,
+    model_version_folder_filter: str,
+    catalog: Optional[FileCatalog] = None,
+    pattern: str = FILE_PATTERN
+) -> List[str]:
+    """
+    <root>/<domain>/<model>/<version>/<date>/raw_data*.csv 的文件发现
+    :param catalog: FileCatalog(os.path.join(root_path, domain, model_name), subdir=None, pattern=pattern)；
+                    提供时查询持久化索引，不遍历目录树
+    """
+    version_pattern = '*' if model_version_folder_filter == 'all' else model_version_folder_filter
+    if catalog is not None:
+        return [str(p) for p in catalog.find_files([version_pattern], ['*'])]
+    search_pattern = os.path.join(root_path, domain, model_name, version_pattern, '*', pattern)
+    return sorted(glob.glob(search_pattern))
+
+
+def _read_files(
+    files: List[str],
+    required_columns: Dict[str, str]
+) -> List[Tuple[str, Optional[pa.Table], Dict[str, object], Optional[str]]]:
+    """
+    各后端共用的 worker：读取一批文件并按 CoercionPlan 转换类型（模块级函数，可被进程池/Dask pickle）
+    :return: [(文件, 表 或 None, 转换报告, 错误信息 或 None)]
+    """
+    plan = CoercionPlan(required_columns)
+    results = []
+    for file in files:
+        try:
+            table, report = plan.read_csv(file, use_threads=False)
+            results.append((file, table, report, None))
+        except Exception as e:
+            results.append((file, None, {"failures": {}, "missing": []}, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def choose_backend(files: List[str], total_bytes: Optional[int] = None) -> str:
+    """按文件数与总字节数选择后端；已连接 dask.distributed 集群时优先使用 Dask"""
+    try:
+        from distributed import default_client
+        default_client()
+        return "dask"
+    except (ImportError, ValueError):
+        pass
+    if total_bytes is None:
+        total_bytes = sum(file_size(f) for f in files)
+    if len(files) <= AUTO_SERIAL_MAX_FILES or total_bytes <= AUTO_SERIAL_MAX_BYTES:
+        return "serial"
+    if len(files) <= AUTO_THREADS_MAX_FILES and total_bytes <= AUTO_THREADS_MAX_BYTES:
+        return "threads"
+    return "processes"
+
+
+def _batches(files: List[str], max_workers: int) -> List[List[str]]:
+    """按字节数把文件打包成任务，摊薄进程间/集群调度开销"""
+    large, batches = plan_tasks(files, target_bytes=TASK_TARGET_BYTES, min_tasks=max_workers * 4)
+    return [[path] for path, _ in large] + [[path for path, _ in batch] for batch in batches]
+
+
+def run_backend(backend: str, files: List[str], required_columns: Dict[str, str], max_workers: Optional[int] = None):
+    """在指定后端上执行 _read_files，按 files 的顺序返回全部结果"""
+    if not files:
+        return []
+    workers = max_workers or os.cpu_count() or 1
+    if backend == "serial":
+        return _read_files(files, required_columns)
+    if backend == "threads":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(lambda f: _read_files([f], required_columns), files)
+            return [r for chunk in chunks for r in chunk]
+    if backend == "processes":
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = _batches(files, workers)
+            chunks = executor.map(_read_files, batches, [required_columns] * len(batches))
+            return [r for chunk in chunks for r in chunk]
+    if backend == "dask":
+        import dask
+        from dask import delayed
+        tasks = [delayed(_read_files)(batch, required_columns) for batch in _batches(files, workers)]
+        return [r for chunk in dask.compute(*tasks) for r in chunk]
+    raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
+
+
+def extract_csv_data(
+    root_path: str,
+    domain: str,
+    model_name: str,
+    model_version_folder_filter: str,
+    required_columns: Dict[str, str],
+    catalog: Optional[FileCatalog] = None,
+    cache: Optional[ParquetCache] = None,
+    return_report: bool = False,
+    backend: str = "auto",
+    max_workers: Optional[int] = None,
+    compact: bool = False
+):
+    """
+    读取 <root>/<domain>/<model>/<version>/<date>/raw_data*.csv 并按 required_columns 转换类型
+    各后端共用文件发现、CoercionPlan 类型转换与输出格式，切换后端不改变结果
+
+    Parameters:
+    - required_columns (dict): 列名 -> 'int' / 'float' / 'date' / 'string'
+    - catalog (FileCatalog, optional): 见 discover_files
+    - cache (ParquetCache, optional): 列式旁路缓存；命中与写入都在主进程完成，worker 只解析未命中的文件
+    - return_report (bool): 同时返回各列转换失败行数及缺失列的文件数
+    - backend: 'serial' | 'threads' | 'processes' | 'dask' | 'auto'
+      'dask' 在已连接 dask.distributed Client 时提交到集群，否则使用 Dask 本地调度器
+      'auto' 见 choose_backend
+    - max_workers: threads / processes 的并发数，默认 CPU 核数
+    - compact (bool): 输出紧凑化（见 compaction.compact_table）：哨兵值换回空值、低基数列转 categorical、
+      整数降位；report 中附带 "memory"（各列压缩前后的字节数）
+
+    Returns:
+    - pandas.DataFrame（return_report 为 True 时为 (DataFrame, report)）
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
+    plan = CoercionPlan(required_columns)
+    files = discover_files(root_path, domain, model_name, model_version_folder_filter, catalog)
+
+    # 结果按文件发现顺序拼接，与后端及缓存命中情况无关
+    tables: Dict[str, pa.Table] = {}
+    reports: List[Dict[str, object]] = []
+    missing: Dict[str, set] = {}  # 文件 -> 缺失的必需列
+    pending = files
+    spec = cache_spec(list(required_columns), required_columns, reader="coercion")
+    if cache is not None:
+        pending = []
+        for file in files:
+            table = cache.load(file, spec)
+            if table is None:
+                pending.append(file)
+            else:
+                tables[file] = table
+                missing[file] = set(plan.columns) - set(sniff_header(file) or plan.columns)
+
+    if backend == "auto":
+        backend = choose_backend(pending)
+    logger.info(f"Reading {len(pending)} files with backend '{backend}' "
+                f"({len(files) - len(pending)} served from cache)")
+
+    for file, table, report, error in run_backend(backend, pending, required_columns, max_workers):
+        if error is not None:
+            logger.error(f"Error reading {file}: {error}")
+            continue
+        if cache is not None:
+            try:
+                cache.store(file, spec, table)
+            except Exception as e:
+                logger.warning(f"Error caching {file}: {e}")
+        tables[file] = table
+        reports.append(report)
+        missing[file] = set(report["missing"])
+
+    ordered = [tables[f] for f in files if f in tables]
+    table = pa.concat_tables(ordered) if ordered else plan.empty_table()
+    report = merge_reports(reports)
+    if compact:
+        table, report["memory"] = compact_table(table)
+        logger.info(format_report(report["memory"]))
+        final_df = compact_to_pandas(table)
+    else:
+        final_df = plan.to_pandas(table, set.intersection(*missing.values()) if missing else ())
+    if report["failures"]:
+        logger.warning(f"Values that could not be coerced (replaced by defaults): {report['failures']}")
+    return (final_df, report) if return_report else final_df
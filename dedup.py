@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from file_catalog import FileCatalog
+from instrumentation import PipelineMetrics
+from predicates import Filter
+from schema_cache import SchemaCache
+from stream_reader import iter_file_tables
+
+logger = logging.getLogger(__name__)
+
+# Constants
+SAMPLE_BLOCK_BYTES = 64 * 1024   # 抽样指纹每块的大小
+SAMPLE_BLOCKS = 4                # 抽样块数（含首块与尾块，其余均匀分布）
+HASH_CHUNK_BYTES = 1024 ** 2     # 全量哈希的读取块大小
+DIGEST_SIZE = 16
+EXACT_PREFIX = "f:"              # 小文件的抽样覆盖全文，指纹即全量哈希，无需再确认
+SAMPLED_PREFIX = "s:"
+POLICIES = ("keep_latest", "keep_all")
+PROVENANCE_COLUMNS = ("source_version", "source_date", "source_file")
+
+
+def sampled_fingerprint(file_path: str, size: Optional[int] = None) -> str:
+    """
+    size + 若干抽样块的 blake2b 指纹；只读取 SAMPLE_BLOCKS * SAMPLE_BLOCK_BYTES 字节
+    不超过抽样总量的文件直接对全文求哈希（EXACT_PREFIX），否则为 SAMPLED_PREFIX，相同时需用 content_hash 确认
+    """
+    size = os.path.getsize(file_path) if size is None else size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=DIGEST_SIZE)
+    with open(file_path, 'rb') as f:
+        if size <= SAMPLE_BLOCKS * SAMPLE_BLOCK_BYTES:
+            digest.update(f.read())
+            return EXACT_PREFIX + digest.hexdigest()
+        last = size - SAMPLE_BLOCK_BYTES
+        for i in range(SAMPLE_BLOCKS):
+            f.seek(last * i // (SAMPLE_BLOCKS - 1))
+            digest.update(f.read(SAMPLE_BLOCK_BYTES))
+    return SAMPLED_PREFIX + digest.hexdigest()
+
+
+def content_hash(file_path: str) -> str:
+    """全文 blake2b 哈希"""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return EXACT_PREFIX + digest.hexdigest()
+
+
+def group_duplicates(file_paths: Iterable[str], catalog: Optional[FileCatalog] = None) -> List[List[str]]:
+    """
+    把内容完全相同的文件分组（组内与组间均保持输入顺序）
+    先按抽样指纹分组，只对抽样指纹相同的大文件计算全量哈希确认；提供 catalog 时指纹持久化在索引中，
+    文件 size/mtime 不变则不再读取
+    """
+    paths = list(dict.fromkeys(str(p) for p in file_paths))
+    cached = catalog.get_fingerprints(paths) if catalog is not None else {}
+    stats, sampled, full = {}, {}, {}
+    computed = set()
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        stats[p] = (st.st_size, st.st_mtime_ns)
+        entry = cached.get(p)
+        if entry is not None and tuple(entry[:2]) == stats[p]:
+            sampled[p] = entry[2]
+            if entry[3] is not None:
+                full[p] = entry[3]
+            continue
+        try:
+            sampled[p] = sampled_fingerprint(p, st.st_size)
+        except OSError as e:
+            logger.warning(f"Could not fingerprint {p}: {e}")
+            continue
+        computed.add(p)
+
+    candidates: Dict[str, List[str]] = {}
+    for p in paths:
+        if p in sampled:
+            candidates.setdefault(sampled[p], []).append(p)
+    groups: Dict[str, List[str]] = {}
+    for fp, members in candidates.items():
+        if len(members) == 1 or fp.startswith(EXACT_PREFIX):
+            groups[fp] = members
+            continue
+        # 抽样指纹相同：用全量哈希确认，防止只在未抽样区域不同的文件被误合并
+        for p in members:
+            if p not in full:
+                full[p] = content_hash(p)
+                computed.add(p)
+            groups.setdefault(full[p], []).append(p)
+
+    if catalog is not None and computed:
+        catalog.set_fingerprints((p, *stats[p], sampled[p], full.get(p)) for p in computed)
+    # 无法读取的文件各自成组，交给读取阶段按正常流程报错
+    result = list(groups.values())
+    result.extend([p] for p in paths if p not in sampled)
+    order = {p: i for i, p in enumerate(paths)}
+    return sorted(result, key=lambda members: order[members[0]])
+
+
+def _version_key(version: str) -> tuple:
+    """按自然顺序比较版本号：'10' 在 '9' 之后，'v2' 在 'v1' 之后"""
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.findall(r'\d+|\D+', version))
+
+
+def _provenance(file_paths: List[str], catalog: Optional[FileCatalog]) -> Dict[str, Tuple[str, str]]:
+    """每个文件的 (version, date)：优先取 catalog 记录，否则按 <version>/<date>/region/<file> 布局解析路径"""
+    info = catalog.file_info(file_paths) if catalog is not None else {}
+    result = {}
+    for p in file_paths:
+        if p in info:
+            result[p] = (info[p]["version"], info[p]["date"])
+        else:
+            parts = Path(p).parts
+            result[p] = (parts[-4], parts[-3]) if len(parts) >= 4 else ("", "")
+    return result
+
+
+def _constant_column(value: str, length: int) -> pa.DictionaryArray:
+    # 字典编码的常量列：只存一个字符串和 int32 索引，扇出多份时额外内存很小
+    return pa.DictionaryArray.from_arrays(pa.array(np.zeros(length, dtype=np.int32)), pa.array([value]))
+
+
+def read_deduplicated(
+    file_paths: Iterable[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    policy: str = "keep_latest",
+    catalog: Optional[FileCatalog] = None,
+    filters: Optional[Filter] = None,
+    schema_cache: Optional[SchemaCache] = None,
+    metrics: Optional[PipelineMetrics] = None
+) -> Optional[pa.Table]:
+    """
+    内容去重后读取：每组字节相同的文件只解析一次
+    :param policy: keep_latest —— 每组只保留版本号最大（同版本取日期最大）的一份；
+                   keep_all —— 每个文件各保留一份，附加 source_version / source_date / source_file 来源列，
+                   各份共享同一组 Arrow 缓冲区，不会复制数据
+    :return: 合并后的 Table（keep_all 按输入文件顺序，keep_latest 按每组首次出现的顺序）；没有可用结果时返回 None
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unsupported dedup policy: {policy} (expected one of {POLICIES})")
+    paths = list(dict.fromkeys(str(p) for p in file_paths))
+    groups = group_duplicates(paths, catalog)
+    provenance = _provenance(paths, catalog)
+    # 每组的代表文件：keep_latest 时即保留的那一份
+    representative = {}
+    for members in groups:
+        rep = max(members, key=lambda p: (_version_key(provenance[p][0]), provenance[p][1]))
+        representative.update((p, rep) for p in members)
+    duplicates = len(paths) - len(groups)
+    logger.info(f"Deduplicated {len(paths)} files into {len(groups)} unique contents "
+                f"({duplicates} duplicates, policy {policy})")
+    if metrics is not None:
+        metrics.count("files_duplicate", duplicates)
+
+    unique = list(dict.fromkeys(representative[members[0]] for members in groups))
+    parsed = dict(iter_file_tables(unique, columns_list, column_types, max_workers,
+                                   schema_cache=schema_cache, filters=filters, metrics=metrics))
+    parts = []
+    if policy == "keep_latest":
+        parts = [parsed[rep] for rep in unique if rep in parsed]
+    else:
+        for p in paths:
+            table = parsed.get(representative.get(p))
+            if table is None:
+                continue
+            version, date = provenance[p]
+            n = table.num_rows
+            parts.append(table.append_column(PROVENANCE_COLUMNS[0], _constant_column(version, n))
+                         .append_column(PROVENANCE_COLUMNS[1], _constant_column(date, n))
+                         .append_column(PROVENANCE_COLUMNS[2], _constant_column(p, n)))
+    if not parts:
+        return None
+    # 来源列统一为同一字典，便于直接 group_by，转 pandas 后为一个 categorical
+    return pa.concat_tables(parts, promote_options="permissive").unify_dictionaries()
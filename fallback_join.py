@@ -0,0 +1,111 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Constants
+MATCH_LEVEL = '_match_level'  # fallback 结果中命中的键层级（1 表示第一个降级键集合）
+A_ROW = '_a_row'              # fallback 结果中提供属性的 df_a 行号（位置）
+_KEY = '__fallback_key'
+_INT_LIMIT = 2 ** 62
+
+
+class FallbackJoinResult(NamedTuple):
+    matched: pd.DataFrame    # df_a left join df_b（完整键）
+    fallback: pd.DataFrame   # 完整键未匹配、但在某个降级键上命中的 df_b 行，附带 df_a 属性列
+    unmatched: pd.DataFrame  # 所有键层级都未命中的 df_b 行
+
+
+def _factorize_columns(df_a: pd.DataFrame, df_b: pd.DataFrame, columns: Sequence[str]) -> Dict[str, tuple]:
+    """对每个键列在 a、b 上联合编码为整数（向量化哈希，只做一次）"""
+    codes = {}
+    n_a = len(df_a)
+    for col in columns:
+        values = pd.concat([df_a[col], df_b[col]], ignore_index=True)
+        # NaN 也分配编码，与 merge / 字符串拼接键中 NaN 可以互相匹配的行为一致
+        col_codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        col_codes = col_codes.astype(np.int64)
+        codes[col] = (col_codes[:n_a], col_codes[n_a:], len(uniques))
+    return codes
+
+
+def _combine(codes: Dict[str, tuple], columns: Sequence[str]) -> tuple:
+    """把多列编码按混合进制合并为单个 int64 键；可能溢出时先压缩已合并部分"""
+    key_a = np.zeros(len(codes[columns[0]][0]), dtype=np.int64)
+    key_b = np.zeros(len(codes[columns[0]][1]), dtype=np.int64)
+    card = 1
+    for col in columns:
+        col_a, col_b, n = codes[col]
+        if card * max(n, 1) >= _INT_LIMIT:
+            merged, uniques = pd.factorize(np.concatenate([key_a, key_b]))
+            key_a, key_b = merged[:len(key_a)].astype(np.int64), merged[len(key_a):].astype(np.int64)
+            card = len(uniques)
+        key_a = key_a * n + col_a
+        key_b = key_b * n + col_b
+        card *= max(n, 1)
+    return key_a, key_b
+
+
+def fallback_join(
+    df_a: pd.DataFrame,
+    df_b: pd.DataFrame,
+    key_levels: List[List[str]],
+    attrs: Optional[List[str]] = None,
+    suffixes=('_a', '_b')
+) -> FallbackJoinResult:
+    """
+    多级降级键连接：先用完整键做 df_a left join df_b，再让未匹配的 df_b 行依次尝试更少的键列，
+    从 df_a 取回 attrs 属性（每个键取首次出现的行）
+    键列只在一开始联合编码为整数一次，各层级的键由整数编码合并得到，不构造字符串键
+
+    :param key_levels: 从最具体到最宽松的键列集合，例如 [key_cols, key_cols[:-1]]
+    :param attrs: 降级匹配时从 df_a 取回的列，默认为 df_a 中除键列以外的所有列
+    """
+    if not key_levels:
+        raise ValueError("key_levels must contain at least one key set")
+    all_keys = list(dict.fromkeys(col for level in key_levels for col in level))
+    if attrs is None:
+        attrs = [c for c in df_a.columns if c not in all_keys]
+
+    codes = _factorize_columns(df_a, df_b, all_keys)
+    level_keys = [_combine(codes, level) for level in key_levels]
+
+    # 第 0 层：完整键 left join（整数键上的 merge）
+    full_a, full_b = level_keys[0]
+    matched = df_a.assign(**{_KEY: full_a}).merge(
+        df_b.drop(columns=key_levels[0]).assign(**{_KEY: full_b}),
+        how='left', on=_KEY, suffixes=suffixes
+    ).drop(columns=_KEY)
+
+    # 降级层：只处理仍未匹配的 df_b 行，一次遍历所有层级
+    remaining = np.flatnonzero(~pd.Index(full_b).isin(full_a))
+    hit_rows, hit_a_rows, hit_levels = [], [], []
+    for level, (key_a, key_b) in enumerate(level_keys[1:], start=1):
+        if len(remaining) == 0:
+            break
+        first = ~pd.Series(key_a).duplicated().to_numpy()
+        lookup = pd.Index(key_a[first])
+        positions = lookup.get_indexer(key_b[remaining])
+        found = positions >= 0
+        hit_rows.append(remaining[found])
+        hit_a_rows.append(np.flatnonzero(first)[positions[found]])
+        hit_levels.append(np.full(found.sum(), level, dtype=np.int8))
+        remaining = remaining[~found]
+
+    if hit_rows:
+        rows = np.concatenate(hit_rows)
+        a_rows = np.concatenate(hit_a_rows)
+        levels = np.concatenate(hit_levels)
+    else:
+        rows = a_rows = np.empty(0, dtype=np.int64)
+        levels = np.empty(0, dtype=np.int8)
+
+    fallback = df_b.iloc[rows].reset_index(drop=True)
+    attr_values = df_a[attrs].iloc[a_rows].reset_index(drop=True)
+    attr_values.columns = [c + suffixes[0] if c in fallback.columns else c for c in attrs]
+    fallback = pd.concat([fallback, attr_values], axis=1)
+    fallback[MATCH_LEVEL] = levels
+    fallback[A_ROW] = a_rows
+
+    unmatched = df_b.iloc[remaining].reset_index(drop=True)
+    return FallbackJoinResult(matched, fallback, unmatched)
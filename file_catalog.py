@@ -0,0 +1,309 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from compressed import CSV_PATTERNS, as_patterns
+from predicates import Filter, filter_files
+from schema_cache import sniff_header
+
+logger = logging.getLogger(__name__)
+
+# Constants
+REGION = "region"
+SAFE_PATH_PATTERN = re.compile(r'^[\w\-\*\.]+$')  # 允许通配符的安全路径校验
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "csv_catalog"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path     TEXT PRIMARY KEY,
+    parent   TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    dir      TEXT,
+    version  TEXT,
+    date     TEXT,
+    size     INTEGER,
+    mtime_ns INTEGER,
+    columns  TEXT
+);
+CREATE INDEX IF NOT EXISTS files_version_date ON files (version, date);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+"""
+# 旧索引库中缺少的列：(列名, 类型)。文件 size/mtime 变化时 _scan_leaf 整行替换，这些列随之清空
+_ADDED_COLUMNS = [("fingerprint", "TEXT"), ("content_hash", "TEXT")]
+
+
+def _matches(name: str, patterns: Iterable[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+class FileCatalog:
+    """
+    <root>/<version>/<date>/<subdir>/<pattern> 文件目录树的持久化索引（SQLite）
+
+    - refresh(): 仅重新列举 mtime 发生变化的目录，未变化的目录直接复用索引
+    - find_files(): 直接在索引上执行 version/date 通配符查询
+
+    注意：目录 mtime 只反映条目的增删/重命名，原地覆盖写文件不会被察觉，
+    此类场景请调用 refresh(full=True)。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        db_path: Optional[Path] = None,
+        subdir: Optional[str] = REGION,
+        pattern: Union[str, Tuple[str, ...]] = CSV_PATTERNS
+    ):
+        self.root = Path(root).resolve()
+        self.subdir = subdir
+        self.pattern = pattern
+        if db_path is None:
+            # 索引默认不放在数据目录下，避免 sqlite 日志文件改变根目录 mtime
+            digest = hashlib.sha1(f"{self.root}|{subdir}|{pattern}".encode()).hexdigest()[:16]
+            db_path = DEFAULT_CACHE_DIR / f"{digest}.sqlite3"
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}
+        with self._conn:
+            for name, sql_type in _ADDED_COLUMNS:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE files ADD COLUMN {name} {sql_type}")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --------------------------
+    # 增量刷新
+    # --------------------------
+    def _children(self, parent: str) -> List[str]:
+        return [r[0] for r in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (parent,))]
+
+    def _forget(self, path: str):
+        """删除目录及其所有下级的索引记录"""
+        prefix = path.rstrip(os.sep) + os.sep
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+        self._conn.execute("DELETE FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+
+    def _stat_dir(self, path: str, parent: Optional[str], full: bool) -> Tuple[bool, bool]:
+        """返回 (目录是否存在, 是否需要重新列举)；同时更新记录的 mtime"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            self._forget(path)
+            return False, False
+        row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == mtime_ns and not full:
+            return True, False
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (path, parent, mtime_ns)
+        )
+        return True, True
+
+    def _list_subdirs(self, path: str, patterns: List[str]) -> List[str]:
+        """重新列举子目录，并清理已被删除的子目录记录"""
+        current = {e.path for e in os.scandir(path) if e.is_dir() and not e.name.startswith('.')}
+        for gone in set(self._children(path)) - current:
+            self._forget(gone)
+        # 不匹配当前模式的子目录也要登记（mtime 置空），以便之后更宽的查询能找到它们
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, NULL)",
+            [(p, path) for p in current]
+        )
+        return sorted(p for p in current if _matches(os.path.basename(p), patterns))
+
+    def _scan_leaf(self, leaf: str, version: str, date: str, full: bool) -> int:
+        """重新扫描叶子目录中的文件，只对 size/mtime 变化的文件重读表头"""
+        known = {
+            r[0]: (r[1], r[2])
+            for r in self._conn.execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (leaf,))
+        }
+        seen = set()
+        updated = 0
+        for entry in os.scandir(leaf):
+            if not entry.is_file() or not _matches(entry.name, as_patterns(self.pattern)):
+                continue
+            st = entry.stat()
+            seen.add(entry.path)
+            if not full and known.get(entry.path) == (st.st_size, st.st_mtime_ns):
+                continue
+            columns = sniff_header(entry.path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, dir, version, date, size, mtime_ns, columns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.path, leaf, version, date, st.st_size, st.st_mtime_ns,
+                 json.dumps(columns) if columns is not None else None)
+            )
+            updated += 1
+        gone = set(known) - seen
+        self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone])
+        return updated + len(gone)
+
+    def refresh(self, versions: List[str] = ("*",), dates: List[str] = ("*",), full: bool = False) -> Dict[str, int]:
+        """
+        增量刷新索引（仅遍历与 versions/dates 模式匹配的子树）
+        :param full: 忽略目录 mtime，强制重新扫描
+        :return: 统计信息（检查/重新列举的目录数、变化的文件数）
+        """
+        stats = {"dirs_checked": 0, "dirs_rescanned": 0, "files_changed": 0}
+        root = str(self.root)
+        with self._lock, self._conn:
+            exists, changed = self._stat_dir(root, None, full)
+            stats["dirs_checked"] += 1
+            if not exists:
+                logger.warning(f"Catalog root does not exist: {root}")
+                return stats
+            if changed:
+                stats["dirs_rescanned"] += 1
+                version_dirs = self._list_subdirs(root, list(versions))
+            else:
+                version_dirs = sorted(p for p in self._children(root) if _matches(os.path.basename(p), versions))
+
+            for version_dir in version_dirs:
+                exists, changed = self._stat_dir(version_dir, root, full)
+                stats["dirs_checked"] += 1
+                if not exists:
+                    continue
+                if changed:
+                    stats["dirs_rescanned"] += 1
+                    date_dirs = self._list_subdirs(version_dir, list(dates))
+                else:
+                    date_dirs = sorted(p for p in self._children(version_dir) if _matches(os.path.basename(p), dates))
+
+                for date_dir in date_dirs:
+                    leaf = os.path.join(date_dir, self.subdir) if self.subdir else date_dir
+                    if leaf != date_dir:
+                        # 记录 date 目录本身，保证其被删除时能级联清理
+                        self._stat_dir(date_dir, version_dir, full)
+                    exists, changed = self._stat_dir(leaf, date_dir if leaf != date_dir else version_dir, full)
+                    stats["dirs_checked"] += 1
+                    if exists and changed:
+                        stats["dirs_rescanned"] += 1
+                        stats["files_changed"] += self._scan_leaf(
+                            leaf, os.path.basename(version_dir), os.path.basename(date_dir), full
+                        )
+        logger.debug(f"Catalog refresh {self.root}: {stats}")
+        return stats
+
+    # --------------------------
+    # 查询
+    # --------------------------
+    def find_files(
+        self,
+        versions: List[str],
+        dates: List[str],
+        required_cols: Optional[Iterable[str]] = None,
+        refresh: bool = True,
+        where: Optional[Filter] = None
+    ) -> List[Path]:
+        """
+        在索引上执行 version/date 通配符查询
+        :param required_cols: 如提供，仅返回表头包含全部这些列的文件
+        :param refresh: 查询前先对匹配的子树做一次增量刷新
+        :param where: 作用于文件元数据（path/version/date/size/mtime_ns）的谓词，
+                      例如 pc.field('date') >= '2023-01-15'，在打开文件前裁剪整文件
+        """
+        versions = [v for v in versions if self._check_pattern(v)]
+        dates = [d for d in dates if self._check_pattern(d)]
+        if not versions or not dates:
+            return []
+        if refresh:
+            self.refresh(versions, dates)
+
+        required = set(required_cols or ())
+        clauses = " OR ".join(["(version GLOB ? AND date GLOB ?)"] * (len(versions) * len(dates)))
+        params = [p for v in versions for d in dates for p in (v, d)]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT path, columns, version, date, size, mtime_ns FROM files WHERE {clauses} ORDER BY path",
+                params
+            ).fetchall()
+        if required:
+            rows = [r for r in rows if r[1] is not None and required.issubset(json.loads(r[1]))]
+        if where is not None:
+            meta = [{"path": r[0], "version": r[2], "date": r[3], "size": r[4], "mtime_ns": r[5]} for r in rows]
+            return [Path(m["path"]) for m in filter_files(meta, where)]
+        return [Path(r[0]) for r in rows]
+
+    def file_info(self, paths: Iterable[Path]) -> Dict[str, dict]:
+        """批量返回文件的 version/date/size/mtime/columns 元数据"""
+        info = {}
+        with self._lock:
+            for p in paths:
+                row = self._conn.execute(
+                    "SELECT version, date, size, mtime_ns, columns FROM files WHERE path = ?", (str(p),)
+                ).fetchone()
+                if row is not None:
+                    info[str(p)] = {
+                        "version": row[0], "date": row[1], "size": row[2], "mtime_ns": row[3],
+                        "columns": json.loads(row[4]) if row[4] is not None else None,
+                    }
+        return info
+
+    def get_fingerprints(self, paths: Iterable[str]) -> Dict[str, Tuple[int, int, Optional[str], Optional[str]]]:
+        """已记录的内容指纹：{path: (size, mtime_ns, 抽样指纹, 全量哈希)}，未记录的文件不出现在结果中"""
+        result = {}
+        with self._lock:
+            for p in paths:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns, fingerprint, content_hash FROM files WHERE path = ?", (str(p),)
+                ).fetchone()
+                if row is not None and row[2] is not None:
+                    result[str(p)] = row
+        return result
+
+    def set_fingerprints(self, rows: Iterable[Tuple[str, int, int, str, Optional[str]]]):
+        """
+        记录内容指纹 (path, size, mtime_ns, 抽样指纹, 全量哈希 或 None)
+        只更新 size/mtime 与索引一致的行，避免把新内容的指纹记到旧记录上
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE files SET fingerprint = ?, content_hash = COALESCE(?, content_hash) "
+                "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                [(fp, full, str(path), size, mtime_ns) for path, size, mtime_ns, fp, full in rows]
+            )
+
+    @staticmethod
+    def _check_pattern(pattern: str) -> bool:
+        if SAFE_PATH_PATTERN.match(pattern) is None:
+            logger.warning(f"Skipping unsafe pattern: {pattern}")
+            return False
+        return True
+
+
+# 示例用法
+if __name__ == "__main__":
+    import sys
+    import time
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    catalog = FileCatalog(Path(sys.argv[1] if len(sys.argv) > 1 else "main_folder"))
+    start = time.perf_counter()
+    print(catalog.refresh())
+    print(f"refresh: {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    files = catalog.find_files(["*"], ["2023-01-*"], refresh=False)
+    print(f"find_files: {len(files)} files in {(time.perf_counter() - start) * 1000:.1f}ms")
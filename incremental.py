@@ -0,0 +1,183 @@
+import fnmatch
+import hashlib
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from compressed import CSV_PATTERNS
+from file_catalog import REGION, FileCatalog
+from parquet_cache import schema_hash
+from predicates import Filter, to_expression
+from stream_reader import iter_file_tables
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MANIFEST_NAME = "_manifest.sqlite3"
+PARTITIONING = ds.partitioning(pa.schema([("version", pa.string()), ("date", pa.string())]), flavor="hive")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path      TEXT PRIMARY KEY,
+    version   TEXT,
+    date      TEXT,
+    size      INTEGER,
+    mtime_ns  INTEGER,
+    spec      TEXT,
+    rows      INTEGER,
+    part_file TEXT
+);
+CREATE INDEX IF NOT EXISTS files_version_date ON files (version, date);
+"""
+
+
+def _alias_type(alias: Optional[str]) -> pa.DataType:
+    try:
+        return pa.type_for_alias(alias) if alias else pa.string()
+    except ValueError:
+        return pa.string()
+
+
+class IncrementalLoader:
+    """
+    增量加载：把 <root>/<version>/<date>/region/*.csv（含 .csv.gz / .csv.zst）追加为按 version/date 分区的 Parquet 数据集
+    - manifest 记录已入库文件的 (path, size, mtime, 读取参数, 行数, 分区文件)
+    - refresh() 只读取新增、发生变化或读取参数（列/列类型）变化的文件；源文件被删除时同步删除其分区文件；
+      变化后读取失败的文件删除旧分区和登记，下次 refresh 重试
+    - load() 返回所请求窗口内全部已入库数据（历史分区 + 本次增量）的并集
+    """
+
+    def __init__(
+        self,
+        dataset_dir: Path,
+        root: Path,
+        columns_list: List[str],
+        column_types: Dict[str, str],
+        catalog: Optional[FileCatalog] = None
+    ):
+        self.dataset_dir = Path(dataset_dir)
+        self.dataset_dir.mkdir(parents=True, exist_ok=True)
+        self.root = Path(root).resolve()  # 与 FileCatalog 一致使用绝对路径作为 manifest 键
+        self.columns_list = columns_list
+        self.column_types = column_types
+        self.catalog = catalog
+        self.spec = schema_hash({"columns": list(columns_list or ()), "types": column_types})
+        self._conn = sqlite3.connect(str(self.dataset_dir / MANIFEST_NAME))
+        self._conn.executescript(_SCHEMA)
+        if "spec" not in {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}:
+            # 旧版 manifest 没有 spec，已登记的文件在下次 refresh 时按当前参数重读
+            self._conn.execute("ALTER TABLE files ADD COLUMN spec TEXT")
+
+    def close(self):
+        self._conn.close()
+
+    def _discover(self, versions: List[str], dates: List[str]) -> Dict[str, dict]:
+        """当前磁盘上匹配窗口的文件：{path: {version, date, size, mtime_ns}}"""
+        if self.catalog is not None:
+            return {
+                path: {k: info[k] for k in ("version", "date", "size", "mtime_ns")}
+                for path, info in self.catalog.file_info(self.catalog.find_files(versions, dates)).items()
+            }
+        found = {}
+        for version_dir in (p for v in versions for p in self.root.glob(v) if p.is_dir()):
+            for date_dir in (p for d in dates for p in version_dir.glob(d) if p.is_dir()):
+                for f in (p for pattern in CSV_PATTERNS for p in (date_dir / REGION).glob(pattern)):
+                    st = f.stat()
+                    found[str(f)] = {"version": version_dir.name, "date": date_dir.name,
+                                     "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        return found
+
+    def _part_file(self, path: str, version: str, date: str) -> Path:
+        # 以源文件路径命名，文件变化后覆盖原分区文件
+        name = hashlib.sha1(path.encode()).hexdigest()[:20] + ".parquet"
+        return self.dataset_dir / f"version={version}" / f"date={date}" / name
+
+    def _manifest(self, versions: List[str], dates: List[str]) -> Dict[str, tuple]:
+        rows = self._conn.execute("SELECT path, version, date, size, mtime_ns, part_file, spec FROM files").fetchall()
+        return {
+            r[0]: r[1:]
+            for r in rows
+            if any(fnmatch.fnmatchcase(r[1], v) for v in versions) and any(fnmatch.fnmatchcase(r[2], d) for d in dates)
+        }
+
+    def refresh(self, versions: List[str], dates: List[str], max_workers: int = None) -> Dict[str, int]:
+        """
+        读取窗口内新增/变化的文件并写入分区数据集
+        :return: 统计信息（新增、变化、删除、未变化、读取失败的文件数及写入行数）
+        """
+        current = self._discover(versions, dates)
+        known = self._manifest(versions, dates)
+
+        stale = [p for p, info in current.items()
+                 if p not in known
+                 or (known[p][2], known[p][3], known[p][5]) != (info["size"], info["mtime_ns"], self.spec)]
+        removed = [p for p in known if p not in current]
+        stats = {"new": sum(p not in known for p in stale), "changed": sum(p in known for p in stale),
+                 "removed": len(removed), "unchanged": len(current) - len(stale), "failed": 0, "rows": 0}
+
+        with self._conn:
+            for path in removed:
+                Path(known[path][4]).unlink(missing_ok=True)
+                self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+        def on_error(path: str, error: str, parse_error: bool):
+            # 旧分区已与源文件不一致，删除后 load() 不再返回过期数据，下次 refresh 按新增文件重试
+            stats["failed"] += 1
+            if path in known:
+                Path(known[path][4]).unlink(missing_ok=True)
+                with self._conn:
+                    self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+        for path, table in iter_file_tables(stale, self.columns_list, self.column_types, max_workers,
+                                            on_error=on_error):
+            info = current[path]
+            part_file = self._part_file(path, info["version"], info["date"])
+            part_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = part_file.with_suffix(".tmp")
+            pq.write_table(table, tmp)
+            os.replace(tmp, part_file)
+            # 每个文件写完即登记，中途失败时已完成的部分不会重读
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (path, version, date, size, mtime_ns, spec, rows, part_file) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, info["version"], info["date"], info["size"], info["mtime_ns"], self.spec,
+                     table.num_rows, str(part_file))
+                )
+            stats["rows"] += table.num_rows
+
+        logger.info(f"Incremental refresh {versions}/{dates}: {stats}")
+        return stats
+
+    def load(
+        self,
+        versions: List[str],
+        dates: List[str],
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filter] = None,
+        with_partitions: bool = False
+    ) -> pa.Table:
+        """
+        查询窗口内已入库数据的并集
+        :param with_partitions: 为 True 时结果中附带 version/date 分区列
+        """
+        known = self._manifest(versions, dates)
+        outdated = [p for p, info in known.items() if info[5] != self.spec]
+        if outdated:
+            # 按旧的列/列类型写出的分区与当前 schema 不一致，混读会报错或缺列
+            raise ValueError(f"{len(outdated)} files were ingested with different columns or column types "
+                             f"(e.g. {outdated[0]}), call refresh() for this window first")
+        part_files = sorted({info[4] for info in known.values()})
+        if not part_files:
+            return pa.schema([(c, _alias_type(self.column_types.get(c))) for c in self.columns_list]).empty_table()
+        dataset = ds.dataset(part_files, format="parquet", partitioning=PARTITIONING,
+                             partition_base_dir=str(self.dataset_dir))
+        if columns is None:
+            columns = list(self.columns_list) + (["version", "date"] if with_partitions else [])
+        return dataset.to_table(columns=columns, filter=to_expression(filters))
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+STARTUP_TIMEOUT = 60.0     # 等待服务就绪的最长时间（秒）
+REQUEST_TIMEOUT = 3600.0
+ERROR_METADATA_KEY = b"error"  # 与 ingest_service.ERROR_METADATA_KEY 一致：服务端读取中途失败的标记
+SERVICE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_service.py")
+
+
+class IngestClient:
+    """
+    ingest_service 的轻量客户端：模块导入只依赖标准库，解码结果时才导入 pyarrow
+    服务未运行时按需在后台启动（python ingest_service.py），之后的调用复用同一个常驻进程
+    用法：
+        client = IngestClient(main_folder="main_folder")
+        table = client.process(["1"], ["2023-01-01"], ["user_id", "price"],
+                               {"user_id": "string", "price": "float64"}, filters=[("price", ">", 10)])
+    filters 使用 DNF 元组列表（需可 JSON 序列化）；column_types 使用 pyarrow 类型别名字符串
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, main_folder: Optional[str] = None,
+                 max_workers: Optional[int] = None, autostart: bool = True, log_path: Optional[str] = None):
+        self.base_url = f"http://{host}:{port}"
+        self.host = host
+        self.port = port
+        self.main_folder = main_folder
+        self.max_workers = max_workers
+        self.autostart = autostart
+        self.log_path = log_path
+
+    def health(self) -> Optional[dict]:
+        """服务不可达时返回 None"""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/health", timeout=2) as resp:
+                return json.load(resp)
+        except (urllib.error.URLError, ConnectionError, OSError):
+            return None
+
+    def ensure_running(self):
+        if self.health() is not None:
+            return
+        if not self.autostart:
+            raise ConnectionError(f"Ingest service is not running at {self.base_url}")
+        cmd = [sys.executable, SERVICE_SCRIPT, "--host", self.host, "--port", str(self.port)]
+        if self.main_folder is not None:
+            cmd += ["--main-folder", str(self.main_folder)]
+        if self.max_workers is not None:
+            cmd += ["--max-workers", str(self.max_workers)]
+        log = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        # 独立会话：客户端进程退出后服务继续常驻
+        subprocess.Popen(cmd, stdout=log, stderr=log, stdin=subprocess.DEVNULL, start_new_session=True)
+        logger.info(f"Started ingest service on {self.base_url}")
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.health() is not None:
+                return
+            time.sleep(0.1)
+        raise TimeoutError(f"Ingest service did not become ready within {STARTUP_TIMEOUT}s")
+
+    def _open(self, versions: List[str], dates: List[str], columns: List[str],
+              column_types: Optional[Dict[str, str]], filters):
+        self.ensure_running()
+        body = json.dumps({"versions": versions, "dates": dates, "columns": columns,
+                           "column_types": column_types or {}, "filters": filters}).encode()
+        request = urllib.request.Request(f"{self.base_url}/process", data=body,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            message = json.load(e).get("error", str(e))
+            # 4xx 为请求本身不合法，5xx 为服务端读取失败
+            raise (ValueError if e.code < 500 else RuntimeError)(message) from None
+
+    def process_raw(self, versions: List[str], dates: List[str], columns: List[str],
+                    column_types: Optional[Dict[str, str]] = None, filters=None) -> bytes:
+        """
+        返回原始 Arrow IPC 流字节（不导入 pyarrow）
+        注意：服务端读取中途失败时流以带 error 元数据的空批次结束，需由调用方自行检查
+        """
+        with self._open(versions, dates, columns, column_types, filters) as resp:
+            return resp.read()
+
+    @staticmethod
+    def _read_batches(reader) -> Iterator:
+        """逐个产出 RecordBatch；遇到服务端的失败标记时抛出 RuntimeError，不会把不完整的结果当作正常结束"""
+        while True:
+            try:
+                batch, metadata = reader.read_next_batch_with_custom_metadata()
+            except StopIteration:
+                return
+            if metadata is not None and ERROR_METADATA_KEY in metadata:
+                raise RuntimeError(f"Ingest service failed while streaming: {metadata[ERROR_METADATA_KEY].decode()}")
+            yield batch
+
+    def iter_batches(self, versions: List[str], dates: List[str], columns: List[str],
+                     column_types: Optional[Dict[str, str]] = None, filters=None) -> Iterator:
+        """边接收边解码，逐个产出 pyarrow.RecordBatch"""
+        import pyarrow.ipc as ipc
+        with self._open(versions, dates, columns, column_types, filters) as resp:
+            yield from self._read_batches(ipc.open_stream(resp))
+
+    def process(self, versions: List[str], dates: List[str], columns: List[str],
+                column_types: Optional[Dict[str, str]] = None, filters=None, as_pandas: bool = False):
+        """返回 pyarrow.Table（as_pandas=True 时为 DataFrame）"""
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        with self._open(versions, dates, columns, column_types, filters) as resp:
+            reader = ipc.open_stream(resp)
+            table = pa.Table.from_batches(list(self._read_batches(reader)), schema=reader.schema)
+        return table.to_pandas(split_blocks=True, self_destruct=True) if as_pandas else table
+
+    def shutdown(self):
+        if self.health() is None:
+            return
+        request = urllib.request.Request(f"{self.base_url}/shutdown", data=b"", method="POST")
+        with urllib.request.urlopen(request, timeout=10):
+            pass
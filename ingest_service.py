@@ -0,0 +1,326 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from file_catalog import SAFE_PATH_PATTERN, FileCatalog
+from predicates import to_expression
+from schema_cache import default_schema_cache
+from stream_reader import iter_file_tables
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAIN_FOLDER = Path("main_folder")
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+RESULT_CACHE_BYTES = 512 * 1024 ** 2   # 常驻结果缓存的总大小上限
+MAX_RESULT_BYTES = 64 * 1024 ** 2      # 单个结果超过该大小时不缓存
+ERROR_METADATA_KEY = "error"           # 流式写出开始后失败：以带该元数据的空批次结束 IPC 流
+
+
+class ResultCache:
+    """按 (请求, 各文件 size/mtime) 缓存 IPC 结果字节的 LRU；文件变化后键随之变化，旧条目自然淘汰"""
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class _TeeSink:
+    """
+    把写出的字节同时发送给客户端并在不超过上限时留一份给结果缓存
+    第一次写出时才调用 on_start（发送响应头），此前失败的请求仍可返回错误状态码
+    """
+
+    def __init__(self, wfile, limit: int, on_start: Optional[Callable[[], None]] = None):
+        self.wfile = wfile
+        self.limit = limit
+        self.on_start = on_start
+        self.started = False
+        self.chunks: Optional[List[bytes]] = []
+        self.size = 0
+        self.closed = False  # pyarrow 包装 Python 文件对象时会检查该属性
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if not self.started:
+            self.started = True
+            if self.on_start is not None:
+                self.on_start()
+        self.wfile.write(data)
+        self.size += len(data)
+        if self.chunks is not None:
+            if self.size > self.limit:
+                self.chunks = None
+            else:
+                self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class IngestService:
+    """
+    常驻的读取服务：进程池、文件目录索引、表头缓存与结果缓存在多次请求之间保持热状态
+    请求 process(versions, dates, columns, column_types, filters) 返回 Arrow IPC 流
+    worker 进程异常退出导致进程池损坏时，当前请求报错并重建进程池，后续请求不受影响
+    """
+
+    def __init__(self, main_folder: Path = MAIN_FOLDER, max_workers: Optional[int] = None,
+                 cache_bytes: int = RESULT_CACHE_BYTES):
+        self.main_folder = Path(main_folder)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.catalog = FileCatalog(self.main_folder)
+        self.schema_cache = default_schema_cache()
+        self.results = ResultCache(cache_bytes)
+        self.started = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()  # 保护 requests 计数与进程池的替换
+        # 预热：提前拉起全部 worker 进程并完成 pyarrow 导入
+        for future in [self.executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.catalog.close()
+
+    def _restart_executor(self, broken: ProcessPoolExecutor):
+        """替换已损坏的进程池；并发请求同时发现损坏时只重建一次"""
+        with self._lock:
+            if self.executor is not broken:
+                return
+            logger.warning("Worker pool is broken, starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "main_folder": str(self.main_folder.resolve()),
+            "workers": self.max_workers,
+            "schema_cache": self.schema_cache.stats(),
+            "result_cache": self.results.stats(),
+        }
+
+    def resolve(self, request: dict) -> tuple:
+        """校验请求并返回 (文件列表, 列, 列类型, 谓词, 结果缓存键)"""
+        versions, dates = request.get("versions"), request.get("dates")
+        if not versions or not dates:
+            raise ValueError("'versions' and 'dates' are required")
+        for name, patterns in (("versions", versions), ("dates", dates)):
+            # 与 FileCatalog 相同的校验：只允许字母数字、-、.、*，拒绝 '../etc' 之类的路径
+            if not isinstance(patterns, list) or not all(
+                    isinstance(p, str) and SAFE_PATH_PATTERN.match(p) and p.strip('.') for p in patterns):
+                raise ValueError(f"Invalid '{name}': expected a list of safe path patterns, got {patterns!r}")
+        columns = request.get("columns") or []
+        column_types = {c: pa.type_for_alias(t) for c, t in (request.get("column_types") or {}).items()}
+        filters = to_expression(request.get("filters"))
+        files = [str(p) for p in self.catalog.find_files(versions, dates, required_cols=columns)]
+        stamp = []
+        for f in files:
+            try:
+                st = os.stat(f)
+                stamp.append((f, st.st_size, st.st_mtime_ns))
+            except OSError:
+                continue
+        key = hashlib.sha1(json.dumps([request, stamp], sort_keys=True, default=str).encode()).hexdigest()
+        return files, columns, column_types, filters, key
+
+    def process(self, resolved: tuple, sink: _TeeSink):
+        """
+        把读取结果以 Arrow IPC 流写入 sink（见 _write_stream）；有文件读取失败的结果不进入结果缓存
+        :param resolved: resolve() 的返回值
+        """
+        files, columns, column_types, filters, key = resolved
+        with self._lock:
+            self.requests += 1
+            executor = self.executor
+        cached = self.results.get(key)
+        if cached is not None:
+            sink.write(cached)
+            return
+
+        for attempt in range(2):
+            failed = []
+            tables = iter_file_tables(files, columns, column_types, self.max_workers, schema_cache=self.schema_cache,
+                                      filters=filters, executor=executor,
+                                      on_error=lambda path, error, parse_error: failed.append(path))
+            try:
+                self._write_stream(tables, columns, column_types, sink)
+                break
+            except BrokenProcessPool:
+                self._restart_executor(executor)
+                # 尚未写出任何字节（进程池在请求之间已损坏）时用新进程池重试一次，否则报错
+                if sink.started or attempt:
+                    raise
+                with self._lock:
+                    executor = self.executor
+        if failed:
+            # 部分文件失败的结果不完整，不缓存，下次请求重新读取
+            logger.warning(f"Not caching result: {len(failed)} files failed, e.g. {failed[0]}")
+        elif sink.chunks is not None:
+            self.results.put(key, b"".join(sink.chunks))
+
+    @staticmethod
+    def _write_stream(tables: Iterable, columns: List[str], column_types: Dict[str, pa.DataType], sink: _TeeSink):
+        """
+        写出 IPC 流：列类型齐全时逐文件流式写出，否则合并后一次写出
+        读取中途失败时不写结束标记，而是追加一个带 ERROR_METADATA_KEY 元数据的空批次，客户端据此报错；
+        尚未写出任何字节时直接抛出，由调用方返回错误状态码
+        """
+        typed = bool(columns) and all(c in column_types for c in columns)
+        schema = pa.schema([(c, column_types[c]) for c in columns]) if typed else None
+        writer = None
+        try:
+            if typed:
+                for _, table in tables:
+                    if writer is None:
+                        writer = ipc.new_stream(sink, schema)
+                    writer.write_table(table.select(columns).cast(schema))
+                if writer is None:
+                    writer = ipc.new_stream(sink, schema)
+            else:
+                parts = [table for _, table in tables]
+                table = pa.concat_tables(parts, promote_options="permissive") if parts else pa.table({})
+                schema = table.schema
+                writer = ipc.new_stream(sink, schema)
+                writer.write_table(table)
+        except Exception as e:
+            if writer is not None:
+                try:
+                    writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema),
+                                       custom_metadata={ERROR_METADATA_KEY: f"{type(e).__name__}: {e}"})
+                    writer.close()
+                except OSError:
+                    pass  # 客户端已断开，保留原始异常
+            raise
+        writer.close()
+
+
+def _make_handler(service: IngestService, server_ref: list):
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._json(200, service.health())
+            else:
+                self._json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path == "/shutdown":
+                self._json(200, {"status": "shutting down"})
+                threading.Thread(target=server_ref[0].shutdown, daemon=True).start()
+                return
+            if self.path != "/process":
+                self._json(404, {"error": f"Unknown path {self.path}"})
+                return
+            start = time.perf_counter()
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                # 先校验，出错时还能返回 400；开始写流之后的错误以流末尾的 error 元数据告知客户端
+                resolved = service.resolve(request)
+            except Exception as e:
+                self._json(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+
+            def send_headers():
+                self.send_response(200)
+                self.send_header("Content-Type", ARROW_STREAM_TYPE)
+                self.end_headers()
+
+            sink = _TeeSink(self.wfile, MAX_RESULT_BYTES, on_start=send_headers)
+            try:
+                service.process(resolved, sink)
+            except Exception as e:
+                if not sink.started:
+                    self._json(500, {"error": f"{type(e).__name__}: {e}"})
+                logger.error(f"Request failed: {e}", exc_info=True)
+                return
+            logger.info(f"Served {sink.size} bytes in {time.perf_counter() - start:.2f}s")
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, main_folder: Path = MAIN_FOLDER,
+          max_workers: Optional[int] = None):
+    """前台运行服务直到收到 /shutdown 或 Ctrl-C；只监听本机地址"""
+    service = IngestService(main_folder, max_workers)
+    server_ref: list = []
+    server = ThreadingHTTPServer((host, port), _make_handler(service, server_ref))
+    server_ref.append(server)
+    logger.info(f"Ingest service listening on http://{host}:{port} (main folder {main_folder}, "
+                f"{service.max_workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Warm CSV ingestion daemon serving Arrow IPC streams")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--main-folder", type=Path, default=MAIN_FOLDER)
+    parser.add_argument("--max-workers", type=int)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.main_folder, args.max_workers)
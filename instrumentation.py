@@ -0,0 +1,223 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Constants
+COUNTERS = ("files_scanned", "files_skipped", "files_failed", "bytes_read", "rows_produced")
+METRIC_PREFIX = "csv_pipeline"
+
+Hook = Callable[[dict], None]
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """本进程及已结束子进程的 RSS 峰值（MB）；不支持 resource 模块的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return {"self": None, "children": None}
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024  # macOS 为字节，Linux 为 KB
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+class ProfileOptions:
+    """
+    worker 内的按文件 cProfile 采样（可 pickle，随任务传入子进程）
+    :param profile_dir: .prof 文件输出目录，可用 snakeviz / pstats 查看
+    :param every: 每 every 个文件采样一个（按路径哈希选取，结果可复现），1 表示全部采样
+    """
+
+    def __init__(self, profile_dir: str, every: int = 1):
+        self.profile_dir = str(profile_dir)
+        self.every = max(1, every)
+
+    def wants(self, file_path: str) -> bool:
+        return zlib.crc32(str(file_path).encode()) % self.every == 0
+
+    @contextmanager
+    def profile(self, file_path: str) -> Iterator[None]:
+        if not self.wants(file_path):
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{Path(file_path).stem}-{zlib.crc32(str(file_path).encode()):08x}-{os.getpid()}.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+
+
+class PipelineMetrics:
+    """
+    流水线各阶段的耗时与计数
+    - stage(name)：上下文管理器，累计各阶段耗时（discovery / header_check / plan / ipc_load / concat / to_pandas ...）
+    - count(name, n)：文件扫描/跳过/失败数、读取字节数、产出行数
+    - record_file(...)：worker 返回的单文件统计（排队等待、解析、IPC 写出耗时，worker pid）
+    - 内存峰值：本进程与 worker 进程的 RSS 高水位
+    每个事件以 dict 形式传给已注册的 hook；JsonLinesExporter / PrometheusExporter 就是 hook
+    """
+
+    def __init__(self, hooks: Optional[List[Hook]] = None, profile: Optional[ProfileOptions] = None):
+        self.hooks: List[Hook] = list(hooks or [])
+        self.profile = profile
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.stage_calls: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+        self.workers: Dict[int, Dict[str, float]] = defaultdict(lambda: {"tasks": 0, "queue_wait_s": 0.0, "busy_s": 0.0})
+        self.worker_rss_mb = 0.0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook):
+        self.hooks.append(hook)
+
+    def emit(self, event: dict):
+        event.setdefault("ts", time.time())
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.warning(f"Metrics hook {hook!r} failed: {e}")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] += seconds
+                self.stage_calls[name] += 1
+            self.emit({"event": "stage", "stage": name, "seconds": seconds})
+
+    def add_stage_time(self, name: str, seconds: float):
+        """记录在其他进程中测得的阶段耗时（例如 worker 内的 parse / ipc_write）"""
+        with self._lock:
+            self.stages[name] += seconds
+            self.stage_calls[name] += 1
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_task(self, stats: dict, submitted: float):
+        """
+        记录一个 worker 任务：stats 为 worker 返回的 {pid, started, finished, rss_mb}
+        :param submitted: 父进程提交任务时的 time.time()
+        """
+        with self._lock:
+            worker = self.workers[stats["pid"]]
+            worker["tasks"] += 1
+            worker["queue_wait_s"] += max(0.0, stats["started"] - submitted)
+            worker["busy_s"] += stats["finished"] - stats["started"]
+            if stats.get("rss_mb"):
+                self.worker_rss_mb = max(self.worker_rss_mb, stats["rss_mb"])
+
+    def record_file(self, file_path: str, stats: dict, status: str, error: Optional[str] = None):
+        """记录单个文件的结果：status 为 ok / failed / skipped"""
+        if status == "ok":
+            self.count("bytes_read", stats.get("bytes", 0))
+            self.count("rows_produced", stats.get("rows", 0))
+            self.add_stage_time("parse", stats.get("parse_s", 0.0))
+            self.add_stage_time("ipc_write", stats.get("write_s", 0.0))
+        else:
+            self.count("files_failed" if status == "failed" else "files_skipped")
+        event = {"event": "file", "path": str(file_path), "status": status}
+        event.update(stats)
+        if error:
+            event["error"] = error
+        self.emit(event)
+
+    def snapshot(self) -> dict:
+        rss = peak_rss_mb()
+        with self._lock:
+            return {
+                "elapsed_s": time.time() - self.started,
+                "stages": {name: {"seconds": round(s, 6), "calls": self.stage_calls[name]}
+                           for name, s in self.stages.items()},
+                "counters": dict(self.counters),
+                "workers": {str(pid): dict(w) for pid, w in self.workers.items()},
+                "memory": {"rss_high_water_mb": rss["self"],
+                           "children_rss_high_water_mb": rss["children"],
+                           "worker_rss_high_water_mb": self.worker_rss_mb or None},
+            }
+
+    def finish(self) -> dict:
+        """发送汇总事件（导出器在此时写出），并返回汇总"""
+        summary = self.snapshot()
+        self.emit(dict(summary, event="summary"))
+        return summary
+
+    def summary_line(self) -> str:
+        snap = self.snapshot()
+        stages = ", ".join(f"{name} {v['seconds']:.2f}s" for name, v in sorted(snap["stages"].items()))
+        counters = ", ".join(f"{k}={v}" for k, v in snap["counters"].items())
+        rss = snap["memory"]["rss_high_water_mb"]
+        return f"Stages: {stages} | {counters} | peak RSS {rss:.0f}MB" if rss else f"Stages: {stages} | {counters}"
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（node_exporter textfile collector 可直接读取）"""
+        snap = self.snapshot()
+        lines = [f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter"]
+        lines += [f'{METRIC_PREFIX}_stage_seconds_total{{stage="{name}"}} {v["seconds"]}'
+                  for name, v in snap["stages"].items()]
+        for name, value in snap["counters"].items():
+            lines += [f"# TYPE {METRIC_PREFIX}_{name}_total counter", f"{METRIC_PREFIX}_{name}_total {value}"]
+        lines.append(f"# TYPE {METRIC_PREFIX}_worker_seconds_total counter")
+        for pid, w in snap["workers"].items():
+            lines.append(f'{METRIC_PREFIX}_worker_seconds_total{{pid="{pid}",kind="queue_wait"}} {w["queue_wait_s"]}')
+            lines.append(f'{METRIC_PREFIX}_worker_seconds_total{{pid="{pid}",kind="busy"}} {w["busy_s"]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_rss_high_water_megabytes gauge")
+        labels = {"rss_high_water_mb": "self", "children_rss_high_water_mb": "children",
+                  "worker_rss_high_water_mb": "worker"}
+        for kind, value in snap["memory"].items():
+            if value is not None:
+                lines.append(f'{METRIC_PREFIX}_rss_high_water_megabytes{{process="{labels[kind]}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class JsonLinesExporter:
+    """把每个事件追加为一行 JSON；files=False 时只写阶段和汇总事件"""
+
+    def __init__(self, path: Path, files: bool = True):
+        self.path = Path(path)
+        self.files = files
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        if event["event"] == "file" and not self.files:
+            return
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(event, default=str) + "\n")
+
+
+class PrometheusExporter:
+    """收到汇总事件时把指标写成 Prometheus 文本文件（原子替换）"""
+
+    def __init__(self, path: Path, metrics: PipelineMetrics):
+        self.path = Path(path)
+        self.metrics = metrics
+
+    def __call__(self, event: dict):
+        if event["event"] != "summary":
+            return
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(self.metrics.to_prometheus())
+        os.replace(tmp, self.path)
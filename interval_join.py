@@ -0,0 +1,281 @@
+import argparse
+import glob
+import logging
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from stream_reader import read_table
+
+logger = logging.getLogger(__name__)
+
+# Constants
+TIME_UNIT = "us"  # 微秒精度可以表示 9999-12-31 这类开放结束日期（纳秒精度在 2262 年溢出）
+US_PER_DAY = 86_400 * 1_000_000
+OPEN_FROM = np.datetime64("1900-01-01", TIME_UNIT).astype(np.int64)  # 左连接未命中时 COALESCE 的默认值
+OPEN_TO = np.datetime64("9999-12-31", TIME_UNIT).astype(np.int64)
+EXCLUDE_FLAG = "ob_inc"  # 该列非 0 的行不参与连接（WHERE ob_inc = 0）
+
+Frame = Union[pd.DataFrame, pa.Table]
+
+
+class IntervalTable(NamedTuple):
+    """参与连接的区间表：有效期为 [from_col, to_col)，columns 为输出的属性列，how 为 'inner' 或 'left'"""
+    data: Frame
+    from_col: str
+    to_col: str
+    columns: Sequence[str] = ()
+    how: str = "inner"
+
+
+# date_range.md Approach A 中的表结构
+DATE_RANGE_TABLES = {
+    "t1": dict(from_col="t1_fromdate", to_col="t1_todate", columns=(), how="inner"),
+    "t2": dict(from_col="t2_fromdate", to_col="t2_todate", columns=("product_name",), how="inner"),
+    "t3": dict(from_col="t3_fromdate", to_col="t3_todate", columns=("trans_number",), how="inner"),
+    "t4": dict(from_col="t4_fromdate", to_col="t4_todate", columns=("address",), how="left"),
+    "t5": dict(from_col="t5_fromdate", to_col="t5_todate", columns=("extra_info",), how="left"),
+}
+
+
+def to_us(values) -> np.ndarray:
+    """把日期/时间列（Arrow、pandas 或 ISO 字符串）转换为 int64 微秒"""
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        values = pc.cast(values, pa.timestamp(TIME_UNIT)).to_numpy()
+    elif isinstance(values, pd.Series):
+        values = values.to_numpy()
+    return np.asarray(values, dtype=f"datetime64[{TIME_UNIT}]").astype(np.int64)
+
+
+def _column(data: Frame, name: str):
+    return data.column(name) if isinstance(data, pa.Table) else data[name]
+
+
+def _values(data: Frame, name: str) -> np.ndarray:
+    return _column(data, name).to_numpy()
+
+
+def _payload(data: Frame, columns: Sequence[str], rows: np.ndarray) -> pd.DataFrame:
+    """按行号取属性列，rows 为 -1 的位置为空值（左连接未命中）"""
+    if isinstance(data, pd.DataFrame):
+        data = pa.Table.from_pandas(data[list(columns)], preserve_index=False)
+    taken = data.select(list(columns)).take(pa.array(rows, mask=rows < 0))
+    return taken.to_pandas()
+
+
+def _filter_window(data: Frame, from_col: str, to_col: str, start: int, end: int) -> np.ndarray:
+    """与查询窗口 [start, end] 可能相交的行：from < end 且 to > start，并排除 ob_inc != 0 的行"""
+    from_us, to_us_ = to_us(_column(data, from_col)), to_us(_column(data, to_col))
+    keep = (from_us < end) & (to_us_ > start)
+    names = data.column_names if isinstance(data, pa.Table) else data.columns
+    if EXCLUDE_FLAG in names:
+        flag = pd.Series(_values(data, EXCLUDE_FLAG)).fillna(0).to_numpy()
+        keep &= flag == 0
+    return np.flatnonzero(keep)
+
+
+def overlap_pairs(
+    l_key: np.ndarray, l_from: np.ndarray, l_to: np.ndarray,
+    r_key: np.ndarray, r_from: np.ndarray, r_to: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    同键且区间相交（r_from < l_to 且 r_to > l_from）的全部行对，按左侧行号排序
+    右侧按 (key, from) 排序后扫描：相交的右侧区间的起点必在 (l_from - 该键最长区间, l_to) 内，
+    用 searchsorted 定位这一段，np.repeat 展开候选后只需再检查 r_to > l_from
+    """
+    if len(l_key) == 0 or len(r_key) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.lexsort((r_from, r_key))
+    rk, rf, rt = r_key[order], r_from[order], r_to[order]
+    n_keys = int(max(rk.max(), l_key.max())) + 1
+    max_dur = np.zeros(n_keys, dtype=np.int64)
+    np.maximum.at(max_dur, rk, rt - rf)
+
+    # (key, 时间) 的字典序组合为单个 int64：时间先换成全局名次，避免溢出
+    lower = l_from - max_dur[l_key]
+    times = np.unique(np.concatenate([rf, lower, l_to]))
+    span = len(times) + 1
+    composite = rk * span + np.searchsorted(times, rf)
+    lo = np.searchsorted(composite, l_key * span + np.searchsorted(times, lower), side="right")
+    hi = np.searchsorted(composite, l_key * span + np.searchsorted(times, l_to), side="left")
+
+    counts = np.maximum(hi - lo, 0)
+    left = np.repeat(np.arange(len(l_key)), counts)
+    right = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    keep = rt[right] > l_from[left]
+    return left[keep], order[right[keep]]
+
+
+def _take(values: np.ndarray, rows: np.ndarray, fill) -> np.ndarray:
+    """values[rows]，rows 为 -1 的位置填充 fill"""
+    out = np.full(len(rows), fill, dtype=values.dtype)
+    hit = rows >= 0
+    out[hit] = values[rows[hit]]
+    return out
+
+
+def _expand_matches(base_rows: np.ndarray, left: np.ndarray, right: np.ndarray, n_base: int, how: str):
+    """
+    把 base 行号 -> 匹配行号 的对应关系作用到当前结果行上
+    :return: (新行来自的当前结果行号, 新行对应的匹配行号，左连接未命中为 -1)
+    """
+    if how not in ("inner", "left"):
+        raise ValueError(f"Unsupported join type: {how}")
+    counts = np.bincount(left, minlength=n_base)
+    starts = np.cumsum(counts) - counts
+    per_row = counts[base_rows]
+    if how == "left":
+        per_row = np.maximum(per_row, 1)
+    rep = np.repeat(np.arange(len(base_rows)), per_row)
+    offset = np.arange(len(rep)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    src = np.where(counts[base_rows[rep]] > 0, starts[base_rows[rep]] + offset, -1)
+    return rep, _take(right, src, -1)
+
+
+def interval_join(
+    base: IntervalTable,
+    others: Sequence[IntervalTable],
+    start_date,
+    end_date,
+    key: str = "sec_id"
+) -> pd.DataFrame:
+    """
+    区间重叠连接（不展开到天）：每张表先按查询窗口过滤，再与 base 按 key 做区间相交连接
+    （与 date_range.md 一致，其余表只检查与 base 区间相交），最后计算组合有效期
+    row_fromdate = max(各表 from)，row_todate = min(各表 to)，左连接未命中的表分别按 1900-01-01 / 9999-12-31 处理
+    :return: key、各表属性列、row_fromdate、row_todate（微秒整数），每个组合一行
+    """
+    start, end = to_us([start_date])[0], to_us([end_date])[0]
+    tables = [base] + list(others)
+    selected, keys = [], []
+    for t in tables:
+        rows = _filter_window(t.data, t.from_col, t.to_col, start, end)
+        values = _values(t.data, key)[rows]
+        notnull = ~pd.isna(values)  # 空键在等值连接中不会匹配
+        selected.append(rows[notnull])
+        keys.append(values[notnull])
+
+    # 键列在所有表上联合编码
+    codes, uniques = pd.factorize(pd.Series(np.concatenate(keys)))
+    bounds = np.cumsum([0] + [len(k) for k in keys])
+    codes = [codes[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(len(tables))]
+    froms = [to_us(_values(t.data, t.from_col))[rows] for t, rows in zip(tables, selected)]
+    tos = [to_us(_values(t.data, t.to_col))[rows] for t, rows in zip(tables, selected)]
+
+    n_base = len(selected[0])
+    base_rows = np.arange(n_base)
+    row_from, row_to = froms[0], tos[0]
+    matches = []
+    for i in range(1, len(tables)):
+        left, right = overlap_pairs(codes[0], froms[0], tos[0], codes[i], froms[i], tos[i])
+        rep, rows = _expand_matches(base_rows, left, right, n_base, tables[i].how)
+        base_rows = base_rows[rep]
+        matches = [m[rep] for m in matches] + [rows]
+        row_from = np.maximum(row_from[rep], _take(froms[i], rows, OPEN_FROM))
+        row_to = np.minimum(row_to[rep], _take(tos[i], rows, OPEN_TO))
+
+    parts = [pd.DataFrame({key: uniques.take(codes[0][base_rows])})]
+    for table, rows, sel in zip(tables, [base_rows] + matches, selected):
+        if table.columns:
+            parts.append(_payload(table.data, table.columns, _take(sel, rows, -1)))
+    parts.append(pd.DataFrame({"row_fromdate": row_from, "row_todate": row_to}))
+    result = pd.concat(parts, axis=1)
+    logger.debug(f"Interval join: {n_base} base rows -> {len(result)} combined intervals")
+    return result
+
+
+def expand_days(
+    ranges: pd.DataFrame,
+    start_date,
+    end_date,
+    calendar: Optional[Iterable] = None,
+    key: str = "sec_id",
+    date_col: str = "date"
+) -> pd.DataFrame:
+    """
+    把 [row_fromdate, row_todate) 与查询窗口 [start_date, end_date] 的交集展开为逐日行（向量化 repeat/arange）
+    :param calendar: dim_date 的日期列；给出时只输出日历中存在的日期，否则输出每一个自然日
+    :return: date、key 及属性列，按 (key, date) 排序
+    """
+    start, end = to_us([start_date])[0], to_us([end_date])[0]
+    row_from = np.maximum(ranges["row_fromdate"].to_numpy(), start)
+    row_to = ranges["row_todate"].to_numpy()
+    # 输出的是 0 点的日期 d：需满足 row_from <= d < row_to 且 d <= end_date
+    first = -(-row_from // US_PER_DAY)
+    stop = np.minimum(-(-row_to // US_PER_DAY), end // US_PER_DAY + 1)
+
+    if calendar is None:
+        counts = np.maximum(stop - first, 0)
+        rep = np.repeat(np.arange(len(ranges)), counts)
+        days = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    else:
+        cal = np.unique(to_us(pd.Series(list(calendar))) // US_PER_DAY)
+        lo, hi = np.searchsorted(cal, first), np.searchsorted(cal, stop)
+        counts = np.maximum(hi - lo, 0)
+        rep = np.repeat(np.arange(len(ranges)), counts)
+        days = cal[np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))]
+
+    attrs = [c for c in ranges.columns if c not in ("row_fromdate", "row_todate")]
+    result = ranges[attrs].take(rep).reset_index(drop=True)
+    result.insert(0, date_col, days.astype("datetime64[D]").astype(f"datetime64[{TIME_UNIT}]"))
+    return result.sort_values([key, date_col], kind="stable", ignore_index=True)
+
+
+def date_range_query(
+    t1: Frame, t2: Frame, t3: Frame, t4: Frame, t5: Frame,
+    start_date,
+    end_date,
+    calendar: Optional[Iterable] = None
+) -> pd.DataFrame:
+    """date_range.md Approach A：dim_t1..dim_t3 内连接、ref_t4/ref_t5 左连接，最后展开为逐日行"""
+    spec = {name: IntervalTable(data, **DATE_RANGE_TABLES[name])
+            for name, data in zip(("t1", "t2", "t3", "t4", "t5"), (t1, t2, t3, t4, t5))}
+    ranges = interval_join(spec["t1"], [spec[n] for n in ("t2", "t3", "t4", "t5")], start_date, end_date)
+    return expand_days(ranges, start_date, end_date, calendar)
+
+
+def load_interval_csv(
+    file_paths: Iterable[str],
+    name: str,
+    start_date,
+    end_date,
+    key: str = "sec_id",
+    max_workers: int = None
+) -> Optional[pa.Table]:
+    """
+    用 stream_reader 读取某张表的 CSV 抽取文件，只读取需要的列，窗口过滤在读取时下推
+    :param name: DATE_RANGE_TABLES 中的表名（t1..t5）
+    """
+    spec = DATE_RANGE_TABLES[name]
+    columns = [key, spec["from_col"], spec["to_col"], EXCLUDE_FLAG] + list(spec["columns"])
+    column_types = {spec["from_col"]: f"timestamp[{TIME_UNIT}]", spec["to_col"]: f"timestamp[{TIME_UNIT}]"}
+    start, end = (pa.scalar(int(v), pa.timestamp(TIME_UNIT)) for v in to_us([start_date, end_date]))
+    window = (pc.field(spec["from_col"]) < end) & (pc.field(spec["to_col"]) > start) & (pc.field(EXCLUDE_FLAG) == 0)
+    table = read_table(file_paths, columns, column_types, max_workers, filters=window)
+    if table is not None and pa.types.is_string(table.schema.field(key).type):
+        # CSV 中的空字符串即空键，空键不参与等值连接
+        table = table.filter(pc.field(key) != "")
+    return table
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Interval-overlap join of dim_t1..ref_t5 CSV extracts with per-day output")
+    for table_name in DATE_RANGE_TABLES:
+        parser.add_argument(f"--{table_name}", required=True, help=f"glob of {table_name} CSV files")
+    parser.add_argument("--start", required=True, help="start date, e.g. 2024-01-01")
+    parser.add_argument("--end", required=True, help="end date (inclusive)")
+    parser.add_argument("--output", required=True, help="output Parquet file")
+    args = parser.parse_args()
+
+    loaded = {table_name: load_interval_csv(sorted(glob.glob(getattr(args, table_name))), table_name, args.start, args.end)
+              for table_name in DATE_RANGE_TABLES}
+    missing = [table_name for table_name, table in loaded.items() if table is None]
+    if missing:
+        parser.error(f"no readable files for {missing}")
+    days = date_range_query(*loaded.values(), args.start, args.end)
+    days.to_parquet(args.output, index=False)
+    logger.info(f"Wrote {len(days)} rows to {args.output}")
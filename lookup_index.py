@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from partitioned_join import NULLABLE_DTYPES, hash_keys
+
+logger = logging.getLogger(__name__)
+
+# Constants
+HASHES_FILE = "hashes.npy"
+TABLE_FILE = "attrs.arrow"
+META_FILE = "meta.json"
+HASH_VERSION = 2  # 键哈希算法变化时递增，旧索引在 open_or_build 时重建
+
+
+def _write_atomic(path: Path, write: Callable[[str], None]):
+    tmp = str(path) + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class LookupIndex:
+    """
+    降级键 -> 属性列的持久化查找索引（替代每次运行都要做的 drop_duplicates + merge）
+    - hashes.npy：按升序排列的 uint64 键哈希，以 mmap 方式打开
+    - attrs.arrow：与哈希同序的键列 + 属性列（Arrow IPC 文件，memory-map 零拷贝读取）
+    - 哈希在数组中的位置即属性行号；查找为 searchsorted + 键列校验，哈希冲突时不会返回错误的行
+    同一个键只保留一行：build 时保留首次出现的行（与 drop_duplicates(subset=key) 一致），update 时以新数据为准
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / META_FILE) as f:
+            self.meta = json.load(f)
+        self.key_cols: List[str] = self.meta["key_cols"]
+        self.attrs: List[str] = self.meta["attrs"]
+        self.hashes = np.load(self.index_dir / HASHES_FILE, mmap_mode="r")
+        with pa.memory_map(str(self.index_dir / TABLE_FILE)) as source:
+            self.table = ipc.open_file(source).read_all()
+        self.key_schema = pa.schema([self.table.schema.field(c) for c in self.key_cols])
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def source_version(self) -> Optional[str]:
+        return self.meta.get("source_version")
+
+    @staticmethod
+    def _hash(keys: pa.Table) -> np.ndarray:
+        # 按可空类型哈希：查询键含空值时整数键列不会变成 float64，哈希与构建时一致
+        return hash_keys(keys)
+
+    @classmethod
+    def _write(cls, index_dir: Path, table: pa.Table, hashes: np.ndarray, meta: dict) -> "LookupIndex":
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+
+        def write_table(path):
+            with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        def write_hashes(path):
+            with open(path, "wb") as f:
+                np.save(f, hashes)
+
+        # meta 最后写入：它引用的数据文件都已完整替换
+        _write_atomic(index_dir / TABLE_FILE, write_table)
+        _write_atomic(index_dir / HASHES_FILE, write_hashes)
+        _write_atomic(index_dir / META_FILE, lambda p: Path(p).write_text(json.dumps(dict(meta, rows=len(hashes)))))
+        return cls(index_dir)
+
+    @staticmethod
+    def _sorted_unique(table: pa.Table, key_cols: List[str]) -> tuple:
+        """按键去重（保留首行）并按哈希排序"""
+        keys = table.select(key_cols)
+        first = ~keys.to_pandas(types_mapper=NULLABLE_DTYPES.get).duplicated().to_numpy()
+        table = table.filter(pa.array(first))
+        hashes = LookupIndex._hash(table.select(key_cols))
+        order = np.argsort(hashes, kind="stable")
+        return table.take(pa.array(order)), hashes[order]
+
+    @classmethod
+    def build(
+        cls,
+        df_a: Union[pd.DataFrame, pa.Table],
+        key_cols: List[str],
+        attrs: List[str],
+        index_dir: Path,
+        source_version: Optional[str] = None
+    ) -> "LookupIndex":
+        """
+        从参考表全量构建索引
+        :param source_version: 参考表的版本标记（例如文件 mtime 水位），open_or_build 用它判断是否需要重建
+        """
+        table = df_a if isinstance(df_a, pa.Table) else pa.Table.from_pandas(df_a[key_cols + attrs], preserve_index=False)
+        table, hashes = cls._sorted_unique(table.select(key_cols + attrs), key_cols)
+        logger.info(f"Built lookup index on {key_cols} with {len(hashes)} keys in {index_dir}")
+        return cls._write(index_dir, table, hashes,
+                          {"key_cols": key_cols, "attrs": attrs, "source_version": source_version,
+                           "hash_version": HASH_VERSION})
+
+    @classmethod
+    def open_or_build(
+        cls,
+        index_dir: Path,
+        df_a: Union[pd.DataFrame, pa.Table, Callable[[], Union[pd.DataFrame, pa.Table]]],
+        key_cols: List[str],
+        attrs: List[str],
+        source_version: Optional[str] = None
+    ) -> "LookupIndex":
+        """
+        索引存在且键列、属性列、source_version、哈希版本一致时直接打开，否则重建
+        df_a 可以是返回参考表的函数，索引有效时不会被调用
+        """
+        meta_path = Path(index_dir) / META_FILE
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if ((meta.get("key_cols"), meta.get("attrs"), meta.get("source_version"), meta.get("hash_version"))
+                    == (key_cols, attrs, source_version, HASH_VERSION)):
+                return cls(index_dir)
+        return cls.build(df_a() if callable(df_a) else df_a, key_cols, attrs, index_dir, source_version)
+
+    def _normalize_keys(self, keys: Union[pd.DataFrame, pa.Table]) -> pa.Table:
+        """把查询键转换为构建时的 Arrow 类型，保证哈希一致"""
+        if isinstance(keys, pd.DataFrame):
+            keys = pa.Table.from_pandas(keys[self.key_cols], preserve_index=False)
+        return keys.select(self.key_cols).cast(self.key_schema)
+
+    def _positions(self, keys: pa.Table) -> np.ndarray:
+        """返回每个查询键在索引中的行号，未命中为 -1"""
+        n = len(self.hashes)
+        query = self._hash(keys)
+        pos = np.searchsorted(self.hashes, query)
+        found = pos < n
+        pos = np.where(found, pos, 0)
+        if n:
+            found &= self.hashes[pos] == query
+
+        # 哈希相同不代表键相同：逐列校验，冲突时沿相同哈希的区间继续查找
+        if found.any():
+            # 在 Arrow 中比较，空值不会改变键列类型
+            stored = self.table.select(self.key_cols).take(pa.array(pos[found]))
+            given = keys.filter(pa.array(found))
+            same = np.ones(stored.num_rows, dtype=bool)
+            for col in self.key_cols:
+                a, b = stored.column(col), given.column(col)
+                same &= (pc.fill_null(pc.equal(a, b), False).to_numpy(zero_copy_only=False)
+                         | pc.and_(pc.is_null(a), pc.is_null(b)).to_numpy(zero_copy_only=False))
+            idx = np.flatnonzero(found)
+            for i in idx[~same]:
+                found[i] = False
+                j = pos[i] + 1
+                while j < n and self.hashes[j] == query[i]:
+                    if self.table.select(self.key_cols).slice(j, 1).equals(keys.slice(i, 1)):
+                        pos[i], found[i] = j, True
+                        break
+                    j += 1
+        return np.where(found, pos, -1)
+
+    def lookup(self, keys: Union[pd.DataFrame, pa.Table], as_pandas: bool = True) -> Union[pd.DataFrame, pa.Table]:
+        """
+        批量查找：返回与 keys 行一一对应的属性列，未命中的行为空值
+        DataFrame 输入时结果沿用 keys 的 index，可直接 join / concat
+        """
+        positions = self._positions(self._normalize_keys(keys))
+        result = self.table.select(self.attrs).take(pa.array(positions, mask=positions < 0))
+        if not as_pandas:
+            return result
+        df = result.to_pandas()
+        if isinstance(keys, pd.DataFrame):
+            df.index = keys.index
+        return df
+
+    def update(self, delta: Union[pd.DataFrame, pa.Table], source_version: Optional[str] = None) -> "LookupIndex":
+        """
+        增量更新：delta 中的键覆盖已有条目，新键追加；只对变化部分做哈希和键校验
+        :return: 更新后重新打开的索引
+        """
+        if isinstance(delta, pd.DataFrame):
+            delta = pa.Table.from_pandas(delta[self.key_cols + self.attrs], preserve_index=False)
+        delta = delta.select(self.key_cols + self.attrs).cast(self.table.schema)
+        delta, delta_hashes = self._sorted_unique(delta, self.key_cols)
+
+        replaced = self._positions(delta.select(self.key_cols))
+        keep = np.ones(len(self.hashes), dtype=bool)
+        keep[replaced[replaced >= 0]] = False
+
+        table = pa.concat_tables([self.table.filter(pa.array(keep)), delta])
+        hashes = np.concatenate([np.asarray(self.hashes)[keep], delta_hashes])
+        order = np.argsort(hashes, kind="stable")
+        logger.info(f"Lookup index update: {int((replaced >= 0).sum())} replaced, "
+                    f"{int((replaced < 0).sum())} added")
+
+        meta = dict(self.meta, source_version=source_version if source_version is not None else self.source_version)
+        # 释放 mmap 后再替换文件
+        self.hashes = None
+        self.table = None
+        return self._write(self.index_dir, table.take(pa.array(order)), hashes[order], meta)
+
+
+# 示例 / 回归检查：查询键和增量数据含空值时，其余键照常命中
+if __name__ == "__main__":
+    import tempfile
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with tempfile.TemporaryDirectory() as index_dir:
+        df_a = pd.DataFrame({'key': [1, 2, 3, 4], 'a': ['A1', 'A2', 'A3', 'A4']})
+        index = LookupIndex.build(df_a, ['key'], ['a'], index_dir)
+
+        found = index.lookup(pd.DataFrame({'key': [3, 4, np.nan]}))
+        print(found)
+        assert found['a'].tolist()[:2] == ['A3', 'A4'] and pd.isna(found['a'].iloc[2])
+
+        index = index.update(pd.DataFrame({'key': [4, np.nan], 'a': ['A4*', 'A-null']}))
+        found = index.lookup(pd.DataFrame({'key': [1, 4, np.nan, 5]}))
+        print(found)
+        assert found['a'].tolist()[:3] == ['A1', 'A4*', 'A-null'] and pd.isna(found['a'].iloc[3])
+        assert len(index) == 5
@@ -4,13 +4,20 @@ import re
 import logging
 import time
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.csv as pa_csv
-import psutil
+
+from compressed import CSV_PATTERNS
+from file_catalog import FileCatalog
+from parquet_cache import ParquetCache, cache_spec
+from predicates import Filter, filter_batches, filter_files, read_columns, to_expression
+from scheduler import plan_tasks
+from schema_cache import SchemaCache, default_schema_cache
 
 # --------------------------
 # 配置模块级日志
@@ -33,10 +40,16 @@ SAFE_PATH_PATTERN = re.compile(r'^[\w\-\*\.]+$')  # 允许通配符的安全路
 # 核心处理类（修复版）
 # --------------------------
 class CSVProcessor:
-    def __init__(self, column_types: Dict[str, pa.DataType], required_cols: List[str], max_workers: int = None):
+    def __init__(self, column_types: Dict[str, pa.DataType], required_cols: List[str], max_workers: int = None,
+                 catalog: Optional[FileCatalog] = None, schema_cache: Optional[SchemaCache] = None,
+                 cache: Optional[ParquetCache] = None):
         self.column_types = column_types
         self.required_cols = set(required_cols)
-        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4
+        self.columns = list(dict.fromkeys(required_cols))  # 保留调用方给出的列顺序
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.catalog = catalog  # 可选的持久化文件索引，避免每次重新遍历目录树
+        self.schema_cache = schema_cache or default_schema_cache()
+        self.cache = cache  # 可选的列式旁路缓存（opt-in）
         self._validate_types()
 
     def _validate_types(self):
@@ -68,8 +81,14 @@ class CSVProcessor:
                     expanded.append(path.resolve())  # 标准化路径
         return expanded
 
-    def find_files(self, versions: List[str], dates: List[str]) -> List[Path]:
-        """支持通配符的路径展开"""
+    def find_files(self, versions: List[str], dates: List[str], partition_filter: Optional[Filter] = None) -> List[Path]:
+        """
+        支持通配符的路径展开
+        :param partition_filter: 作用于 version/date/size/mtime_ns 的谓词，在打开文件前裁剪整文件
+        """
+        if self.catalog is not None:
+            return self.catalog.find_files(versions, dates, where=partition_filter)
+
         valid_files = []
         
         # 展开版本目录
@@ -84,31 +103,97 @@ class CSVProcessor:
             for date_dir in date_dirs:
                 region_dir = date_dir / REGION
                 if region_dir.exists():
-                    valid_files.extend(region_dir.glob("*.csv"))
+                    for pattern in CSV_PATTERNS:
+                        valid_files.extend(region_dir.glob(pattern))
+
+        if partition_filter is not None:
+            rows = []
+            for f in valid_files:
+                st = f.stat()
+                rows.append({"path": str(f), "version": f.parents[2].name, "date": f.parents[1].name,
+                             "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+            valid_files = [Path(r["path"]) for r in filter_files(rows, partition_filter)]
         
         return valid_files
 
     def _fast_column_check(self, file_path: Path) -> bool:
-        """快速列存在性检查（修复空文件处理）"""
-        try:
-            with open(file_path, 'rb') as f:
-                # 仅读取前1行元数据
-                table = pa_csv.read_csv(
-                    f,
-                    read_options=pa_csv.ReadOptions(
-                        skip_rows=1,
-                        autogenerate_column_names=False
-                    )
-                )
-                return self.required_cols.issubset(table.schema.names)
-        except pa.ArrowInvalid as e:
-            logger.debug(f"空文件或格式错误 {file_path}: {e}")
-            return False
-        except Exception as e:
-            logger.debug(f"列检查失败 {file_path}: {e}")
+        """快速列存在性检查：仅嗅探表头，结果按 (path, size, mtime) 缓存"""
+        columns = self.schema_cache.get_columns(file_path)
+        if columns is None:
+            logger.debug(f"空文件或表头读取失败 {file_path}")
             return False
+        return self.required_cols.issubset(columns)
+
+    def _read_file(self, file_path: Path, use_threads: bool = False, expr: Optional[pc.Expression] = None) -> pa.Table:
+        """读取单个文件；启用缓存时优先加载列式副本；提供 expr 时逐批过滤"""
+        def parse(columns: List[str]) -> pa.Table:
+            return pa_csv.read_csv(
+                file_path,
+                read_options=pa_csv.ReadOptions(use_threads=use_threads),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=self.column_types,
+                    include_columns=columns
+                )
+            )
+
+        if self.cache is not None:
+            # 缓存副本同时包含谓词引用的列，过滤后再投影回 self.columns
+            cached_cols = read_columns(self.columns, expr, self.schema_cache.get_columns(file_path) or [])
+            spec = cache_spec(cached_cols, self.column_types)
+            return self.cache.get_or_build(file_path, spec, lambda: parse(cached_cols),
+                                           columns=self.columns, filters=expr)
+        if expr is None:
+            return parse(self.columns)
+
+        # 流式读取：谓词所需的额外列只在过滤时使用，不满足条件的行不会被保留
+        reader = pa_csv.open_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(use_threads=use_threads),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=self.column_types,
+                include_columns=read_columns(self.columns, expr, self.schema_cache.get_columns(file_path) or [])
+            )
+        )
+        schema = pa.schema([reader.schema.field(c) for c in self.columns])
+        return pa.Table.from_batches(list(filter_batches(reader, expr, self.columns)), schema=schema)
+
+    def _read_batch(self, files: List[Path], use_threads: bool = False,
+                    expr: Optional[pc.Expression] = None) -> List[pa.Table]:
+        """顺序读取一批文件，单个文件失败只记录日志"""
+        tables = []
+        for file_path in files:
+            try:
+                tables.append(self._read_file(file_path, use_threads, expr))
+            except Exception as e:
+                logger.error(f"读取失败 {file_path}: {e}")
+        return tables
 
-    # 保持其他方法不变...
+    def process(self, versions: List[str], dates: List[str], batch_size: int = 100,
+                filters: Optional[Filter] = None, partition_filter: Optional[Filter] = None) -> pd.DataFrame:
+        """
+        查找、校验并读取文件，返回合并后的 DataFrame
+        按文件大小调度：大文件逐个用 Arrow 多线程解析，小文件打包成批（每批至多 batch_size 个）由线程池并行读取
+        :param filters: 行谓词（如 pc.field('price') > 10 或 [('user_id', 'in', {...})]），读取时逐批求值
+        :param partition_filter: 作用于 version/date 等文件元数据的谓词，在打开文件前裁剪
+        """
+        expr = to_expression(filters)
+        files = [f for f in self.find_files(versions, dates, partition_filter) if self._fast_column_check(f)]
+        if not files:
+            logger.warning("没有通过列校验的文件")
+            return pd.DataFrame(columns=self.columns)
+
+        large, batches = plan_tasks([str(f) for f in files], max_files=batch_size, min_tasks=self.max_workers)
+        tables = []
+        for file_path, _ in large:
+            tables.extend(self._read_batch([Path(file_path)], use_threads=True, expr=expr))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._read_batch, [Path(p) for p, _ in batch], False, expr) for batch in batches]
+            for future in as_completed(futures):
+                tables.extend(future.result())
+
+        if not tables:
+            return pd.DataFrame(columns=self.columns)
+        return pa.concat_tables(tables).to_pandas(self_destruct=True)
 
 # --------------------------
 # 测试用例
@@ -124,7 +209,8 @@ if __name__ == "__main__":
     processor = CSVProcessor(
         column_types=column_types,
         required_cols=["user_id", "price"],
-        max_workers=8
+        max_workers=8,
+        catalog=FileCatalog(MAIN_FOLDER)
     )
     
     # 测试通配符
@@ -135,56 +221,3 @@ if __name__ == "__main__":
     )
     
     print(f"加载到 {len(df)} 条记录")
-
-----------------------
-def find_files(self, versions: List[str], dates: List[str]) -> List[Path]:
-    """
-    生成有效文件路径列表，支持通配符（例如 "*"）
-    :param versions: 版本列表（支持通配符*）
-    :param dates: 日期列表（支持通配符*）
-    :return: 有效文件路径列表
-    """
-    valid_files = []
-    for version_pattern in versions:
-        # 如果版本参数中包含通配符，则使用 glob 扩展匹配
-        if "*" in version_pattern:
-            version_dirs = [p for p in MAIN_FOLDER.glob(version_pattern) if p.is_dir()]
-            if not version_dirs:
-                logger.debug(f"没有匹配到版本目录: {version_pattern}")
-                continue
-        else:
-            if not self._is_safe_path(version_pattern):
-                logger.warning(f"跳过非法版本路径: {version_pattern}")
-                continue
-            version_dir = MAIN_FOLDER / version_pattern
-            if not version_dir.exists():
-                logger.debug(f"版本目录不存在: {version_dir}")
-                continue
-            version_dirs = [version_dir]
-        
-        for version_dir in version_dirs:
-            for date_pattern in dates:
-                # 同理，日期中如果包含通配符则使用 glob 进行扩展
-                if "*" in date_pattern:
-                    date_dirs = [p for p in version_dir.glob(date_pattern) if p.is_dir()]
-                    if not date_dirs:
-                        logger.debug(f"没有匹配到日期目录: {date_pattern} in {version_dir}")
-                        continue
-                else:
-                    if not self._is_safe_path(date_pattern):
-                        logger.warning(f"跳过非法日期路径: {date_pattern}")
-                        continue
-                    date_dir = version_dir / date_pattern
-                    if not date_dir.exists():
-                        logger.debug(f"日期目录不存在: {date_dir}")
-                        continue
-                    date_dirs = [date_dir]
-                
-                for date_dir in date_dirs:
-                    target_dir = date_dir / REGION
-                    if target_dir.exists() and target_dir.is_dir():
-                        valid_files.extend(target_dir.glob("*.csv"))
-                    else:
-                        logger.debug(f"区域目录不存在: {target_dir}")
-    
-    return valid_files
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "csv_catalog" / "columnar"
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+PathLike = Union[str, Path]
+
+
+def _normalize(spec):
+    if isinstance(spec, dict):
+        return {str(k): _normalize(v) for k, v in spec.items()}
+    if isinstance(spec, (list, tuple, set)):
+        return sorted(_normalize(v) for v in spec)
+    return str(spec)
+
+
+def schema_hash(spec) -> str:
+    """列类型/必需列定义的稳定哈希（与键顺序无关，pyarrow 类型按字符串处理）"""
+    return hashlib.sha1(json.dumps(_normalize(spec), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _type_name(dtype) -> str:
+    """pyarrow 类型与其别名字符串统一为类型名（'float64' 与 pa.float64() 均为 'double'）"""
+    if isinstance(dtype, str):
+        try:
+            return str(pa.type_for_alias(dtype))
+        except ValueError:
+            return dtype  # 非 pyarrow 别名（如 CoercionPlan 的 'int' / 'date'）
+    return str(dtype)
+
+
+def cache_spec(columns: Optional[List[str]], column_types: Dict[str, object], reader: str = "arrow") -> dict:
+    """
+    缓存条目的读取定义；CLI --rebuild 与各读取器共用，同一种读取无论从哪个入口发起都得到相同的缓存键
+    :param columns: 读入的列（含谓词所需的列）；为空表示全部列
+    :param column_types: 列类型，pyarrow 类型或别名字符串
+    :param reader: 产出缓存内容的方式：'arrow'（pyarrow.csv 按 column_types 读取）或
+                   'coercion'（coercion.CoercionPlan 按 int/float/date/string 转换，见 csv_extract）
+    """
+    return {
+        "reader": reader,
+        "column_types": {str(c): _type_name(t) for c, t in column_types.items()},
+        "required_cols": sorted(columns or ()),
+    }
+
+
+class ParquetCache:
+    """
+    CSV -> 列式文件 的旁路缓存
+    - 缓存键：源文件 path + size + mtime + 类型定义哈希，源文件变化后自动失效
+    - 命中时按列投影读取列式副本，跳过文本解析
+    - 总大小超过 max_bytes 时按最近访问时间（文件 mtime）做 LRU 淘汰
+    """
+
+    def __init__(
+        self,
+        cache_dir: PathLike = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        fmt: str = "parquet",
+        rebuild: bool = False
+    ):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported cache format: {fmt}")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.rebuild = rebuild  # True 时忽略已有缓存并重新生成
+        self._lock = threading.Lock()
+        self._total_bytes = sum(e.stat().st_size for e in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self):
+        suffix = FORMATS[self.fmt]
+        return [e for e in os.scandir(self.cache_dir) if e.is_file() and e.name.endswith(suffix)]
+
+    def cache_path(self, file_path: PathLike, spec) -> Optional[Path]:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        key = hashlib.sha1(
+            f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}|{schema_hash(spec)}".encode()
+        ).hexdigest()
+        return self.cache_dir / f"{key}{FORMATS[self.fmt]}"
+
+    def load(
+        self,
+        file_path: PathLike,
+        spec,
+        columns: Optional[List[str]] = None,
+        filters: Optional[pc.Expression] = None
+    ) -> Optional[pa.Table]:
+        """命中时返回（按 columns 投影、按 filters 过滤的）列式副本，否则返回 None"""
+        path = self.cache_path(file_path, spec)
+        if path is None or self.rebuild or not path.exists():
+            return None
+        try:
+            if self.fmt == "parquet":
+                # 谓词下推到 Parquet 行组
+                table = pq.read_table(path, columns=columns, filters=filters)
+            elif filters is not None:
+                table = feather.read_table(path).filter(filters)
+                table = table.select(columns) if columns is not None else table
+            else:
+                table = feather.read_table(path, columns=columns)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # 记录最近访问时间，供 LRU 淘汰使用
+        except OSError:
+            pass
+        self.hits += 1
+        return table
+
+    def store(self, file_path: PathLike, spec, table: pa.Table):
+        """原子写入列式副本（先写临时文件再 rename），然后按需淘汰"""
+        path = self.cache_path(file_path, spec)
+        if path is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            if self.fmt == "parquet":
+                pq.write_table(table, tmp)
+            else:
+                feather.write_feather(table, tmp)
+            size = os.path.getsize(tmp)
+            replaced = path.stat().st_size if path.exists() else 0
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        with self._lock:
+            self._total_bytes += size - replaced
+        self.evict()
+
+    def get_or_build(
+        self,
+        file_path: PathLike,
+        spec,
+        build: Callable[[], pa.Table],
+        columns: Optional[List[str]] = None,
+        filters: Optional[pc.Expression] = None
+    ) -> pa.Table:
+        """命中直接返回；未命中时调用 build() 解析 CSV 并写入缓存（缓存的是未过滤的完整副本）"""
+        table = self.load(file_path, spec, columns, filters)
+        if table is not None:
+            return table
+        self.misses += 1
+        table = build()
+        try:
+            self.store(file_path, spec, table)
+        except Exception as e:
+            logger.warning(f"Failed to cache {file_path}: {e}")
+        if filters is not None:
+            table = table.filter(filters)
+        return table.select(columns) if columns is not None else table
+
+    def _remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """按最近访问时间淘汰，直到总大小不超过上限；返回删除的条目数"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        if self._total_bytes <= limit:
+            return 0
+        removed = 0
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime_ns)
+            total = sum(e.stat().st_size for e in entries)
+            for entry in entries:
+                if total <= limit:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.unlink(entry.path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._total_bytes = total
+        logger.info(f"Evicted {removed} cache entries from {self.cache_dir}")
+        return removed
+
+    def clear(self) -> int:
+        return self.evict(max_bytes=0)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries()), "bytes": self._total_bytes}
+
+
+# 命令行：查看/清理/重建缓存
+if __name__ == "__main__":
+    import argparse
+    import glob
+
+    import pyarrow.csv as pa_csv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="CSV -> Parquet/Feather conversion cache")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--clear", action="store_true", help="remove every cache entry")
+    parser.add_argument("--evict", action="store_true", help="apply the size limit now")
+    parser.add_argument("--rebuild", metavar="GLOB", help="re-convert every CSV matching GLOB")
+    parser.add_argument("--columns", default="",
+                        help="column types for --rebuild, e.g. user_id:string,price:float32")
+    parser.add_argument("--coerce", action="store_true",
+                        help="--columns are csv_extract kinds (int/float/date/string) converted by CoercionPlan")
+    args = parser.parse_args()
+
+    cache = ParquetCache(args.cache_dir, args.max_bytes, args.format, rebuild=bool(args.rebuild))
+    if args.clear:
+        cache.clear()
+    if args.rebuild:
+        column_types = dict(item.split(":", 1) for item in args.columns.split(",") if item)
+        if args.coerce:
+            from coercion import CoercionPlan
+
+            plan = CoercionPlan(column_types)
+            spec = cache_spec(list(column_types), column_types, reader="coercion")
+            build = lambda path: plan.read_csv(path, use_threads=False)[0]
+        else:
+            column_types = {name: pa.type_for_alias(dtype) for name, dtype in column_types.items()}
+            spec = cache_spec(list(column_types), column_types)
+            build = lambda path: pa_csv.read_csv(
+                path,
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=column_types,
+                    include_columns=list(column_types) or None
+                )
+            )
+        for csv_path in glob.glob(args.rebuild, recursive=True):
+            cache.get_or_build(csv_path, spec, lambda: build(csv_path))
+    if args.evict:
+        cache.evict()
+    print(cache.stats())
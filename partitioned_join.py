@@ -0,0 +1,187 @@
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from fallback_join import A_ROW, MATCH_LEVEL, fallback_join
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_PARTITIONS = 64
+JOINED = "joined"            # df_a left join df_b（完整键）
+B_UNMATCHED = "b_unmatched"  # 完整键未匹配的 df_b 行，附带按降级键取回的 df_a 属性
+A_UNMATCHED = "a_unmatched"  # 与上述未匹配行按降级键对应的 df_a 行（每个降级键一行）
+OUTPUTS = (JOINED, B_UNMATCHED, A_UNMATCHED)
+# 键列转 pandas 时使用可空类型：含空值的整数列不会退化为 float64，同一个键的哈希与所在块是否含空值无关
+NULLABLE_DTYPES = {
+    pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(), pa.uint16(): pd.UInt16Dtype(), pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(), pa.bool_(): pd.BooleanDtype(),
+    pa.float32(): pd.Float32Dtype(), pa.float64(): pd.Float64Dtype(),
+    pa.string(): pd.StringDtype(), pa.large_string(): pd.StringDtype(),
+}
+
+Source = Union[pd.DataFrame, pa.Table, Iterable[Union[pd.DataFrame, pa.Table, pa.RecordBatch]]]
+
+
+def _iter_tables(source: Source) -> Iterator[pa.Table]:
+    """把 DataFrame / Table / 分块迭代器统一为 Arrow Table 序列"""
+    if isinstance(source, (pd.DataFrame, pa.Table, pa.RecordBatch)):
+        source = [source]
+    for chunk in source:
+        if isinstance(chunk, pd.DataFrame):
+            chunk = pa.Table.from_pandas(chunk, preserve_index=False)
+        elif isinstance(chunk, pa.RecordBatch):
+            chunk = pa.Table.from_batches([chunk])
+        yield chunk
+
+
+def hash_keys(keys: pa.Table) -> np.ndarray:
+    """逐行计算键列的 uint64 哈希；同一 Arrow 类型下结果只取决于键值本身"""
+    return pd.util.hash_pandas_object(keys.to_pandas(types_mapper=NULLABLE_DTYPES.get), index=False).to_numpy()
+
+
+def partition_ids(table: pa.Table, keys: List[str], n_partitions: int) -> np.ndarray:
+    """按键列哈希计算每行的分区号；两侧键列类型需一致，同一键才会落入同一分区"""
+    hashes = hash_keys(table.select(keys))
+    return (hashes % np.uint64(n_partitions)).astype(np.int64)
+
+
+def spill_partitions(
+    source: Source,
+    keys: List[str],
+    n_partitions: int,
+    out_dir: Path
+) -> Tuple[Dict[int, str], Optional[pa.Schema]]:
+    """
+    按 hash(keys) 把输入逐块写入 out_dir/part-XXXXX.arrow，内存中只保留当前块
+    :return: ({分区号: IPC 文件路径}, 输入的 schema)
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writers: Dict[int, Tuple[pa.OSFile, ipc.RecordBatchFileWriter]] = {}
+    schema = None
+    try:
+        for chunk in _iter_tables(source):
+            if schema is None:
+                schema = chunk.schema
+            elif chunk.schema != schema:
+                chunk = chunk.select(schema.names).cast(schema)
+            if chunk.num_rows == 0:
+                continue
+            pids = partition_ids(chunk, keys, n_partitions)
+            order = np.argsort(pids, kind="stable")
+            chunk = chunk.take(pa.array(order))
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(pids, minlength=n_partitions))])
+            for pid in np.flatnonzero(np.diff(bounds)):
+                if pid not in writers:
+                    sink = pa.OSFile(str(out_dir / f"part-{pid:05d}.arrow"), "wb")
+                    writers[pid] = (sink, ipc.new_file(sink, schema))
+                writers[pid][1].write_table(chunk.slice(bounds[pid], bounds[pid + 1] - bounds[pid]))
+    finally:
+        for sink, writer in writers.values():
+            writer.close()
+            sink.close()
+    return {int(pid): str(out_dir / f"part-{pid:05d}.arrow") for pid in writers}, schema
+
+
+def _load_partition(path: Optional[str], schema: pa.Schema) -> pd.DataFrame:
+    if path is None:
+        return schema.empty_table().to_pandas()
+    with pa.memory_map(path) as source:
+        return ipc.open_file(source).read_all().to_pandas()
+
+
+def _write_output(df: pd.DataFrame, path: Path) -> Optional[str]:
+    if df.empty:
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+    return str(path)
+
+
+def _join_partition(
+    pid: int,
+    a_path: Optional[str],
+    b_path: Optional[str],
+    a_schema: pa.Schema,
+    b_schema: pa.Schema,
+    keys: List[str],
+    fallback_keys: List[str],
+    attrs: Optional[List[str]],
+    output_dir: str
+) -> Tuple[int, Dict[str, Optional[str]]]:
+    """在 worker 进程中处理一对分区，结果写为 Parquet，只返回路径"""
+    df_a = _load_partition(a_path, a_schema)
+    df_b = _load_partition(b_path, b_schema)
+    joined = fallback_join(df_a, df_b, key_levels=[keys, fallback_keys], attrs=attrs)
+    b_unmatched = pd.concat([joined.fallback.drop(columns=[MATCH_LEVEL, A_ROW]), joined.unmatched],
+                            ignore_index=True)
+    a_unmatched = df_a.iloc[joined.fallback[A_ROW].unique()]
+
+    name = f"part-{pid:05d}.parquet"
+    output_dir = Path(output_dir)
+    return pid, {
+        JOINED: _write_output(joined.matched, output_dir / JOINED / name),
+        B_UNMATCHED: _write_output(b_unmatched, output_dir / B_UNMATCHED / name),
+        A_UNMATCHED: _write_output(a_unmatched, output_dir / A_UNMATCHED / name),
+    }
+
+
+def partitioned_fallback_join(
+    df_a: Source,
+    df_b: Source,
+    keys: List[str],
+    fallback_keys: List[str],
+    output_dir: Path,
+    attrs: Optional[List[str]] = None,
+    n_partitions: int = DEFAULT_PARTITIONS,
+    max_workers: int = None,
+    spill_dir: str = None
+) -> Iterator[Tuple[int, Dict[str, Optional[str]]]]:
+    """
+    超出内存的降级键连接：两侧先按 hash(fallback_keys) 落盘为 Arrow IPC 分区，
+    再在进程池中逐对分区执行 fallback_join；同一降级键的行必在同一分区，因此结果与整体执行一致
+
+    df_a / df_b 可以是 DataFrame、Arrow Table，或分块迭代器（例如 stream_reader.iter_batches 的输出），
+    输入不会整体驻留内存；单个 worker 的内存约为一对分区的大小，可通过 n_partitions 调节
+
+    结果写入 output_dir/{joined,b_unmatched,a_unmatched}/part-XXXXX.parquet，
+    每完成一个分区即 yield (分区号, {结果名: 路径或 None})，可用 pyarrow.dataset 按目录读取
+
+    :param keys: 第一次连接的完整键，例如 ['key', 'sub_group']
+    :param fallback_keys: 未匹配行使用的降级键（必须是 keys 的子集），例如 ['key']
+    :param spill_dir: 分区临时文件的父目录，默认系统临时目录（不使用 /dev/shm，避免占用内存）
+    """
+    if not set(fallback_keys) <= set(keys):
+        raise ValueError("fallback_keys must be a subset of keys")
+    work_dir = tempfile.mkdtemp(prefix="partitioned_join_", dir=spill_dir)
+    try:
+        a_parts, a_schema = spill_partitions(df_a, fallback_keys, n_partitions, Path(work_dir) / "a")
+        b_parts, b_schema = spill_partitions(df_b, fallback_keys, n_partitions, Path(work_dir) / "b")
+        if a_schema is None or b_schema is None:
+            raise ValueError("both inputs must contain at least one chunk")
+        pids = sorted(set(a_parts) | set(b_parts))
+        logger.info(f"Joining {len(pids)} partitions ({len(a_parts)} from df_a, {len(b_parts)} from df_b)")
+
+        max_workers = min(max_workers or os.cpu_count() or 1, max(1, len(pids)))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_join_partition, pid, a_parts.get(pid), b_parts.get(pid), a_schema, b_schema,
+                                keys, fallback_keys, attrs, str(output_dir))
+                for pid in pids
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
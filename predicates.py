@@ -0,0 +1,69 @@
+import logging
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# 谓词既可以是 pyarrow.compute.Expression，
+# 也可以是 parquet 风格的 DNF 列表，例如 [('price', '>', 10), ('user_id', 'in', {'u1', 'u2'})]
+Filter = Union[pc.Expression, Sequence[Tuple], Sequence[Sequence[Tuple]]]
+
+
+def to_expression(filters: Optional[Filter]) -> Optional[pc.Expression]:
+    """把 Expression 或 DNF 元组列表统一为 Expression；None/空列表返回 None"""
+    if filters is None:
+        return None
+    if isinstance(filters, pc.Expression):
+        return filters
+    if len(filters) == 0:
+        return None
+    return pq.filters_to_expression(filters)
+
+
+def referenced_columns(expr: Optional[pc.Expression], candidates: Iterable[str]) -> List[str]:
+    """
+    返回谓词可能引用的列（candidates 中出现在表达式文本里的列名）
+    Expression 没有公开引用字段的接口，这里取保守的超集：多读一列只影响性能，不影响正确性
+    """
+    if expr is None:
+        return []
+    text = str(expr)
+    return [c for c in candidates if c in text]
+
+
+def read_columns(columns_list: Optional[List[str]], expr: Optional[pc.Expression], header: Iterable[str]) -> Optional[List[str]]:
+    """投影列 + 谓词所需列（保持 columns_list 的顺序）；columns_list 为空表示读取全部列"""
+    if not columns_list:
+        return None
+    extra = [c for c in referenced_columns(expr, header) if c not in columns_list]
+    return list(columns_list) + extra
+
+
+def filter_batches(
+    batches: Iterable[pa.RecordBatch],
+    expr: Optional[pc.Expression],
+    columns_list: Optional[List[str]] = None
+) -> Iterator[pa.RecordBatch]:
+    """逐批应用谓词并投影到 columns_list，被过滤掉的行不会进入后续环节"""
+    for batch in batches:
+        if expr is not None:
+            batch = batch.filter(expr)
+        if columns_list:
+            batch = batch.select(columns_list)
+        if batch.num_rows:
+            yield batch
+
+
+def filter_files(rows: List[dict], partition_filter: Optional[Filter]) -> List[dict]:
+    """
+    在文件元数据（path/version/date/size/mtime_ns）上求值分区谓词，打开文件前裁剪整文件
+    例如 pc.field('date') >= '2023-01-15'
+    """
+    expr = to_expression(partition_filter)
+    if expr is None or not rows:
+        return rows
+    keep = set(pa.Table.from_pylist(rows).filter(expr).column('path').to_pylist())
+    return [r for r in rows if r['path'] in keep]
@@ -1,16 +1,25 @@
-Share
-
-
-You said:
-import os
 from pathlib import Path
 import pandas as pd
-import pyarrow.csv as pv
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Dict, Optional, Set
+import pyarrow as pa
+import psutil
+from typing import List, Dict, Optional, Set, Iterator, Union
 import logging
 import time
 import re
+from contextlib import nullcontext
+
+import async_pipeline
+from aggregation import Agg, aggregate_files
+from checkpoint import Checkpoint
+from compaction import compact_table, format_report, to_pandas as compact_to_pandas
+from compressed import CSV_PATTERNS
+from dedup import read_deduplicated
+from file_catalog import FileCatalog
+from incremental import IncrementalLoader
+from instrumentation import PipelineMetrics
+from predicates import Filter
+from schema_cache import SchemaCache, default_schema_cache
+from stream_reader import DEFAULT_MEMORY_BUDGET, iter_batches, read_table
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,10 +34,14 @@ def validate_input(*paths: str) -> bool:
     """防止路径遍历攻击和非法字符"""
     return all(SAFE_PATH_PATTERN.match(p) for p in paths)
 
-def get_file_paths(versions: List[str], dates: List[str]) -> List[str]:
-    """使用生成器优化大规模路径遍历"""
+def get_file_paths(versions: List[str], dates: List[str], catalog: Optional[FileCatalog] = None) -> List[str]:
+    """使用生成器优化大规模路径遍历（提供 catalog 时直接查询持久化索引）"""
     if not all(validate_input(v, d) for v in versions for d in dates):
         raise ValueError("Invalid version or date format")
+
+    if catalog is not None:
+        yield from (str(p) for p in catalog.find_files(versions, dates))
+        return
     
     for version in versions:
         version_path = MAIN_FOLDER / version
@@ -38,101 +51,172 @@ def get_file_paths(versions: List[str], dates: List[str]) -> List[str]:
         for date in dates:
             date_path = version_path / date / REGION
             if date_path.exists():
-                yield from (str(p) for p in date_path.glob("*.csv"))
+                for pattern in CSV_PATTERNS:
+                    yield from (str(p) for p in date_path.glob(pattern))
 
-def fast_check_columns(file_path: str, required_cols: Set[str]) -> bool:
-    """快速检查CSV文件列名而不加载全量数据"""
-    try:
-        schema = pv.read_csv(
-            file_path,
-            read_options=pv.ReadOptions(skip_rows=0, autogenerate_column_names=False)
-        ).schema
-        return required_cols.issubset(schema.names)
-    except Exception as e:
-        logger.debug(f"Column check failed for {file_path}: {e}")
-        return False
-
-def read_csv_file(file_path: str, columns_list: List[str], column_types: Dict[str, str]) -> Optional[pd.DataFrame]:
-    """使用PyArrow原生类型转换优化内存使用"""
-    try:
-        # 显式关闭PyArrow多线程以避免资源竞争
-        table = pv.read_csv(
-            file_path,
-            read_options=pv.ReadOptions(use_threads=False),
-            convert_options=pv.ConvertOptions(
-                column_types=column_types,
-                include_columns=columns_list
-            )
-        )
-        
-        # 直接转换到Pandas避免中间对象
-        return table.to_pandas(split_blocks=True, self_destruct=True)
-    
-    except Exception as e:
-        logger.error(f"Critical error reading {file_path}: {e}", exc_info=True)
-        return None
+def fast_check_columns(file_path: str, required_cols: Set[str], schema_cache: Optional[SchemaCache] = None) -> bool:
+    """快速检查CSV文件列名而不加载全量数据（仅嗅探表头，结果按 path/size/mtime 缓存）"""
+    return (schema_cache or default_schema_cache()).has_columns(file_path, required_cols)
 
 def parallel_read(
     file_paths: List[str],
     columns_list: List[str],
     column_types: Dict[str, str],
-    max_workers: int = None
+    max_workers: int = None,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    compact: bool = False,
+    checkpoint_dir: Optional[Path] = None,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True
 ) -> pd.DataFrame:
-    """基于进程池的并行读取，优化CPU密集型任务"""
-    required_cols = set(columns_list)
-    valid_paths = [p for p in file_paths if fast_check_columns(p, required_cols)]
-    
-    if not valid_paths:
+    """
+    基于进程池的并行读取：worker 经 IPC 文件回传 Arrow 数据，最后只做一次 to_pandas
+    filters（如 pc.field('price') > 10）在 worker 内逐批求值，未通过的行不会跨进程传输
+    metrics 记录各阶段耗时与文件计数（见 instrumentation.PipelineMetrics）
+    compact=True 时在合并表上做紧凑化：低基数字符串/日期 -> categorical、整数降位、哨兵值 -> 空值（见 compaction.py）
+    checkpoint_dir 指定时每个文件完成即落盘，中断后重跑从断点继续；解析失败的文件被隔离，
+    在文件修改前不再重试（见 checkpoint.py）
+    split_bytes / newlines_in_values：显式开启大文件按字节范围拆分并行解析（见 stream_reader.iter_file_tables），
+    例如 split_bytes=SPLIT_FILE_BYTES, newlines_in_values=False；断点模式按文件登记，不拆分
+    """
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, columns_list, column_types, filters)
+        try:
+            table = checkpoint.run(file_paths, max_workers, metrics)
+        finally:
+            checkpoint.close()
+    else:
+        table = read_table(file_paths, columns_list, column_types, max_workers, filters=filters, metrics=metrics,
+                           split_bytes=split_bytes, newlines_in_values=newlines_in_values)
+    if table is None:
         return pd.DataFrame()
-    
-    # 动态调整进程池大小
-    max_workers = max_workers or min(os.cpu_count() or 1, len(valid_paths))
-    logger.info(f"Processing {len(valid_paths)} files with {max_workers} workers")
-    
-    # 使用进程池规避GIL限制
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(read_csv_file, p, columns_list, column_types): p for p in valid_paths}
-        
-        results = []
-        for future in as_completed(futures):
-            file_path = futures[future]
-            try:
-                df = future.result()
-                if df is not None:
-                    results.append(df)
-                    # 及时释放内存
-                    if len(results) % 100 == 0:
-                        pd.concat(results, copy=False).reset_index(drop=True)
-                        results.clear()
-            except Exception as e:
-                logger.error(f"Failed processing {file_path}: {e}")
-    
-    return pd.concat(results, ignore_index=True, copy=False) if results else pd.DataFrame()
+    if compact:
+        with metrics.stage("compact") if metrics is not None else nullcontext():
+            table, report = compact_table(table)
+        logger.info(format_report(report))
+    with metrics.stage("to_pandas") if metrics is not None else nullcontext():
+        if compact:
+            return compact_to_pandas(table)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def stream_main(
+    versions: List[str],
+    dates: List[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    catalog: Optional[FileCatalog] = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    as_pandas: bool = False,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True
+) -> Iterator[Union[pa.RecordBatch, pd.DataFrame]]:
+    """
+    main 的流式版本：按完成顺序逐批产出，适合在超出内存的数据集上做下游聚合
+    split_bytes / newlines_in_values 见 parallel_read
+    """
+    yield from iter_batches(get_file_paths(versions, dates, catalog), columns_list, column_types,
+                            max_workers, memory_budget=memory_budget, as_pandas=as_pandas, filters=filters,
+                            metrics=metrics, split_bytes=split_bytes, newlines_in_values=newlines_in_values)
+
+def aggregate_main(
+    versions: List[str],
+    dates: List[str],
+    keys: List[str],
+    aggs: List[Agg],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    catalog: Optional[FileCatalog] = None,
+    filters: Optional[Filter] = None
+) -> pd.DataFrame:
+    """
+    聚合模式：只需要分组统计（如 每个 user_id 每天的 price 合计）时使用，
+    worker 端做部分聚合，父进程树形归约，不回传原始行（见 aggregation.py）
+    例如 aggregate_main(versions, dates, ['user_id'], [('price', 'sum'), ('user_id', 'approx_distinct')], types)
+    """
+    start_time = time.perf_counter()
+    df = aggregate_files(get_file_paths(versions, dates, catalog), keys, aggs, column_types,
+                         max_workers, filters=filters)
+    logger.info(f"Aggregated into {len(df)} groups in {time.perf_counter() - start_time:.2f}s")
+    return df
 
 def main(
     versions: List[str],
     dates: List[str],
     columns_list: List[str],
     column_types: Dict[str, str],
-    max_workers: int = None
+    max_workers: int = None,
+    catalog: Optional[FileCatalog] = None,
+    filters: Optional[Filter] = None,
+    incremental_dir: Optional[Path] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    pipelined: bool = False,
+    checkpoint_dir: Optional[Path] = None,
+    dedup: Optional[str] = None,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True
 ) -> pd.DataFrame:
-    """全流程优化版本"""
+    """
+    全流程优化版本
+    :param incremental_dir: 增量模式的分区数据集目录；只读取新增/变化的文件，返回窗口内全部已入库数据
+    :param metrics: 传入时记录各阶段耗时/计数，结束时发送汇总事件（导出器在此时写出）
+    :param pipelined: 目录列举、表头检查/预取与解析并发进行（见 async_pipeline.py），
+                      适合元数据延迟高的网络存储
+    :param checkpoint_dir: 可恢复模式的断点目录（见 parallel_read）
+    :param dedup: 内容去重策略 keep_latest / keep_all：不同版本下字节相同的文件只解析一次（见 dedup.py）
+    :param split_bytes: 大文件按字节范围拆分并行解析的阈值，默认不拆分；需同时声明 newlines_in_values=False
+                        （字段值内没有换行）且读取的列类型全部声明，否则按整文件读取（见 parallel_read）
+    """
     start_time = time.perf_counter()
-    memory_start = psutil.Process().memory_info().rss // 1024**2  # 需要import psutil
+    memory_start = psutil.Process().memory_info().rss // 1024**2
     
     try:
-        file_paths = list(get_file_paths(versions, dates))
-        if not file_paths:
-            logger.warning("No valid files found")
-            return pd.DataFrame()
-        
-        logger.info(f"Found {len(file_paths)} potential files")
-        
-        df = parallel_read(file_paths, columns_list, column_types, max_workers)
+        if not all(validate_input(v, d) for v in versions for d in dates):
+            raise ValueError("Invalid version or date format")
+
+        if incremental_dir is not None:
+            loader = IncrementalLoader(incremental_dir, MAIN_FOLDER, columns_list, column_types, catalog)
+            try:
+                loader.refresh(versions, dates, max_workers)
+                df = loader.load(versions, dates, filters=filters).to_pandas(self_destruct=True)
+            finally:
+                loader.close()
+            time_elapsed = time.perf_counter() - start_time
+            logger.info(f"Loaded {len(df)} rows incrementally in {time_elapsed:.2f}s")
+            return df
+
+        if pipelined:
+            table = async_pipeline.read_table(MAIN_FOLDER, versions, dates, columns_list, column_types,
+                                              max_workers, catalog=catalog, subdir=REGION,
+                                              filters=filters, metrics=metrics)
+            df = table.to_pandas(split_blocks=True, self_destruct=True) if table is not None else pd.DataFrame()
+        else:
+            with metrics.stage("discovery") if metrics is not None else nullcontext():
+                file_paths = list(get_file_paths(versions, dates, catalog))
+            if not file_paths:
+                logger.warning("No valid files found")
+                return pd.DataFrame()
+
+            logger.info(f"Found {len(file_paths)} potential files")
+
+            if dedup is not None:
+                table = read_deduplicated(file_paths, columns_list, column_types, max_workers, dedup,
+                                          catalog=catalog, filters=filters, metrics=metrics)
+                df = table.to_pandas(split_blocks=True, self_destruct=True) if table is not None else pd.DataFrame()
+            else:
+                df = parallel_read(file_paths, columns_list, column_types, max_workers, filters, metrics,
+                                   checkpoint_dir=checkpoint_dir, split_bytes=split_bytes,
+                                   newlines_in_values=newlines_in_values)
         
         time_elapsed = time.perf_counter() - start_time
         memory_used = psutil.Process().memory_info().rss // 1024**2 - memory_start
         logger.info(f"Processed {len(df)} rows in {time_elapsed:.2f}s | Memory: +{memory_used}MB")
+        if metrics is not None:
+            metrics.finish()
+            logger.info(metrics.summary_line())
         return df
     except Exception as e:
         logger.critical(f"Pipeline failed: {e}", exc_info=True)
@@ -140,8 +224,6 @@ def main(
 
 # 示例用法
 if __name__ == "__main__":
-    import psutil  # 需安装psutil
-    
     column_types = {
         'column_a': 'string',
         'column_b': 'float64',
@@ -159,80 +241,3 @@ if __name__ == "__main__":
         print(result.info(memory_usage='deep'))
     except KeyboardInterrupt:
         logger.warning("Process interrupted by user")
-def parallel_read(...):
-    required_cols = set(columns_list)
-    valid_paths = [p for p in file_paths if fast_check_columns(p, required_cols)]
-    if not valid_paths:
-        return pd.DataFrame()
-
-    max_workers = max_workers or min(os.cpu_count() or 1, len(valid_paths))
-    logger.info(f"Processing {len(valid_paths)} files with {max_workers} workers")
-    
-    chunks = []      # To store intermediate concatenated chunks
-    results = []     # To store individual DataFrames temporarily
-
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(read_csv_file, p, columns_list, column_types): p for p in valid_paths}
-        for future in as_completed(futures):
-            file_path = futures[future]
-            try:
-                df = future.result()
-                if df is not None:
-                    results.append(df)
-                    # Every 100 files, concatenate and store the chunk, then clear results.
-                    if len(results) >= 100:
-                        chunk_df = pd.concat(results, copy=False).reset_index(drop=True)
-                        chunks.append(chunk_df)
-                        results.clear()
-            except Exception as e:
-                logger.error(f"Failed processing {file_path}: {e}")
-
-    # Concatenate any remaining DataFrames
-    if results:
-        chunks.append(pd.concat(results, copy=False).reset_index(drop=True))
-    
-    # Final concatenation of all chunks
-    return pd.concat(chunks, ignore_index=True, copy=False) if chunks else pd.DataFrame()
-import pyarrow.csv as pa_csv
-from pyarrow.csv import ReadOptions, ConvertOptions
-from concurrent.futures import ThreadPoolExecutor
-import logging
-
-def check_columns(path: str, required_cols: list) -> bool:
-    """无数据读取的快速列检查"""
-    try:
-        # 仅读取第一行元数据
-        table = pa_csv.read_csv(
-            path,
-            read_options=ReadOptions(skip_rows=1, autogenerate_column_names=False)
-        )
-        return set(required_cols).issubset(table.schema.names)
-    except Exception as e:
-        logging.debug(f"Column check failed for {path}: {e}")
-        return False
-
-def process_data_batch(file_paths: list, required_cols: list) -> pd.DataFrame:
-    # 第一阶段：并行过滤有效文件
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        valid_mask = list(executor.map(
-            lambda p: check_columns(p, required_cols),
-            file_paths
-        ))
-    valid_paths = [p for p, valid in zip(file_paths, valid_mask) if valid]
-    
-    # 第二阶段：处理有效文件
-    tables = []
-    for path in valid_paths:
-        try:
-            table = pa_csv.read_csv(
-                path,
-                convert_options=ConvertOptions(
-                    include_columns=required_cols,
-                    column_types=column_types
-                )
-            )
-            tables.append(table)
-        except Exception as e:
-            logging.error(f"Failed to process {path}: {e}")
-    
-    return pa.concat_tables(tables).to_pandas() if tables else pd.DataFrame()
@@ -1,4 +1,17 @@
 import pandas as pd
+import pyarrow.dataset as ds
+
+from lookup_index import LookupIndex
+from partitioned_join import A_UNMATCHED, B_UNMATCHED, JOINED, partitioned_fallback_join
+
+# Set to True when df_a/df_b do not fit in memory (e.g. df_a built from a month of CSVs);
+# df_a/df_b may then also be chunk iterators such as stream_reader.iter_batches(...)
+OUT_OF_CORE = False
+OUTPUT_DIR = 'fallback_join_output'
+# Key -> 'a', 'b', 'c' lookup index over df_a; bump REFERENCE_VERSION (or pass e.g. a file mtime watermark)
+# whenever df_a changes
+INDEX_DIR = 'df_a_lookup_index'
+REFERENCE_VERSION = '1'
 
 # Sample data frames for demonstration (replace these with your actual data)
 # df_a = pd.DataFrame({
@@ -16,23 +29,34 @@ import pandas as pd
 #     'value_b': ['VB1', 'VB2', 'VB3']
 # })
 
-# Step 1: Perform the initial left join between df_a and df_b on ['key', 'sub_group']
-result_df = df_a.merge(df_b, how='left', on=['key', 'sub_group'])
+if OUT_OF_CORE:
+    # Hash-partition both sides by 'key' to disk, then run each partition pair in a process pool
+    for partition, outputs in partitioned_fallback_join(df_a, df_b, keys=['key', 'sub_group'], fallback_keys=['key'],
+                                                        output_dir=OUTPUT_DIR, attrs=['a', 'b', 'c']):
+        print(f"Partition {partition} done: {outputs}")
+    result_df, df_b_unmatched, df_a_unmatched = (
+        ds.dataset(f"{OUTPUT_DIR}/{name}", format='parquet').to_table().to_pandas()
+        for name in (JOINED, B_UNMATCHED, A_UNMATCHED)
+    )
+else:
+    # Step 1: Perform the initial left join between df_a and df_b on ['key', 'sub_group']
+    result_df = df_a.merge(df_b, how='left', on=['key', 'sub_group'])
 
-# Step 2: Identify unmatched records in df_b after the initial join
-df_b_unmatched = df_b.merge(df_a[['key', 'sub_group']], on=['key', 'sub_group'], how='left', indicator=True)
-df_b_unmatched = df_b_unmatched[df_b_unmatched['_merge'] == 'left_only'].drop(columns=['_merge'])
+    # Step 2: Identify unmatched records in df_b after the initial join
+    df_b_unmatched = df_b.merge(df_a[['key', 'sub_group']], on=['key', 'sub_group'], how='left', indicator=True)
+    df_b_unmatched = df_b_unmatched[df_b_unmatched['_merge'] == 'left_only'].drop(columns=['_merge'])
 
-# Step 3: For unmatched df_b records, remove 'sub_group' from join keys and match on 'key' only to get 'a', 'b', 'c' from df_a
-# Since 'a', 'b', 'c' are the same for the same 'key', we can drop duplicates
-df_a_unique = df_a[['key', 'a', 'b', 'c']].drop_duplicates(subset='key')
+    # Step 3: For unmatched df_b records, remove 'sub_group' from join keys and match on 'key' only to get 'a', 'b', 'c' from df_a
+    # Since 'a', 'b', 'c' are the same for the same 'key', a persistent key -> attribute index is built once
+    # (first row per 'key') and only rebuilt when REFERENCE_VERSION changes
+    index = LookupIndex.open_or_build(INDEX_DIR, df_a, ['key'], ['a', 'b', 'c'], source_version=REFERENCE_VERSION)
 
-# Merge unmatched df_b records with df_a_unique on 'key'
-df_b_unmatched = df_b_unmatched.merge(df_a_unique, on='key', how='left')
+    # Look up 'a', 'b', 'c' for the unmatched df_b records without a merge
+    df_b_unmatched = df_b_unmatched.join(index.lookup(df_b_unmatched[['key']]))
 
-# Step 4: Output df_a's all columns and 'a', 'b', 'c' for unmatched records
-# Get df_a records corresponding to unmatched df_b records (matched on 'key' only)
-df_a_unmatched = df_a[df_a['key'].isin(df_b_unmatched['key'])].drop_duplicates(subset='key')
+    # Step 4: Output df_a's all columns and 'a', 'b', 'c' for unmatched records
+    # Get df_a records corresponding to unmatched df_b records (matched on 'key' only)
+    df_a_unmatched = df_a[df_a['key'].isin(df_b_unmatched['key'])].drop_duplicates(subset='key')
 
 # Display the results
 print("Result after initial left join (df_a left join df_b on ['key', 'sub_group']):")
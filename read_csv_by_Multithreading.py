@@ -1,19 +1,19 @@
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor
 import glob
 
-# List CSV files
-csv_files = glob.glob("data/*.csv")
+from stream_reader import read_table
 
-# Function to read a single CSV
-def read_csv(file):
-    return pd.read_csv(file)
+# Guard required: the reader uses a process pool
+if __name__ == "__main__":
+    # List CSV files
+    csv_files = glob.glob("data/*.csv")
 
-# Use multithreading to read files in parallel
-with ThreadPoolExecutor() as executor:
-    dfs = list(executor.map(read_csv, csv_files))
+    # Read files in parallel, scheduled by file size: large files are parsed one at a
+    # time with Arrow's multithreaded reader, small files are packed into batches per
+    # process task (see scheduler.py)
+    table = read_table(csv_files, None, None)
 
-# Concatenate dataframes
-df = pd.concat(dfs, ignore_index=True)
+    # Convert to pandas once at the end
+    df = table.to_pandas() if table is not None else pd.DataFrame()
 
-print(df.head())
+    print(df.head())
@@ -0,0 +1,92 @@
+import logging
+import time
+from typing import Iterable, List, Tuple
+
+from compressed import decompressed_size
+
+logger = logging.getLogger(__name__)
+
+# Constants
+LARGE_FILE_BYTES = 256 * 1024 ** 2   # 超过该大小的文件单独成任务，并启用 Arrow 多线程解析
+TASK_TARGET_BYTES = 64 * 1024 ** 2   # 小文件按该目标大小打包成一个进程任务
+MAX_FILES_PER_TASK = 256             # 单个任务最多包含的文件数
+LARGE_TASK_CONCURRENCY = 2           # 大文件任务自身已多线程解析，只允许少量并发以重叠 I/O
+
+
+def file_size(file_path: str) -> int:
+    """解析工作量按解压后大小计（压缩文件见 compressed.decompressed_size）"""
+    try:
+        return decompressed_size(file_path)
+    except OSError:
+        return 0
+
+
+def plan_tasks(
+    file_paths: Iterable[str],
+    large_threshold: int = LARGE_FILE_BYTES,
+    target_bytes: int = TASK_TARGET_BYTES,
+    max_files: int = MAX_FILES_PER_TASK,
+    min_tasks: int = 1
+) -> Tuple[List[Tuple[str, int]], List[List[Tuple[str, int]]]]:
+    """
+    按文件大小划分任务
+    :param min_tasks: 小文件至少拆成的批次数（数据量较小时缩小每批目标字节数，保证并行度）
+    :return: (大文件列表, 小文件批次列表)，元素均为 (path, size)，按大小降序排列
+             大文件先执行（LPT），小文件批次按目标字节数贪心打包，摊薄单任务开销
+    """
+    sized = sorted(((p, file_size(p)) for p in file_paths), key=lambda x: x[1], reverse=True)
+    large = [item for item in sized if item[1] >= large_threshold]
+    small_bytes = sum(size for _, size in sized[len(large):])
+    target_bytes = max(1, min(target_bytes, small_bytes // max(1, min_tasks)))
+    batches: List[List[Tuple[str, int]]] = []
+    batch: List[Tuple[str, int]] = []
+    batch_bytes = 0
+    for item in sized[len(large):]:
+        if batch and (batch_bytes + item[1] > target_bytes or len(batch) >= max_files):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += item[1]
+    if batch:
+        batches.append(batch)
+    return large, batches
+
+
+class ThroughputTuner:
+    """
+    根据观测吞吐（字节/秒）调整并发任务上限的爬山调节器
+    每完成 window 个任务评估一次：吞吐提升则沿原方向继续调整，下降则反向
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: int = None, window: int = 4):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, initial or self.max_limit))
+        self.window = window
+        self._direction = -1 if self.limit == self.max_limit else 1
+        self._last_rate = None
+        self._bytes = 0
+        self._tasks = 0
+        self._window_start = time.perf_counter()
+
+    def record(self, nbytes: int):
+        """记录一个已完成任务处理的字节数"""
+        self._bytes += nbytes
+        self._tasks += 1
+        if self._tasks < self.window:
+            return
+        elapsed = time.perf_counter() - self._window_start
+        rate = self._bytes / elapsed if elapsed > 0 else 0.0
+        if self._last_rate is not None and rate < self._last_rate:
+            self._direction = -self._direction
+        self._last_rate = rate
+        new_limit = min(self.max_limit, max(self.min_limit, self.limit + self._direction))
+        if new_limit != self.limit:
+            logger.debug(f"Concurrency {self.limit} -> {new_limit} ({rate / 1024 ** 2:.1f} MB/s)")
+        elif self.limit in (self.min_limit, self.max_limit):
+            # 到达边界后下次评估朝另一方向探测
+            self._direction = 1 if self.limit == self.min_limit else -1
+        self.limit = new_limit
+        self._bytes = 0
+        self._tasks = 0
+        self._window_start = time.perf_counter()
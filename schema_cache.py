@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "csv_catalog" / "schema_cache.sqlite3"
+SNIFF_BYTES = 8 * 1024             # 首次读取的字节数
+MAX_HEADER_BYTES = 4 * 1024 ** 2   # 表头行最长允许读取的字节数
+
+PathLike = Union[str, Path]
+
+
+def _open_head(file_path: PathLike):
+    if str(file_path).lower().endswith(('.gz', '.zst')):
+        # 延迟导入：未压缩文件的表头检查不需要加载 pyarrow
+        from compressed import open_input
+        return open_input(file_path)
+    return open(file_path, 'rb')
+
+
+def sniff_header(file_path: PathLike, nbytes: int = SNIFF_BYTES) -> Optional[List[str]]:
+    """
+    仅读取文件开头若干 KB 解析表头（不解析任何数据行）；.csv.gz / .csv.zst 只解压开头的若干 KB
+    :return: 列名列表；空文件或读取失败时返回 None
+    """
+    try:
+        with _open_head(file_path) as f:
+            head = f.read(nbytes)
+            # 表头超过一个块时继续读，直到遇到换行
+            while b'\n' not in head and len(head) < MAX_HEADER_BYTES:
+                more = f.read(nbytes)
+                if not more:
+                    break
+                head += more
+    except (OSError, ValueError) as e:  # 压缩数据损坏时 Arrow 抛出 ArrowInvalid（ValueError 的子类）
+        logger.debug(f"Header sniff failed for {file_path}: {e}")
+        return None
+
+    line = head.split(b'\n', 1)[0].rstrip(b'\r')
+    if not line.strip():
+        return None
+    text = line.decode('utf-8-sig', errors='replace')
+    return next(csv.reader(io.StringIO(text)), None) or None
+
+
+class SchemaCache:
+    """
+    表头缓存：以 (path, size, mtime) 为键保存列名
+    文件未变化时直接命中缓存，必需列过滤退化为一次查表
+    """
+
+    def __init__(self, db_path: Optional[PathLike] = None):
+        self.db_path = Path(db_path) if db_path is not None else DEFAULT_CACHE_PATH
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS schemas ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, columns TEXT)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def get_columns(self, file_path: PathLike) -> Optional[List[str]]:
+        """返回文件列名；缓存未命中或文件已变化时重新嗅探表头"""
+        path = str(file_path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logger.debug(f"Stat failed for {path}: {e}")
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, columns FROM schemas WHERE path = ?", (path,)
+            ).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            self.hits += 1
+            return json.loads(row[2]) if row[2] is not None else None
+
+        self.misses += 1
+        columns = sniff_header(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO schemas (path, size, mtime_ns, columns) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, json.dumps(columns) if columns is not None else None)
+            )
+        return columns
+
+    def has_columns(self, file_path: PathLike, required_cols: Iterable[str]) -> bool:
+        columns = self.get_columns(file_path)
+        return columns is not None and set(required_cols).issubset(columns)
+
+    def filter_paths(self, file_paths: Iterable[PathLike], required_cols: Iterable[str]) -> List[PathLike]:
+        """保留表头包含全部必需列的文件"""
+        required: Set[str] = set(required_cols)
+        return [p for p in file_paths if self.has_columns(p, required)]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_default_cache: Optional[SchemaCache] = None
+_default_lock = threading.Lock()
+
+
+def default_schema_cache() -> SchemaCache:
+    """进程级共享的默认缓存（位于 ~/.cache/csv_catalog）"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = SchemaCache()
+        return _default_cache
@@ -0,0 +1,408 @@
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.ipc as ipc
+
+from chunked_reader import (DEFAULT_BLOCK_SIZE, RANGE_TARGET_BYTES, open_csv_stream,
+                            split_byte_ranges, types_declared, write_stream_ipc)
+from compressed import compression_of, open_csv_source
+from instrumentation import PipelineMetrics, ProfileOptions, peak_rss_mb
+from predicates import Filter, read_columns, to_expression
+from scheduler import LARGE_TASK_CONCURRENCY, ThroughputTuner, file_size, plan_tasks
+from schema_cache import SchemaCache, default_schema_cache, sniff_header
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3  # 在途（已提交但尚未被消费）结果的内存上限
+MEMORY_EXPANSION = 2.0                 # CSV 文件大小 -> 内存占用的估算系数
+SHM_DIR = "/dev/shm"
+PARSE_ERRORS = (pa.ArrowInvalid, UnicodeDecodeError)  # 由文件内容本身导致、重试也不会成功的错误
+CSV_PARSE_ERROR = "CSV parse error"             # 行列数不一致、引号未闭合等 CSV 结构错误
+CSV_CONVERSION_ERROR = "CSV conversion error"   # 值无法转换为列类型（也可能是调用方声明的类型有误）
+
+
+def is_parse_error(error: BaseException) -> bool:
+    """
+    是否为文件内容本身导致的解析/解码错误
+    谓词引用了不存在的列（No match for FieldRef）等同属 ArrowInvalid，但属于调用方错误，不计入
+    """
+    if isinstance(error, UnicodeDecodeError):
+        return True
+    return isinstance(error, PARSE_ERRORS) and (CSV_PARSE_ERROR in str(error) or CSV_CONVERSION_ERROR in str(error))
+
+
+def default_spill_dir() -> str:
+    """worker 结果的落地目录：优先使用共享内存 tmpfs，其次系统临时目录"""
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+
+def _stage(metrics: Optional[PipelineMetrics], name: str):
+    return metrics.stage(name) if metrics is not None else nullcontext()
+
+
+def read_csv_table(
+    file_path: str,
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    use_threads: bool = False
+) -> pa.Table:
+    """读取单个文件为 Arrow Table（不转换为 pandas）；.csv.gz / .csv.zst 流式解压"""
+    # 进程池中默认关闭PyArrow多线程以避免争抢CPU；大文件单独任务时再开启
+    return pv.read_csv(
+        open_csv_source(file_path, use_threads),
+        read_options=pv.ReadOptions(use_threads=use_threads),
+        convert_options=pv.ConvertOptions(
+            column_types=column_types,
+            include_columns=columns_list
+        )
+    )
+
+
+def write_ipc(table: pa.Table, spill_dir: str) -> str:
+    """把 Table 写成 spill_dir 下的临时 Arrow IPC 文件，返回路径"""
+    fd, ipc_path = tempfile.mkstemp(prefix="csv_", suffix=".arrow", dir=spill_dir)
+    os.close(fd)
+    try:
+        with pa.OSFile(ipc_path, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    except BaseException:
+        os.unlink(ipc_path)
+        raise
+    return ipc_path
+
+
+def write_filtered_ipc(
+    file_path: str,
+    columns_list: Optional[List[str]],
+    column_types: Dict[str, str],
+    expr: Optional[pc.Expression],
+    spill_dir: str,
+    use_threads: bool = False,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    byte_range: Optional[Tuple[int, int]] = None
+) -> str:
+    """
+    流式读取单个文件（或其中一个字节范围）：逐块求值谓词后只把保留的行写入 IPC 文件
+    额外读取谓词引用的列，写出前再投影回 columns_list；worker 内存只保留当前块
+    """
+    header = sniff_header(file_path) or []
+    reader = open_csv_stream(file_path, columns_list, column_types, block_size, use_threads,
+                             byte_range=byte_range, header=header, expr=expr)
+    return write_stream_ipc(reader, spill_dir, columns_list, expr)
+
+
+def read_csv_batch_ipc(
+    file_paths: List[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    spill_dir: str,
+    use_threads: bool = False,
+    expr: Optional[pc.Expression] = None,
+    profile: Optional[ProfileOptions] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    byte_range: Optional[Tuple[int, int]] = None
+) -> List[Tuple[str, Optional[str], Optional[str], dict]]:
+    """
+    进程池 worker：读取一批文件，每个文件写成一个 Arrow IPC 文件，只把路径传回父进程
+    避免 DataFrame 的 pickle 序列化及跨进程的整份拷贝；单个文件失败不影响同批其他文件
+    提供 expr 时在 worker 内逐批过滤，不满足谓词的行不会跨进程传输
+    大文件（use_threads）、带谓词或指定 byte_range 时以 memory_map + 流式读取器按 block_size 逐块解析；
+    流式读取要求读取涉及的列类型全部声明（见 chunked_reader.types_declared），否则整文件读取后再过滤
+    :param profile: 按文件采样 cProfile（见 instrumentation.ProfileOptions）
+    :param byte_range: 只解析单个文件的 [start, end) 字节范围（见 chunked_reader.split_byte_ranges）
+    :return: [(源文件, IPC 文件路径 或 None, 错误信息 或 None, 统计)]
+             统计包括 pid、开始/结束时间、文件字节数、解析与 IPC 写出耗时、worker RSS 峰值；
+             失败时另含 error_type（异常类名）与 parse_error（见 is_parse_error）
+    """
+    results = []
+    for file_path in file_paths:
+        stats = {"pid": os.getpid(), "started": time.time(), "parse_s": 0.0, "write_s": 0.0}
+        try:
+            stats["bytes"] = os.path.getsize(file_path) if byte_range is None else byte_range[1] - byte_range[0]
+            with profile.profile(file_path) if profile is not None else nullcontext():
+                start = time.perf_counter()
+                header = sniff_header(file_path) or []
+                # 流式读取按第一个块推断未声明的列类型，列类型未全部声明时改为整文件读取
+                stream = byte_range is not None or (
+                    (use_threads or expr is not None) and types_declared(header, columns_list, column_types, expr)
+                )
+                if not stream:
+                    table = read_csv_table(file_path, read_columns(columns_list, expr, header), column_types,
+                                           use_threads)
+                    if expr is not None:
+                        table = table.filter(expr)
+                        if columns_list:
+                            table = table.select(columns_list)
+                    stats["parse_s"] = time.perf_counter() - start
+                    ipc_path = write_ipc(table, spill_dir)
+                    stats["write_s"] = time.perf_counter() - start - stats["parse_s"]
+                else:
+                    # 流式读取时解析与写出交替进行，耗时一并计入 parse
+                    ipc_path = write_filtered_ipc(file_path, columns_list, column_types, expr, spill_dir,
+                                                  use_threads, block_size, byte_range)
+                    stats["parse_s"] = time.perf_counter() - start
+            error = None
+        except Exception as e:
+            ipc_path, error = None, f"{type(e).__name__}: {e}"
+            stats["error_type"] = type(e).__name__
+            stats["parse_error"] = is_parse_error(e)
+        stats["finished"] = time.time()
+        stats["rss_mb"] = peak_rss_mb()["self"]
+        results.append((file_path, ipc_path, error, stats))
+    return results
+
+
+def load_ipc(ipc_path: str) -> pa.Table:
+    """以内存映射方式零拷贝加载 worker 写出的 IPC 文件，并立即删除目录项"""
+    table = ipc.open_file(pa.memory_map(ipc_path)).read_all()
+    try:
+        # 映射在 Table 的缓冲区释放前保持有效，文件空间随之回收
+        os.unlink(ipc_path)
+    except OSError as e:
+        logger.debug(f"Could not remove spill file {ipc_path}: {e}")
+    return table
+
+
+def iter_file_tables(
+    file_paths: Iterable[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    schema_cache: Optional[SchemaCache] = None,
+    expansion: float = MEMORY_EXPANSION,
+    spill_dir: Optional[str] = None,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True,
+    executor: Optional[ProcessPoolExecutor] = None,
+    on_error: Optional[Callable[[str, str, bool], None]] = None
+) -> Iterator[Tuple[str, pa.Table]]:
+    """
+    按完成顺序产出每个文件的 (源文件路径, Arrow Table)（iter_batches / read_table 的公共实现）
+    调度：大文件先行且单独成任务、开启 Arrow 多线程；小文件按字节数打包成批，
+    批任务的并发上限由 ThroughputTuner 根据观测吞吐动态调整
+    :param metrics: 记录各阶段耗时、文件计数、worker 排队/忙碌时间（见 instrumentation.py）
+    :param block_size: 大文件流式解析的块大小
+    :param split_bytes: 不小于该大小的文件按换行边界拆成多个字节范围，由多个 worker 并行解析；
+                        此时同一文件会产出多个 Table。默认不拆分（每个文件恰好一个 Table）。
+                        只有调用方保证 newlines_in_values=False（字段值内没有换行）且读取涉及的列类型
+                        全部在 column_types 中声明时才拆分，否则按整文件读取
+    :param newlines_in_values: 字段值中是否可能含有（引号内的）换行；为 True 时不拆分
+    :param executor: 复用调用方的常驻进程池（例如 ingest_service），结束时只取消本次提交的任务，不关闭进程池
+    :param on_error: 单个文件失败时以 (源文件, 错误信息, 是否为解析/解码错误) 回调（例如 checkpoint 的隔离列表）；
+                     整批任务失败时对批内每个文件回调，解析/解码错误标记为 False
+    进程池损坏（worker 被杀）时抛出 BrokenProcessPool，不再继续提交；传入的 executor 需由调用方重建
+    """
+    expr = to_expression(filters)
+    cache = schema_cache or default_schema_cache()
+    required_cols = set(columns_list or ())
+    file_paths = list(file_paths)
+    with _stage(metrics, "header_check"):
+        valid_paths = [p for p in file_paths if cache.has_columns(p, required_cols)]
+    if metrics is not None:
+        metrics.count("files_scanned", len(file_paths))
+        valid = set(valid_paths)
+        for p in file_paths:
+            if p not in valid:
+                metrics.record_file(p, {}, "skipped", "missing required columns")
+    if not valid_paths:
+        return
+
+    pool_size = max_workers or os.cpu_count() or 1
+    with _stage(metrics, "plan"):
+        split, rest = [], valid_paths
+        if split_bytes is not None and newlines_in_values:
+            logger.debug("Not splitting files into byte ranges: values may contain newlines")
+        elif split_bytes is not None:
+            sizes = {p: file_size(p) for p in valid_paths}
+            # 压缩文件无法按字节范围拆分；seekable zstd 大文件改为在单个任务内多线程解压 + 解析
+            # 各范围独立推断类型，未声明类型的列可能在范围之间推断不一致，这类文件不拆分
+            splittable = {p for p in valid_paths if sizes[p] >= split_bytes and compression_of(p) is None
+                          and types_declared(cache.get_columns(p) or [], columns_list, column_types, expr)}
+            split = [p for p in valid_paths if p in splittable]
+            rest = [p for p in valid_paths if p not in splittable]
+        large, batches = plan_tasks(rest, min_tasks=pool_size * 4)
+        tasks = deque()
+        for p in split:
+            # 范围数至少与 worker 数相同；单个范围在 worker 内单线程解析，范围之间按普通任务并发
+            target = max(block_size, min(RANGE_TARGET_BYTES, -(-sizes[p] // pool_size)))
+            tasks.extend(([p], end - start, False, (start, end)) for start, end in split_byte_ranges(p, target))
+        tasks.extend(([p], size, True, None) for p, size in large)
+        tasks.extend(([p for p, _ in batch], sum(size for _, size in batch), False, None) for batch in batches)
+    max_workers = min(pool_size, len(tasks))
+    tuner = ThroughputTuner(max_workers)
+    spill_dir = spill_dir or default_spill_dir()
+    logger.info(f"Streaming {len(valid_paths)} files ({len(split)} split into ranges, {len(large)} large, "
+                f"{len(batches)} batches) "
+                f"with {max_workers} workers (memory budget {memory_budget / 1024 ** 2:.0f}MB)")
+
+    in_flight = {}
+    in_flight_bytes = 0
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while tasks or in_flight:
+            # 提交任务直到达到并发上限或内存预算（至少保证一个任务在途）
+            while tasks:
+                paths, size, is_large, byte_range = tasks[0]
+                limit = LARGE_TASK_CONCURRENCY if is_large else tuner.limit
+                cost = max(1, int(size * expansion))
+                if in_flight and (len(in_flight) >= limit or in_flight_bytes + cost > memory_budget):
+                    break
+                tasks.popleft()
+                future = executor.submit(read_csv_batch_ipc, paths, columns_list, column_types,
+                                         spill_dir, is_large, expr, metrics.profile if metrics else None,
+                                         block_size, byte_range)
+                in_flight[future] = (paths, size, cost, is_large, time.time())
+                in_flight_bytes += cost
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                paths, size, cost, is_large, submitted = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"Failed processing {len(paths)} files starting at {paths[0]}: {e}")
+                    for file_path in paths:
+                        if metrics is not None:
+                            metrics.record_file(file_path, {}, "failed", str(e))
+                        if on_error is not None:
+                            on_error(file_path, f"{type(e).__name__}: {e}", False)
+                    in_flight_bytes -= cost
+                    if isinstance(e, BrokenProcessPool):
+                        raise
+                    continue
+                if not is_large:
+                    tuner.record(size)
+                if metrics is not None and results:
+                    metrics.record_task({"pid": results[0][3]["pid"], "started": results[0][3]["started"],
+                                         "finished": results[-1][3]["finished"],
+                                         "rss_mb": max(r[3]["rss_mb"] or 0 for r in results)}, submitted)
+
+                loaded = []
+                for file_path, ipc_path, error, stats in results:
+                    if error is not None:
+                        logger.error(f"Failed processing {file_path}: {error}")
+                        if metrics is not None:
+                            metrics.record_file(file_path, stats, "failed", error)
+                        if on_error is not None:
+                            on_error(file_path, error, stats.get("parse_error", False))
+                        continue
+                    try:
+                        with _stage(metrics, "ipc_load"):
+                            table = load_ipc(ipc_path)
+                        loaded.append((file_path, table))
+                        if metrics is not None:
+                            metrics.record_file(file_path, dict(stats, rows=table.num_rows), "ok")
+                    except Exception as e:
+                        logger.error(f"Failed loading result of {file_path}: {e}")
+                        if metrics is not None:
+                            metrics.record_file(file_path, stats, "failed", str(e))
+                in_flight_bytes -= cost
+                for item in loaded:
+                    yield item
+                del loaded
+    finally:
+        # 调用方提前停止迭代时取消尚未开始的任务，并清理已写出但未加载的结果
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in in_flight:
+                future.cancel()
+            wait(in_flight)
+        for future in in_flight:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                for _, ipc_path, _, _ in future.result():
+                    if ipc_path is not None:
+                        try:
+                            os.unlink(ipc_path)
+                        except OSError:
+                            pass
+
+
+def iter_batches(
+    file_paths: Iterable[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    as_pandas: bool = False,
+    schema_cache: Optional[SchemaCache] = None,
+    expansion: float = MEMORY_EXPANSION,
+    spill_dir: Optional[str] = None,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True
+) -> Iterator[Union[pa.RecordBatch, pd.DataFrame]]:
+    """
+    按完成顺序流式产出读取结果，内存占用有上界
+    :param memory_budget: 在途结果的估算字节上限；达到上限后暂停提交新任务（背压），
+                          直到调用方消费掉已完成的结果。至少保证一个任务在途。
+    :param as_pandas: True 时每个文件产出一个 DataFrame，否则产出 Arrow RecordBatch
+    :param expansion: 以 文件大小 * expansion 估算单个结果的内存占用
+    :param spill_dir: worker 结果 IPC 文件的目录，默认 /dev/shm
+    :param filters: 行谓词（pyarrow.compute.Expression 或 DNF 元组列表），在 worker 内逐批求值
+    :param metrics / block_size / split_bytes / newlines_in_values: 见 iter_file_tables；
+        拆分大文件需显式传入 split_bytes（例如 SPLIT_FILE_BYTES）与 newlines_in_values=False，
+        as_pandas 时每个字节范围产出一个 DataFrame
+    """
+    for _, table in iter_file_tables(file_paths, columns_list, column_types, max_workers,
+                                     memory_budget, schema_cache, expansion, spill_dir, filters, metrics,
+                                     block_size, split_bytes, newlines_in_values):
+        if as_pandas:
+            with _stage(metrics, "to_pandas"):
+                df = table.to_pandas(split_blocks=True, self_destruct=True)
+            yield df
+        else:
+            yield from table.to_batches()
+
+
+def read_table(
+    file_paths: Iterable[str],
+    columns_list: List[str],
+    column_types: Dict[str, str],
+    max_workers: int = None,
+    schema_cache: Optional[SchemaCache] = None,
+    spill_dir: Optional[str] = None,
+    filters: Optional[Filter] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    split_bytes: Optional[int] = None,
+    newlines_in_values: bool = True
+) -> Optional[pa.Table]:
+    """
+    读取全部文件并拼接为一个 Arrow Table（零拷贝拼接）
+    需要 pandas 时调用方只做一次 to_pandas(self_destruct=True)
+    提供 split_bytes 且 newlines_in_values=False 时，超过 split_bytes 的文件拆成字节范围并行解析（见 iter_file_tables）
+    :return: 没有可读文件时返回 None
+    """
+    # 结果全部保留在内存中，内存预算不起作用
+    tables = [table for _, table in iter_file_tables(
+        file_paths, columns_list, column_types, max_workers,
+        memory_budget=float("inf"), schema_cache=schema_cache, spill_dir=spill_dir, filters=filters,
+        metrics=metrics, block_size=block_size, split_bytes=split_bytes, newlines_in_values=newlines_in_values
+    )]
+    if not tables:
+        return None
+    with _stage(metrics, "concat"):
+        return pa.concat_tables(tables, promote_options="permissive")